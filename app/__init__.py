@@ -1,7 +1,13 @@
 #!/usr/bin/env python
+"""
+One time setup of the NLTK resources used by the app, e.g. when the docker image is built.
+Resources are downloaded into app/nltk_data (or NLTK_DATA_DIR) and loaded from there on first use,
+the app itself does not download anything.
+"""
 
-import nltk
-nltk.download('stopwords')
-nltk.download('punkt')
-# download lexicon for vader sentiment analyzer
-nltk.download("vader_lexicon")
+import sys
+
+from src import nlp
+
+if __name__ == "__main__":
+    sys.exit(0 if nlp.download_resources() else 1)
@@ -1,11 +1,10 @@
 
 import os
-import random
 import time
-from src import utils
+from src import utils, tmdbutils, db, jobs, cache, metrics, snapshot
 
 import streamlit as st
-import sqlalchemy as sa
+import pandas as pd
 
 # Set page confiuration. Must be the first execution in the app/page
 st.set_page_config(
@@ -24,7 +23,12 @@ def init_connection():
 
     # return psycopg2.connect(**st.secrets["postgres"])
 
-    return sa.create_engine(f"postgresql://{os.environ['POSTGRES_USER']}:{os.environ['POSTGRES_PASSWORD']}@{os.environ['POSTGRES_HOST']}/{os.environ['POSTGRES_DB']}")
+    engine = db.engine_from_env()
+
+    # create or update DB tables
+    db.migrate(engine)
+
+    return engine
 
 # Initialize Db connection
 conn = init_connection()
@@ -32,12 +36,40 @@ conn = init_connection()
 #Read TMDB api key
 tmdb_key = os.environ['TMDB_KEY'] #st.secrets['tmdb']['TMDB_KEY']
 
+# seconds between checks of a running update
+JOB_STATUS_POLL = float(os.environ.get("JOB_STATUS_POLL", 2))
+# True to show stage timings of the last update and the current page run in the sidebar
+SHOW_METRICS = os.environ.get("SHOW_METRICS", "1") == "1"
+
+# Log stage timings and serve them at /metrics if METRICS_PORT is set
+@st.experimental_singleton
+def init_metrics():
+    metrics.setup_logging()
+
+    if metrics.METRICS_PORT:
+        return metrics.start_http_server()
+
+init_metrics()
+
+# Start a worker thread for the updates of movies, unless they are run by a separate worker process (worker.py)
+@st.experimental_singleton
+def init_worker():
+    if os.environ.get("BACKGROUND_WORKER", "thread") == "external":
+        return None
+
+    return jobs.start_worker_thread(conn, tmdb_key)
+
+init_worker()
+
 # Load CSS to hide dataframe index column
 # utils.load_css()
 
-def main():
+def main(rerun: metrics.Recorder = None):
     """
     Sentiment analysis app based on reviews of the daily popular movies list on The moview database
+
+    Args:
+        rerun (Recorder, optional): stage timings of the current page run for the debug panel. Defaults to None
     """
 
     hc1, hc2 = st.columns([3,1])
@@ -87,43 +119,70 @@ def main():
         st.write(""" Movie review sentiment analysis based on [VADER 
                     (Valence Aware Dictionary and sEntiment Reasoner)](https://github.com/cjhutto/vaderSentiment#python-demo-and-code-examples)
                     using [NLTK](https://www.nltk.org/) package """)
-    # update table if button is clicked        
+    # queue an update if button is clicked, updates run in the background worker
     if update_movie_bt:
-        with st.spinner("Please wait while we fetch updated movies from TMDB..."):
-            start = time.perf_counter()
-            utils.update_tmdb_pop_movies_sentiments(
-                        con = conn,
-                        tmdb_key = tmdb_key,
-                        thresh = threshold,
-                        stwords = rm_sw,
-                        hyperlinks = rm_hl
-                    )
+        jobs.enqueue_refresh(conn, incremental = True)
+
+    with hc2:
+        latest_job = jobs.get_latest_job(conn)
+        job_running = show_job_status(latest_job)
 
-        st.success(f" Movies successfully updated in {int(time.perf_counter() - start)} seconds!")
     try:
-        movie_overview, tot_movies = utils.get_movies_overview(con= conn)
+        movie_overview, tot_movies = utils.get_movies_overview(
+                                        con= conn,
+                                        thresh = threshold,
+                                        stwords = rm_sw,
+                                        hyperlinks = rm_hl
+                                    )
     except:
-        # update DB in case there is no initial data
-        with st.spinner("Please wait while we initialize the DB with initial movies list. It won't take long ..."):
-            start = time.perf_counter()
-            utils.update_tmdb_pop_movies_sentiments(con=conn, 
-                                            tmdb_key= tmdb_key, 
-                                            stwords = rm_sw,
-                                            hyperlinks = rm_hl
-                                        )
-
-        st.success(f" DB successfully initialized in {int(time.perf_counter() - start)} seconds!\n Enjoy the app!")
-    # update sentiments based on new threshold
-    utils.update_sentiments(
-                    con = conn,
-                    thresh = threshold,
-                    stwords = rm_sw,
-                    hyperlinks = rm_hl
-                    )
-    
-    
-    # get movie overview infrom from DB
-    movie_overview, tot_movies = utils.get_movies_overview(con= conn)
+        tot_movies = 0
+
+    if tot_movies == 0 and db.has_movies(conn):
+        # movies are stored but not in the overview, e.g. none of them has a director and lead actor or the overview was not refreshed.
+        # Refreshing it is enough, a running update refreshes it when it is done
+        if not job_running:
+            db.refresh_overview(conn)
+            cache.invalidate()
+
+    elif tot_movies == 0:
+        # initialize DB in case there is no initial data. A failed initialization is shown with the update status,
+        # update button retries it
+        latest_job = jobs.get_latest_job(conn)
+        if latest_job is not None and latest_job["status"] == "failed":
+            st.stop()
+
+        # warm start from the latest snapshot, an incremental update then catches up with TMDB
+        if snapshot.WARM_START and snapshot.latest_snapshot() is not None:
+            try:
+                manifest = snapshot.warm_start(conn)
+            except snapshot.SnapshotError as e:
+                st.warning(f"Snapshot could not be loaded, movies are loaded from TMDB : {e}")
+            else:
+                if manifest is not None:
+                    jobs.enqueue_refresh(conn, incremental= True)
+                    st.experimental_rerun()
+
+                # another session is loading the snapshot or an update is running
+                ovr_table.info("Please wait while we load the latest snapshot of movies ...")
+                wait_for_job()
+
+        # a finished update without movies is not repeated on every page run
+        if latest_job is not None and latest_job["status"] == "done":
+            ovr_table.info("No popular movies were loaded from TMDB, use Update movies to try again")
+            st.stop()
+
+        jobs.enqueue_refresh(conn, incremental= False)
+
+        ovr_table.info("Please wait while we initialize the DB with initial movies list. It won't take long ...")
+        wait_for_job()
+    # get movie overview infrom from DB, sentiments are classified for the settings of this session only
+    with metrics.timer("render_overview"):
+        movie_overview, tot_movies = utils.get_movies_overview(
+                                        con= conn,
+                                        thresh = threshold,
+                                        stwords = rm_sw,
+                                        hyperlinks = rm_hl
+                                    )
 
     movie_overview.columns = [" ".join(c.split("_")).capitalize() for c in movie_overview.columns]
 
@@ -139,6 +198,17 @@ def main():
     st.sidebar.write("### Total Movies : ",tot_movies)
     st.sidebar.write("### Movies with reviews : ",len(movie_overview))
     st.sidebar.write("---")
+
+    # e.g. none of the popular movies has reviews, there is no movie to select
+    if len(movie_overview) == 0:
+        if tot_movies == 0:
+            st.info("None of the popular movies has a director and lead actor yet")
+        else:
+            st.info("None of the popular movies has reviews yet")
+        if job_running:
+            wait_for_job()
+        st.stop()
+
     # sidebar movie selection for full reviews
     movie_index = st.sidebar.selectbox("Select a movie for detailed reviews",
                      options= movie_overview.index,
@@ -151,7 +221,7 @@ def main():
     st.sidebar.markdown(f"**Genre** : {movie_genres.loc[movie_index,'Genre']}")
     
     # image of the selected movie
-    st.sidebar.image(utils.get_movie_img_url(
+    st.sidebar.image(utils.get_movie_poster(
                     m_id = movie_overview.loc[movie_index,'Id'] , 
                     con = conn
                     )
@@ -161,14 +231,163 @@ def main():
     st.write("#### Review sentiments for : ",
                  f"*{movie_overview.loc[movie_index,'Title']}*"
             )
-    m_reviews_df = utils.get_movie_reviews(
-                        m_id = movie_overview.loc[movie_index,'Id'],
-                        con = conn)
+    with metrics.timer("render_reviews"):
+        show_reviews(
+            m_id = movie_overview.loc[movie_index,'Id'],
+            thresh = threshold,
+            stwords = rm_sw,
+            hyperlinks = rm_hl
+        )
+
+    if SHOW_METRICS and rerun is not None:
+        show_metrics(rerun.snapshot(), latest_job)
+
+    if job_running:
+        wait_for_job()
+
+
+def show_reviews(m_id: int, thresh: float, stwords: bool, hyperlinks: bool):
+    """
+    Shows one page of reviews of a movie with previews of the texts, pager controls and a sentiment filter.
+    The full text of a review is loaded when it is selected.
+
+    Args:
+        m_id (int): TMDB movie ID
+        thresh (float) : threshold value to classify for positive/negative sentiment
+        stwords (bool): scores with stop words removed
+        hyperlinks(bool): scores with hyperlinks removed
+    """
+    settings = {"thresh": thresh, "stwords": stwords, "hyperlinks": hyperlinks}
+    counts = utils.get_movie_review_counts(m_id = m_id, con = conn, **settings)
 
-    m_reviews_df.columns = [" ".join(c.split("_")).capitalize() for c in m_reviews_df.columns]
+    fc1, fc2 = st.columns([1,3])
+    with fc1:
+        sentiment = st.selectbox(
+                    label= "Sentiment",
+                    options= [None, *utils.SENTIMENT_LABELS.values()],
+                    format_func= lambda label: f"{label or 'all'} ({counts[label]})",
+                    key= "review_sentiment"
+                    )
+
+    # cursors of the pages visited, another movie, filter or setting starts again at the first page
+    pager_key = (int(m_id), sentiment, thresh, stwords, hyperlinks)
+    if st.session_state.get("review_pager_key") != pager_key:
+        st.session_state["review_pager_key"] = pager_key
+        st.session_state["review_cursors"] = [None]
+    cursors = st.session_state["review_cursors"]
+
+    page_df, next_cursor = utils.get_movie_reviews_page(
+                                m_id = m_id,
+                                con = conn,
+                                after = cursors[-1],
+                                sentiment = sentiment,
+                                **settings
+                                )
+
+    first = (len(cursors) - 1) * utils.REVIEW_PAGE_SIZE
+
+    pc1, pc2, pc3 = st.columns([1,1,4])
+    with pc1:
+        st.button("Previous", key= "review_prev", on_click= cursors.pop, disabled= len(cursors) == 1)
+    with pc2:
+        st.button("Next", key= "review_next", on_click= cursors.append, args= (next_cursor,), disabled= next_cursor is None)
+    with pc3:
+        st.caption(f"Reviews {first + min(1, len(page_df))} - {first + len(page_df)} of {counts[sentiment]}")
+
+    reviews_df = page_df[["created_at", "user", "review", "sentiment"]]
+    reviews_df.columns = [" ".join(c.split("_")).capitalize() for c in reviews_df.columns]
+
+    st.write(reviews_df)
+
+    reviews = page_df.set_index("id")
+    review_id = st.selectbox(
+                label= "Read full review",
+                options= [None, *reviews.index[reviews["truncated"]]],
+                format_func= lambda r_id: "-" if r_id is None else f"{reviews.loc[r_id, 'user']}, {reviews.loc[r_id, 'created_at']}",
+                )
+
+    if review_id is not None:
+        st.markdown(utils.get_review_text(review_id = review_id, con = conn))
+
+
+def show_job_status(job: dict) -> bool:
+    """
+    Shows status and progress of an update of movies
+
+    Args:
+        job (dict): latest update job, None if there was none
+    Returns:
+        bool: True if the update is queued or running
+    """
+    if job is None:
+        return False
+
+    progress = f"{job['movies_fetched']} movies fetched, {job['reviews_scored']} reviews scored, {job['rows_written']} rows written"
+
+    if job["status"] == "queued":
+        st.info("Update of movies is queued")
+    elif job["status"] == "running":
+        st.info(f"Updating movies : {progress}")
+    elif job["status"] == "done":
+        seconds = int((job["finished_at"] - job["started_at"]).total_seconds())
+        st.caption(f"Movies updated {job['finished_at']:%Y-%m-%d %H:%M} in {seconds} seconds : {progress}")
+        cache_stats = tmdbutils.cache_stats()
+        if cache_stats:
+            st.caption("TMDB response cache : {hits} hits, {revalidated} revalidated, {misses} misses".format(**cache_stats))
+    else:
+        st.warning(f"Last update of movies failed : {job['error']}")
 
-    st.write(m_reviews_df)
+    return job["status"] in jobs.ACTIVE_STATUSES
+
+
+def show_metrics(rerun: dict, job: dict):
+    """
+    Shows debug panel with stage timings, counters and cache hit rates of the current page run and the last update
+
+    Args:
+        rerun (dict): snapshot of the current page run
+        job (dict): latest update job, None if there was none
+    """
+    with st.sidebar.expander("Performance"):
+        st.write(f"**Current page run** : {rerun['seconds'] * 1000:.0f} ms so far")
+        st.dataframe(metrics_frame(rerun))
+
+        counters = rerun["counters"]
+        reads = counters.get("read_cache_hits", 0) + counters.get("read_cache_misses", 0)
+        if reads:
+            st.caption(f"Read cache : {counters.get('read_cache_hits', 0)} of {reads} reads cached")
+
+        read_stats = cache.stats()
+        st.caption(f"Read cache since start : {read_stats['hit_ratio']:.0%} hit rate, {read_stats['entries']} entries")
+
+        job_metrics = None if job is None else job.get("metrics")
+        if job_metrics:
+            st.write(f"**Last update** : {job_metrics['seconds']:.1f} s, job {job['id']} {job['status']}")
+            st.dataframe(metrics_frame(job_metrics))
+            st.caption(", ".join(f"{counter} {value}" for counter, value in job_metrics["counters"].items()))
+
+
+def metrics_frame(snapshot: dict) -> pd.DataFrame:
+    """
+    Returns stage timings of a metrics snapshot as DataFrame with calls, total ms and max ms per stage
+    """
+    stages_df = pd.DataFrame.from_dict(snapshot["stages"], orient= "index", columns= ["calls", "seconds", "max"])
+
+    return pd.DataFrame({
+                "calls": stages_df["calls"],
+                "total ms": (stages_df["seconds"] * 1000).round(1),
+                "max ms": (stages_df["max"] * 1000).round(1),
+            })
+
+
+def wait_for_job():
+    """
+    Reruns the page after a short pause to follow the progress of a running update
+    """
+    time.sleep(JOB_STATUS_POLL)
+    st.experimental_rerun()
 
 if __name__ == "__main__":
-    main()
+    with metrics.recording("rerun") as rerun:
+        main(rerun)
 
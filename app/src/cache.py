@@ -0,0 +1,198 @@
+"""
+In memory read cache for DB accessors that is invalidated when data in the DB changes
+"""
+
+import copy
+import functools
+import inspect
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+from src import db, metrics
+
+
+# maximum cached results per accessor
+READ_CACHE_SIZE = int(os.environ.get("READ_CACHE_SIZE", 256))
+# seconds a data version read from DB is trusted before it is checked again
+DATA_VERSION_TTL = float(os.environ.get("DATA_VERSION_TTL", 2))
+
+
+class LRUCache:
+    """
+    Thread safe size bounded cache with least recently used eviction
+    """
+
+    def __init__(self, maxsize:int = 256):
+        """
+        Args:
+            maxsize (int, optional): maximum number of entries. Defaults to 256
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default = None):
+        """
+        Returns cached value of the key and marks it as recently used
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        """
+        Stores value of the key and evicts least recently used entries over maxsize
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last= False)
+
+    def clear(self):
+        """
+        Removes all entries
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DataVersion:
+    """
+    Data version token of the DB, re-read from DB at most once per ttl seconds
+    """
+
+    def __init__(self, ttl:float = 2):
+        self.ttl = ttl
+        self.version = None
+        self.checked_at = 0.
+        self.lock = threading.Lock()
+
+    def get(self, con) -> int:
+        """
+        Returns data version of the DB
+
+        Args:
+            con (engine): SQLAlchemy engine
+        """
+        with self.lock:
+            if self.version is not None and time.monotonic() - self.checked_at < self.ttl:
+                return self.version
+
+        version = db.get_data_version(con)
+
+        with self.lock:
+            self.version = version
+            self.checked_at = time.monotonic()
+
+        return version
+
+    def reset(self):
+        """
+        Forces a fresh read of the data version with the next get
+        """
+        with self.lock:
+            self.version = None
+
+
+data_version = DataVersion(ttl= DATA_VERSION_TTL)
+
+_caches = []
+
+
+def versioned(func = None, maxsize:int = None):
+    """
+    Decorator to cache results of a DB accessor with a `con` argument. Results are keyed by the data version
+    of the DB and the other arguments of the accessor, so that cached results are not used after data changed.
+    Copies of cached results are returned, callers can modify them.
+
+    Args:
+        func (callable): DB accessor
+        maxsize (int, optional): maximum cached results. Defaults to READ_CACHE_SIZE
+    """
+    if func is None:
+        return functools.partial(versioned, maxsize= maxsize)
+
+    lru = LRUCache(maxsize or READ_CACHE_SIZE)
+    _caches.append(lru)
+
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+
+        params = dict(bound.arguments)
+        con = params.pop("con")
+
+        key = (data_version.get(con), tuple(sorted((k, _hashable(v)) for k, v in params.items())))
+
+        result = lru.get(key)
+
+        if result is None:
+            metrics.count("read_cache_misses")
+            result = func(*args, **kwargs)
+            lru.put(key, result)
+        else:
+            metrics.count("read_cache_hits")
+
+        return _copy(result)
+
+    wrapper.cache = lru
+
+    return wrapper
+
+
+def invalidate():
+    """
+    Removes all cached results e.g. after this process updated the DB
+    """
+    data_version.reset()
+
+    for lru in _caches:
+        lru.clear()
+
+
+def stats() -> dict:
+    """
+    Returns hits, misses and entries of all accessor caches
+    """
+    hits = sum(lru.hits for lru in _caches)
+    misses = sum(lru.misses for lru in _caches)
+
+    return {
+        "hits": hits,
+        "misses": misses,
+        "entries": sum(len(lru) for lru in _caches),
+        "hit_ratio": hits / (hits + misses) if hits + misses else 0.,
+    }
+
+
+def _hashable(value):
+    # numpy scalars e.g. movie ids from DataFrames
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def _copy(value):
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if hasattr(value, "copy"):
+        return value.copy()
+    return copy.copy(value)
@@ -0,0 +1,427 @@
+"""
+Database tables and bulk loading of DataFrames into Postgres
+"""
+
+import io
+import os
+import time
+import threading
+import contextlib
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy import engine
+
+from src import metrics
+
+
+M_CREW_TABLE = "t_tmdb_movie_crew"
+M_CAST_TABLE = "t_tmdb_movie_cast"
+MOVIE_TABLE = "t_tmdb_pop_movies"
+M_REVIEW_TABLE = "t_tmdb_movie_review"
+M_SCORE_TABLE = "t_tmdb_review_score"
+M_CLEAN_TEXT_TABLE = "t_tmdb_review_clean_text"
+OVERVIEW_VIEW = "mv_tmdb_movie_overview"
+SCHEMA_VERSION_TABLE = "t_schema_version"
+DATA_VERSION_TABLE = "t_data_version"
+INGEST_JOB_TABLE = "t_ingest_job"
+
+# advisory lock id to allow only one update of the tables at a time
+REFRESH_LOCK_ID = 72240301
+
+# column names and Postgres types of the tables are read from the DB, MIGRATIONS are their only definition
+_table_columns = {}
+_table_columns_lock = threading.Lock()
+
+INT_TYPES = {"smallint", "integer", "bigint"}
+
+
+# schema changes in order of version. Each migration is applied once, pending migrations are applied in one transaction.
+# Migrations only change tables in place, they never drop tables or columns with data.
+MIGRATIONS = [
+    # Tables created before migrations existed were created by pandas with the columns of the TMDB responses.
+    # They are kept with their data: missing columns are added, column types are converted and keys are added,
+    # columns no longer used by the app are left empty by new rows.
+    (1, "create tables", [
+        f"""create table if not exists {MOVIE_TABLE} (
+                id bigint,
+                title text,
+                release_date date,
+                popularity double precision,
+                poster_path text,
+                genre_names text
+            )""",
+        f"""create table if not exists {M_CREW_TABLE} (
+                m_id bigint,
+                id bigint,
+                name text,
+                job text
+            )""",
+        f"""create table if not exists {M_CAST_TABLE} (
+                m_id bigint,
+                id bigint,
+                name text,
+                "order" integer
+            )""",
+        f"""create table if not exists {M_REVIEW_TABLE} (
+                m_id bigint,
+                id text,
+                author_details_username text,
+                content text,
+                content_hash text,
+                created_at timestamp with time zone
+            )""",
+        f"""create table if not exists {M_SCORE_TABLE} (
+                id text,
+                m_id bigint,
+                stwords boolean,
+                hyperlinks boolean,
+                compound double precision,
+                pos double precision,
+                neu double precision,
+                neg double precision
+            )""",
+        # tables of pandas, e.g. dates as text, integers as bigint and columns missing of some TMDB responses
+        f"""alter table {MOVIE_TABLE}
+                add column if not exists title text,
+                add column if not exists release_date date,
+                add column if not exists popularity double precision,
+                add column if not exists poster_path text,
+                add column if not exists genre_names text""",
+        f"""alter table {MOVIE_TABLE}
+                alter column id type bigint using nullif(id::text, '')::numeric::bigint,
+                alter column release_date type date using nullif(release_date::text, '')::date,
+                alter column popularity type double precision using nullif(popularity::text, '')::double precision""",
+        f"""alter table {M_CREW_TABLE}
+                add column if not exists name text,
+                add column if not exists job text""",
+        f"""alter table {M_CREW_TABLE}
+                alter column m_id type bigint using nullif(m_id::text, '')::numeric::bigint,
+                alter column id type bigint using nullif(id::text, '')::numeric::bigint""",
+        f"""alter table {M_CAST_TABLE}
+                add column if not exists name text,
+                add column if not exists "order" integer""",
+        f"""alter table {M_CAST_TABLE}
+                alter column m_id type bigint using nullif(m_id::text, '')::numeric::bigint,
+                alter column id type bigint using nullif(id::text, '')::numeric::bigint,
+                alter column "order" type integer using nullif("order"::text, '')::numeric::integer""",
+        f"""alter table {M_REVIEW_TABLE}
+                add column if not exists author_details_username text,
+                add column if not exists content_hash text,
+                add column if not exists created_at timestamp with time zone""",
+        f"""alter table {M_REVIEW_TABLE}
+                alter column m_id type bigint using nullif(m_id::text, '')::numeric::bigint,
+                alter column id type text,
+                alter column created_at type timestamp with time zone using nullif(created_at::text, '')::timestamp with time zone""",
+        # same digest as utils.content_hash, texts of reviews are cleaned and scored by the hash
+        f"update {M_REVIEW_TABLE} set content_hash = md5(content) where content_hash is null and content is not null",
+        # popular movies of pandas tables may repeat across pages of the list, rows without key cannot be updated
+        f"delete from {MOVIE_TABLE} where id is null",
+        f"delete from {MOVIE_TABLE} ttpm using {MOVIE_TABLE} dup where dup.id = ttpm.id and dup.ctid > ttpm.ctid",
+        f"delete from {M_REVIEW_TABLE} where id is null",
+        f"delete from {M_REVIEW_TABLE} ttmr using {M_REVIEW_TABLE} dup where dup.id = ttmr.id and dup.ctid > ttmr.ctid",
+        f"alter table {MOVIE_TABLE} add primary key (id)",
+        f"alter table {M_REVIEW_TABLE} add primary key (id)",
+        f"alter table {M_SCORE_TABLE} add primary key (id, stwords, hyperlinks)",
+        f"create index on {M_CREW_TABLE} (m_id, job)",
+        f'create index on {M_CAST_TABLE} (m_id, "order")',
+        # keyset pagination of the reviews of a movie, pages are read newest first with a backward index scan
+        f"create index on {M_REVIEW_TABLE} (m_id, created_at, id)",
+        f"create index on {M_SCORE_TABLE} (m_id)",
+        # sentiments depend on the threshold of a session, they are classified from the stored scores when read
+        f"""create materialized view {OVERVIEW_VIEW} as
+            select ttpm.id,
+                ttpm.title,
+                ttpm.release_date,
+                director."name" as "director",
+                lead_actor."name" as "lead_Actor",
+                ttpm.genre_names as genre
+            from {MOVIE_TABLE} ttpm
+            join lateral (
+                select ttmc."name" from {M_CREW_TABLE} ttmc
+                where ttmc.m_id = ttpm.id and ttmc.job = 'Director'
+                limit 1
+            ) director on true
+            join lateral (
+                select ttmc2."name" from {M_CAST_TABLE} ttmc2
+                where ttmc2.m_id = ttpm.id and ttmc2."order" = 1
+                limit 1
+            ) lead_actor on true
+        """,
+        # unique index is required to refresh the view concurrently
+        f"create unique index on {OVERVIEW_VIEW} (id)",
+        f"""create table {DATA_VERSION_TABLE} (
+                id boolean primary key default true check (id),
+                version bigint not null,
+                updated_at timestamp with time zone default now()
+            )""",
+        f"insert into {DATA_VERSION_TABLE} (version) values (1)",
+        f"""create table {INGEST_JOB_TABLE} (
+                id bigserial primary key,
+                status text not null default 'queued' check (status in ('queued', 'running', 'done', 'failed')),
+                incremental boolean not null default true,
+                requested_at timestamp with time zone not null default now(),
+                started_at timestamp with time zone,
+                finished_at timestamp with time zone,
+                heartbeat_at timestamp with time zone,
+                movies_fetched integer not null default 0,
+                reviews_scored integer not null default 0,
+                rows_written integer not null default 0,
+                error text,
+                metrics jsonb
+            )""",
+        f"create index on {INGEST_JOB_TABLE} (status, requested_at)",
+        f"""create table {M_CLEAN_TEXT_TABLE} (
+                content_hash text,
+                stwords boolean,
+                hyperlinks boolean,
+                tokenizer text not null default 'nltk',
+                clean_text text,
+                primary key (content_hash, stwords, hyperlinks, tokenizer)
+            )""",
+    ]),
+]
+
+
+def engine_from_env() -> engine:
+    """
+    Creates SQLAlchemy engine for the DB configured with POSTGRES_* environment variables
+
+    Returns:
+        engine: SQLAlchemy engine
+    """
+    return sa.create_engine(f"postgresql://{os.environ['POSTGRES_USER']}:{os.environ['POSTGRES_PASSWORD']}@{os.environ['POSTGRES_HOST']}/{os.environ['POSTGRES_DB']}")
+
+
+def migrate(con: engine) -> int:
+    """
+    Applies pending schema migrations
+
+    Args:
+        con (engine): SQLAlchemy engine
+    Returns:
+        int: schema version of the DB
+    """
+    with con.begin() as trans_con:
+        trans_con.execute(f"""create table if not exists {SCHEMA_VERSION_TABLE} (
+                                version integer primary key,
+                                description text,
+                                applied_at timestamp with time zone default now()
+                            )""")
+        # only one process applies migrations at a time
+        trans_con.execute(f"lock table {SCHEMA_VERSION_TABLE} in exclusive mode")
+
+        version = trans_con.execute(f"select coalesce(max(version), 0) from {SCHEMA_VERSION_TABLE}").scalar()
+
+        for mig_version, description, statements in MIGRATIONS:
+            if mig_version <= version:
+                continue
+
+            for stmt in statements:
+                trans_con.execute(stmt)
+
+            trans_con.execute(
+                    sa.text(f"insert into {SCHEMA_VERSION_TABLE} (version, description) values (:version, :description)"),
+                    {"version": mig_version, "description": description}
+                )
+            version = mig_version
+
+            # columns are read again after schema changes
+            with _table_columns_lock:
+                _table_columns.clear()
+
+    return version
+
+
+def get_table_columns(con, table_name:str) -> dict:
+    """
+    Returns column names and Postgres types of a table in table order, as created by MIGRATIONS. 
+    Columns are read from the DB catalog once per process and table.
+
+    Args:
+        con (engine or Connection): SQLAlchemy engine or connection
+        table_name (str): name of the table
+    Returns:
+        dict: column name to Postgres type e.g. {"id": "bigint", "title": "text"}
+    """
+    with _table_columns_lock:
+        columns = _table_columns.get(table_name)
+
+    if columns is None:
+        rows = con.execute(
+                sa.text("""select att.attname, format_type(att.atttypid, att.atttypmod)
+                            from pg_attribute att
+                            where att.attrelid = cast(:table_name as regclass) and 
+                                att.attnum > 0 and 
+                                not att.attisdropped
+                            order by att.attnum"""),
+                {"table_name": table_name}
+            ).fetchall()
+        columns = {col: col_type for col, col_type in rows}
+
+        with _table_columns_lock:
+            _table_columns[table_name] = columns
+
+    return columns
+
+
+def refresh_overview(con) -> int:
+    """
+    Refreshes movie overview materialized view after data changes and bumps data version, 
+    so that cached reads of other processes are invalidated. Readers are not blocked during refresh.
+    Called with the connection of the data changes, readers see the new data and overview together.
+
+    Args:
+        con (engine or Connection): SQLAlchemy engine or a connection with an open transaction
+    Returns:
+        int: new data version
+    """
+    if isinstance(con, sa.engine.Engine):
+        with con.begin() as trans_con:
+            return refresh_overview(trans_con)
+
+    with metrics.timer("db_refresh_view"):
+        con.execute(f"refresh materialized view concurrently {OVERVIEW_VIEW}")
+
+        return con.execute(
+                f"update {DATA_VERSION_TABLE} set version = version + 1, updated_at = now() returning version"
+            ).scalar()
+
+
+def has_movies(con: engine) -> bool:
+    """
+    Returns True if the movie table has rows, whether or not they are in the overview
+
+    Args:
+        con (engine): SQLAlchemy engine
+    Returns:
+        bool: True if there are movies
+    """
+    return con.execute(f"select exists (select 1 from {MOVIE_TABLE})").scalar()
+
+
+def get_data_version(con: engine) -> int:
+    """
+    Returns data version token of the DB. Version changes with every update of movies or sentiments.
+
+    Args:
+        con (engine): SQLAlchemy engine
+    Returns:
+        int: data version
+    """
+    return con.execute(f"select version from {DATA_VERSION_TABLE}").scalar()
+
+
+@contextlib.contextmanager
+def try_advisory_lock(con: engine, lock_id:int = REFRESH_LOCK_ID):
+    """
+    Context manager that tries to get a Postgres advisory lock without waiting. 
+    The lock is held by a separate connection until the end of the block.
+
+    Args:
+        con (engine): SQLAlchemy engine
+        lock_id (int, optional): advisory lock id. Defaults to REFRESH_LOCK_ID
+    Yields:
+        bool: True if the lock was acquired
+    """
+    with con.connect() as lock_con:
+        acquired = lock_con.execute(sa.text("select pg_try_advisory_lock(:lock_id)"), {"lock_id": lock_id}).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock_con.execute(sa.text("select pg_advisory_unlock(:lock_id)"), {"lock_id": lock_id})
+
+
+def bulk_load(frames: dict, con, keys: dict = None) -> int:
+    """
+    Loads DataFrames into their tables in a single transaction. Each DataFrame is copied with COPY into a
+    temporary staging table and then moved into the table.
+    Readers keep seeing the previous data until the transaction is committed.
+
+    Args:
+        frames (dict): table name to DataFrame mapping
+        con (engine or Connection): SQLAlchemy engine or a connection with an open transaction
+        keys (dict, optional): table name to list of key columns. Rows with the same key values as in the DataFrame
+                    are replaced. Tables without keys are replaced completely. Defaults to None
+    Returns:
+        int: number of rows written
+    """
+    if isinstance(con, sa.engine.Engine):
+        with con.begin() as trans_con:
+            return bulk_load(frames, trans_con, keys)
+
+    keys = keys or {}
+    rows_written = 0
+
+    curs = con.connection.cursor()
+    start = time.perf_counter()
+
+    for table_name, df in frames.items():
+        staging_table = f"{table_name}_staging"
+        table_columns = get_table_columns(con, table_name)
+        columns = list(table_columns)
+        col_list = ", ".join(f'"{col}"' for col in columns)
+
+        curs.execute(f"drop table if exists {staging_table}")
+        curs.execute(f"create temp table {staging_table} (like {table_name} including defaults) on commit drop")
+
+        copy_frame(project_frame(df, table_columns), staging_table, curs, columns)
+
+        if table_name in keys:
+            key_match = " and ".join(f't."{key}" = s."{key}"' for key in keys[table_name])
+            curs.execute(f"delete from {table_name} t using {staging_table} s where {key_match}")
+        else:
+            # delete rather than truncate so that readers are not blocked
+            curs.execute(f"delete from {table_name}")
+
+        curs.execute(f"insert into {table_name} ({col_list}) select {col_list} from {staging_table}")
+        rows_written += curs.rowcount
+        curs.execute(f"drop table {staging_table}")
+
+    curs.close()
+    metrics.record_time("db_write", time.perf_counter() - start)
+
+    return rows_written
+
+
+def project_frame(df: pd.DataFrame, columns: dict) -> pd.DataFrame:
+    """
+    Returns DataFrame with the given columns in their order. Missing columns are empty.
+    Integer columns are converted to nullable integers so that missing values are not written as floats.
+
+    Args:
+        df (DataFrame): DataFrame to be loaded
+        columns (dict): column name to Postgres type, see get_table_columns
+    Returns:
+        DataFrame: projected DataFrame
+    """
+    projected = df.reindex(columns= list(columns))
+
+    for col, col_type in columns.items():
+        if col_type in INT_TYPES:
+            projected[col] = pd.to_numeric(projected[col]).astype("Int64")
+
+    return projected
+
+
+def copy_frame(df: pd.DataFrame, table_name: str, curs, columns: list = None, encoding: str = 'utf-8'):
+    """
+    Copies DataFrame rows into a table with COPY in CSV format. Empty values are loaded as NULL.
+
+    Args:
+        df (DataFrame): DataFrame with columns in the order of columns argument
+        table_name (str): name of the table
+        curs (cursor): psycopg2 cursor
+        columns (list, optional): table columns to copy into. Defaults to all columns of the table
+        encoding (str, optional): encoding of the data. Defaults to 'utf-8'
+    """
+    output = io.StringIO()
+    df.to_csv(output, header=False, index=False, encoding=encoding)
+    output.seek(0)
+
+    col_list = "" if columns is None else "(" + ", ".join(f'"{col}"' for col in columns) + ")"
+
+    curs.copy_expert(f"copy {table_name} {col_list} from stdin with (format csv)", output)
+
+    del output
@@ -0,0 +1,140 @@
+"""
+Persistent cache for http responses stored in a local SQLite file
+
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    Response cache keyed by url and query parameters with a separate time to live per endpoint.
+    Expired entries are kept with their ETag / Last-Modified headers for conditional requests.
+    """
+
+    def __init__(self, path:str, ttls:list, default_ttl:float = 3600, ignore_params:tuple = ("api_key",)):
+        """
+        Args:
+            path (str): SQLite file location
+            ttls (list): list of (url regex pattern, seconds) tuples. First matching pattern defines time to live
+            default_ttl (float, optional): time to live in seconds for urls without matching pattern. Defaults to 3600
+            ignore_params (tuple, optional): query parameters not used in the cache key. Defaults to ("api_key",)
+        """
+        self.path = path
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self.default_ttl = default_ttl
+        self.ignore_params = set(ignore_params)
+
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "revalidated": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok= True)
+
+        self.db = sqlite3.connect(path, check_same_thread= False)
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("""create table if not exists http_cache (
+                                key text primary key,
+                                body blob not null,
+                                etag text,
+                                last_modified text,
+                                fetched_at real not null
+                            )""")
+        self.db.commit()
+
+    def key(self, url:str, params:dict = None) -> str:
+        """
+        Cache key from url and query parameters
+
+        Args:
+            url (str): request url
+            params (dict, optional): query parameters
+        Returns:
+            str: cache key
+        """
+        params = {k: v for k, v in (params or {}).items() if k not in self.ignore_params}
+        return url + "?" + json.dumps(params, sort_keys= True, default= str)
+
+    def ttl(self, url:str) -> float:
+        """
+        Time to live in seconds for the url
+        """
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def get(self, key:str):
+        """
+        Returns cached entry for the key
+
+        Args:
+            key (str): cache key
+        Returns:
+            dict: body, etag, last_modified and fetched_at of the entry or None
+        """
+        with self.lock:
+            row = self.db.execute(
+                    "select body, etag, last_modified, fetched_at from http_cache where key = ?", (key,)
+                ).fetchone()
+
+        if row is None:
+            return None
+
+        return dict(zip(("body", "etag", "last_modified", "fetched_at"), row))
+
+    def is_fresh(self, url:str, entry:dict) -> bool:
+        """
+        True if the cached entry of the url is within its time to live
+        """
+        return entry is not None and time.time() - entry["fetched_at"] < self.ttl(url)
+
+    def put(self, key:str, body:bytes, etag:str = None, last_modified:str = None):
+        """
+        Stores a response body in the cache
+        """
+        with self.lock:
+            self.db.execute(
+                "insert or replace into http_cache values (?, ?, ?, ?, ?)",
+                (key, body, etag, last_modified, time.time())
+            )
+            self.db.commit()
+
+    def touch(self, key:str):
+        """
+        Marks an entry as fresh again e.g. after 304 Not Modified response
+        """
+        with self.lock:
+            self.db.execute("update http_cache set fetched_at = ? where key = ?", (time.time(), key))
+            self.db.commit()
+
+    def count(self, counter:str):
+        """
+        Increments a hit/miss counter
+        """
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> dict:
+        """
+        Returns hits, misses, revalidated counters and hit ratio since the cache was created
+        """
+        with self.lock:
+            stats = dict(self.counters)
+
+        total = stats["hits"] + stats["misses"] + stats["revalidated"]
+        stats["hit_ratio"] = (stats["hits"] + stats["revalidated"]) / total if total else 0.
+
+        return stats
+
+    def clear(self):
+        """
+        Removes all entries from the cache
+        """
+        with self.lock:
+            self.db.execute("delete from http_cache")
+            self.db.commit()
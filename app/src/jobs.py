@@ -0,0 +1,352 @@
+"""
+Queue of background updates of popular movies and their sentiments. Jobs are stored in the DB,
+so that the app only enqueues updates and follows their progress while a worker runs them.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from sqlalchemy import engine
+
+from src import db, utils, metrics, snapshot
+from src.db import INGEST_JOB_TABLE
+
+
+# seconds between scheduled updates, 0 to only run enqueued updates
+REFRESH_INTERVAL = float(os.environ.get("REFRESH_INTERVAL", 0))
+# seconds between checks for new jobs
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 5))
+# seconds without heartbeat after which a running job is considered dead, e.g. after a worker crash
+JOB_STALE_AFTER = float(os.environ.get("JOB_STALE_AFTER", 900))
+# seconds between heartbeats of a running job, well below JOB_STALE_AFTER
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", 30))
+# seconds without progress after which the heartbeat of a running job stops, so that a hung job becomes stale.
+# Longer than the slowest stage of an update, e.g. scoring all reviews of a full update
+JOB_PROGRESS_TIMEOUT = float(os.environ.get("JOB_PROGRESS_TIMEOUT", 600))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+logger = logging.getLogger(__name__)
+
+JOB_COLUMNS = """id, status, incremental, requested_at, started_at, finished_at, heartbeat_at,
+                movies_fetched, reviews_scored, rows_written, error, metrics"""
+
+
+def enqueue_refresh(con: engine, incremental:bool = True) -> int:
+    """
+    Adds an update of popular movies to the queue. Only one update is queued or running at a time,
+    if there is one already its id is returned instead of adding another one.
+
+    Args:
+        con (engine): SQLAlchemy engine
+        incremental (bool, optional): True to only write changes to DB. Default: True
+    Returns:
+        int: id of the queued or running job
+    """
+    fail_stale_jobs(con)
+
+    with con.begin() as trans_con:
+        # serializes enqueues, so that concurrent requests do not add duplicate jobs
+        trans_con.execute(f"lock table {INGEST_JOB_TABLE} in share row exclusive mode")
+
+        job_id = trans_con.execute(
+                sa.text(f"select id from {INGEST_JOB_TABLE} where status in :statuses order by requested_at limit 1"),
+                {"statuses": ACTIVE_STATUSES}
+            ).scalar()
+
+        if job_id is None:
+            job_id = trans_con.execute(
+                    sa.text(f"insert into {INGEST_JOB_TABLE} (incremental) values (:incremental) returning id"),
+                    {"incremental": incremental}
+                ).scalar()
+
+    return job_id
+
+
+def get_latest_job(con: engine) -> dict:
+    """
+    Returns most recently requested job with its progress counters
+
+    Args:
+        con (engine): SQLAlchemy engine
+    Returns:
+        dict: job columns, None if no job was requested yet
+    """
+    row = con.execute(f"select {JOB_COLUMNS} from {INGEST_JOB_TABLE} order by requested_at desc, id desc limit 1").first()
+
+    return None if row is None else dict(row._mapping)
+
+
+def claim_next_job(con: engine) -> dict:
+    """
+    Marks the oldest queued job as running and returns it. Jobs claimed by other workers are skipped.
+
+    Args:
+        con (engine): SQLAlchemy engine
+    Returns:
+        dict: claimed job, None if no job is queued
+    """
+    fail_stale_jobs(con)
+
+    with con.begin() as trans_con:
+        row = trans_con.execute(f"""update {INGEST_JOB_TABLE}
+                    set status = 'running', started_at = now(), heartbeat_at = now()
+                    where id = (
+                        select id from {INGEST_JOB_TABLE}
+                        where status = 'queued'
+                        order by requested_at
+                        limit 1
+                        for update skip locked
+                    )
+                    returning {JOB_COLUMNS}
+                """).first()
+
+    return None if row is None else dict(row._mapping)
+
+
+def update_progress(con: engine, job_id:int, movies_fetched:int = 0, reviews_scored:int = 0, rows_written:int = 0):
+    """
+    Adds progress increments to the job counters and records that the job is alive
+
+    Args:
+        con (engine): SQLAlchemy engine
+        job_id (int): job id
+        movies_fetched (int, optional): movies fetched from TMDB since the last update. Defaults to 0
+        reviews_scored (int, optional): reviews scored since the last update. Defaults to 0
+        rows_written (int, optional): rows written to DB since the last update. Defaults to 0
+    """
+    con.execute(
+            sa.text(f"""update {INGEST_JOB_TABLE}
+                        set movies_fetched = movies_fetched + :movies_fetched,
+                            reviews_scored = reviews_scored + :reviews_scored,
+                            rows_written = rows_written + :rows_written,
+                            heartbeat_at = now()
+                        where id = :job_id"""),
+            {"job_id": job_id, "movies_fetched": movies_fetched, "reviews_scored": reviews_scored, "rows_written": rows_written}
+        )
+
+
+def beat_heartbeat(con: engine, job_id:int):
+    """
+    Records that a running job is alive
+
+    Args:
+        con (engine): SQLAlchemy engine
+        job_id (int): job id
+    """
+    con.execute(
+            sa.text(f"update {INGEST_JOB_TABLE} set heartbeat_at = now() where id = :job_id and status = 'running'"),
+            {"job_id": job_id}
+        )
+
+
+@contextmanager
+def heartbeat(con: engine, job_id:int, interval:float = None, progress_timeout:float = None):
+    """
+    Context manager that beats the heartbeat of a job from a daemon thread until the end of the block,
+    so that a long stage without progress is not taken for a dead worker. The heartbeat stops when the job
+    reports no progress for progress_timeout seconds, a hung job is then failed by fail_stale_jobs.
+
+    Args:
+        con (engine): SQLAlchemy engine
+        job_id (int): job id
+        interval (float, optional): seconds between heartbeats. Defaults to JOB_HEARTBEAT_INTERVAL
+        progress_timeout (float, optional): seconds without progress. Defaults to JOB_PROGRESS_TIMEOUT
+    Yields:
+        Callable: to be called when the job makes progress
+    """
+    interval = JOB_HEARTBEAT_INTERVAL if interval is None else interval
+    progress_timeout = JOB_PROGRESS_TIMEOUT if progress_timeout is None else progress_timeout
+    stop = threading.Event()
+    last_progress = [time.monotonic()]
+
+    def progressed():
+        last_progress[0] = time.monotonic()
+
+    def beat():
+        while not stop.wait(interval):
+            if time.monotonic() - last_progress[0] > progress_timeout:
+                logger.warning(f"job {job_id} made no progress for {progress_timeout:.0f} seconds, heartbeat stopped")
+                return
+
+            try:
+                beat_heartbeat(con, job_id)
+            except Exception as e:
+                # a missed heartbeat is retried with the next one
+                logger.warning(f"heartbeat of job {job_id} failed: {type(e).__name__}: {e}")
+
+    thread = threading.Thread(target= beat, name= f"job-{job_id}-heartbeat", daemon= True)
+    thread.start()
+
+    try:
+        yield progressed
+    finally:
+        stop.set()
+        thread.join()
+
+
+def finish_job(con: engine, job_id:int, error:str = None, job_metrics:dict = None) -> bool:
+    """
+    Marks a running job as done, or as failed if there is an error. Jobs that are not running anymore, 
+    e.g. failed by fail_stale_jobs, keep their status.
+
+    Args:
+        con (engine): SQLAlchemy engine
+        job_id (int): job id
+        error (str, optional): error message of a failed job. Defaults to None
+        job_metrics (dict, optional): stage timings and counters of the job, see metrics.Recorder.snapshot. Defaults to None
+    Returns:
+        bool: True if the job was running and is finished now
+    """
+    result = con.execute(
+            sa.text(f"""update {INGEST_JOB_TABLE}
+                        set status = :status, finished_at = now(), heartbeat_at = now(), error = :error,
+                            metrics = cast(:metrics as jsonb)
+                        where id = :job_id and status = 'running'"""),
+            {"job_id": job_id, "status": "done" if error is None else "failed", "error": error,
+             "metrics": None if job_metrics is None else json.dumps(job_metrics)}
+        )
+
+    return result.rowcount > 0
+
+
+def fail_stale_jobs(con: engine, stale_after:float = None) -> int:
+    """
+    Marks running jobs without heartbeat for too long as failed, so that new jobs can be queued
+
+    Args:
+        con (engine): SQLAlchemy engine
+        stale_after (float, optional): seconds without heartbeat. Defaults to JOB_STALE_AFTER
+    Returns:
+        int: number of failed jobs
+    """
+    stale_after = JOB_STALE_AFTER if stale_after is None else stale_after
+
+    result = con.execute(
+            sa.text(f"""update {INGEST_JOB_TABLE}
+                        set status = 'failed', finished_at = now(), error = 'no heartbeat, worker stopped or update hung'
+                        where status = 'running' and heartbeat_at < now() - make_interval(secs => :stale_after)"""),
+            {"stale_after": stale_after}
+        )
+
+    return result.rowcount
+
+
+def run_job(con: engine, job: dict, tmdb_key:str) -> bool:
+    """
+    Runs a claimed job and records its progress, stage timings and result
+
+    Args:
+        con (engine): SQLAlchemy engine
+        job (dict): job returned by claim_next_job
+        tmdb_key (str) : TMDB api key
+    Returns:
+        bool: True if the job is done, False if it failed
+    """
+    error = None
+
+    with heartbeat(con, job["id"]) as progressed, metrics.recording("refresh") as recorder:
+        def progress(**counts):
+            progressed()
+            update_progress(con, job["id"], **counts)
+
+        try:
+            utils.update_tmdb_pop_movies_sentiments(
+                        con = con,
+                        tmdb_key = tmdb_key,
+                        incremental = job["incremental"],
+                        progress = progress
+                    )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        if error is None and snapshot.SNAPSHOT_AFTER_REFRESH:
+            # a failed export does not fail the update, the previous snapshot is kept for warm starts
+            try:
+                snapshot.export_snapshot(con)
+                snapshot.prune_snapshots()
+            except Exception as e:
+                logger.warning(f"snapshot export after update {job['id']} failed: {type(e).__name__}: {e}")
+
+    if not finish_job(con, job["id"], error= error, job_metrics= recorder.snapshot()):
+        logger.warning(f"update {job['id']} was marked as failed while running, its result is not recorded")
+        return False
+
+    return error is None
+
+
+def schedule_refresh(con: engine, interval:float) -> int:
+    """
+    Enqueues an incremental update if the last update was requested more than interval seconds ago.
+    The schedule is kept in the job table, it survives worker restarts and is shared by all workers.
+
+    Args:
+        con (engine): SQLAlchemy engine
+        interval (float): seconds between updates
+    Returns:
+        int: id of the enqueued job, None if no update is due
+    """
+    due = con.execute(
+            sa.text(f"""select coalesce(max(requested_at) < now() - make_interval(secs => :interval), true)
+                        from {INGEST_JOB_TABLE}"""),
+            {"interval": interval}
+        ).scalar()
+
+    return enqueue_refresh(con) if due else None
+
+
+def run_worker(con: engine, tmdb_key:str, once:bool = False, poll:float = None, interval:float = None, stop: threading.Event = None):
+    """
+    Runs queued jobs until stopped. Updates are enqueued every interval seconds, if an interval is given.
+
+    Args:
+        con (engine): SQLAlchemy engine
+        tmdb_key (str) : TMDB api key
+        once (bool, optional): True to return when the queue is empty. Defaults to False
+        poll (float, optional): seconds between checks for new jobs. Defaults to JOB_POLL_INTERVAL
+        interval (float, optional): seconds between scheduled updates, 0 for none. Defaults to REFRESH_INTERVAL
+        stop (threading.Event, optional): event to stop the worker. Defaults to None
+    """
+    poll = JOB_POLL_INTERVAL if poll is None else poll
+    interval = REFRESH_INTERVAL if interval is None else interval
+    stop = stop or threading.Event()
+
+    db.migrate(con)
+
+    while not stop.is_set():
+        if interval > 0:
+            schedule_refresh(con, interval)
+
+        job = claim_next_job(con)
+
+        if job is not None:
+            run_job(con, job, tmdb_key)
+            continue
+
+        if once:
+            return
+
+        stop.wait(poll)
+
+
+def start_worker_thread(con: engine, tmdb_key:str, **kwargs) -> threading.Thread:
+    """
+    Starts run_worker in a daemon thread, e.g. to run jobs inside the app process
+
+    Args:
+        con (engine): SQLAlchemy engine
+        tmdb_key (str) : TMDB api key
+        kwargs: arguments of run_worker
+    Returns:
+        Thread: worker thread
+    """
+    thread = threading.Thread(target= run_worker, args= (con, tmdb_key), kwargs= kwargs, name= "ingest-worker", daemon= True)
+    thread.start()
+
+    return thread
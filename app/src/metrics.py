@@ -0,0 +1,303 @@
+"""
+Stage timings and counters of updates and page renders, e.g. time of TMDB requests, JSON parsing, cleaning,
+scoring and DB writes. Measurements are added to process totals and to the active recordings of the caller,
+e.g. the running update or the current page rerun.
+
+Totals are exported in Prometheus text format to a file or a http endpoint, finished recordings are logged as JSON.
+"""
+
+import contextlib
+import contextvars
+import datetime
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# True to log finished recordings as JSON lines
+METRICS_LOG = os.environ.get("METRICS_LOG", "1") == "1"
+# file for process totals in Prometheus text format, written after each recording e.g. for node exporter
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+# port of the http endpoint for process totals in Prometheus text format, 0 for none
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+
+METRIC_PREFIX = "tmdb"
+
+logger = logging.getLogger(__name__)
+
+
+class Recorder:
+    """
+    Thread safe stage timings and counters of an operation
+    """
+
+    def __init__(self, name:str):
+        """
+        Args:
+            name (str): name of the operation e.g. refresh
+        """
+        self.name = name
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add_time(self, stage:str, seconds:float):
+        """
+        Adds time of one call of the stage
+        """
+        with self.lock:
+            calls, total, longest = self.stages.get(stage, (0, 0., 0.))
+            self.stages[stage] = (calls + 1, total + seconds, max(longest, seconds))
+
+    def add(self, counter:str, value:float = 1):
+        """
+        Adds value to the counter
+        """
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def finish(self):
+        """
+        Records duration of the operation
+        """
+        self.seconds = time.perf_counter() - self.started
+
+    def snapshot(self) -> dict:
+        """
+        Returns timings and counters as JSON serializable dict. Seconds of stages run in parallel threads
+        add up, they can exceed the duration of the operation.
+
+        Returns:
+            dict: name, started_at, seconds, stages with calls, seconds and max seconds per call and counters
+        """
+        with self.lock:
+            seconds = time.perf_counter() - self.started if self.seconds is None else self.seconds
+
+            return {
+                "name": self.name,
+                "started_at": self.started_at.isoformat(timespec= "seconds"),
+                "seconds": round(seconds, 4),
+                "stages": {
+                    stage: {"calls": calls, "seconds": round(total, 4), "max": round(longest, 4)}
+                    for stage, (calls, total, longest) in sorted(self.stages.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+
+totals = Recorder("process")
+
+# recordings of the current context, measurements are added to all of them
+_active = contextvars.ContextVar("metrics_recordings", default= ())
+
+_collectors = []
+
+
+def record_time(stage:str, seconds:float):
+    """
+    Adds time of one call of the stage to process totals and active recordings
+
+    Args:
+        stage (str): stage name e.g. http_fetch
+        seconds (float): duration of the call
+    """
+    for recorder in (totals, *_active.get()):
+        recorder.add_time(stage, seconds)
+
+
+def count(counter:str, value:float = 1):
+    """
+    Adds value to a counter of process totals and active recordings
+
+    Args:
+        counter (str): counter name e.g. http_requests
+        value (float, optional): increment. Defaults to 1
+    """
+    for recorder in (totals, *_active.get()):
+        recorder.add(counter, value)
+
+
+@contextlib.contextmanager
+def timer(stage:str):
+    """
+    Context manager that records the time of the block as one call of the stage
+
+    Args:
+        stage (str): stage name e.g. http_fetch
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(stage, time.perf_counter() - start)
+
+
+@contextlib.contextmanager
+def recording(name:str):
+    """
+    Context manager that records timings and counters of the block, including those of nested recordings and
+    of functions run with in_context. Finished recording is logged.
+
+    Args:
+        name (str): name of the operation e.g. refresh or rerun
+    Yields:
+        Recorder: recording of the block
+    """
+    recorder = Recorder(name)
+    token = _active.set((*_active.get(), recorder))
+
+    try:
+        yield recorder
+    finally:
+        _active.reset(token)
+        recorder.finish()
+
+        snapshot = recorder.snapshot()
+
+        if METRICS_LOG:
+            logger.info(json.dumps({"event": "metrics", **snapshot}))
+        if METRICS_FILE:
+            write_prometheus(METRICS_FILE)
+
+
+def in_context(func):
+    """
+    Returns func bound to the recordings of the caller, so that measurements of func run in another thread
+    e.g. with ThreadPoolExecutor are added to them. Bind once per submitted call.
+
+    Args:
+        func (callable): function to run in another thread
+    Returns:
+        callable: bound function
+    """
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+def register_collector(func):
+    """
+    Registers a function that returns additional metrics for the Prometheus export e.g. cache hit counters.
+    Metrics with a name ending in _total are exported as counters, others as gauges.
+
+    Args:
+        func (callable): function without arguments returning (name, labels dict, value) tuples
+    Returns:
+        callable: func, so that it can be used as decorator
+    """
+    _collectors.append(func)
+    return func
+
+
+def prometheus_text() -> str:
+    """
+    Returns process totals and metrics of the registered collectors in Prometheus text format
+
+    Returns:
+        str: metrics
+    """
+    snapshot = totals.snapshot()
+
+    samples = {
+        "stage_calls_total": [({"stage": stage}, values["calls"]) for stage, values in snapshot["stages"].items()],
+        "stage_seconds_total": [({"stage": stage}, values["seconds"]) for stage, values in snapshot["stages"].items()],
+        "stage_seconds_max": [({"stage": stage}, values["max"]) for stage, values in snapshot["stages"].items()],
+    }
+
+    for counter, value in snapshot["counters"].items():
+        samples[f"{counter}_total"] = [({}, value)]
+
+    for collector in _collectors:
+        try:
+            for name, labels, value in collector():
+                samples.setdefault(name, []).append((labels, value))
+        except Exception as e:
+            logger.warning(f"metrics collector {collector.__name__} failed: {e}")
+
+    lines = []
+    for name, values in samples.items():
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} {'counter' if name.endswith('_total') else 'gauge'}")
+
+        for labels, value in values:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path:str):
+    """
+    Writes process totals in Prometheus text format to a file. The file is replaced atomically,
+    readers never see a partial file.
+
+    Args:
+        path (str): file location
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok= True)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(prometheus_text())
+
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = prometheus_text().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port:int = None, host:str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serves process totals in Prometheus text format at /metrics from a daemon thread
+
+    Args:
+        port (int, optional): port of the endpoint. Defaults to METRICS_PORT
+        host (str, optional): interface to listen on. Defaults to all interfaces
+    Returns:
+        ThreadingHTTPServer: running server
+    """
+    server = ThreadingHTTPServer((host, port or METRICS_PORT), _MetricsHandler)
+    threading.Thread(target= server.serve_forever, name= "metrics-http", daemon= True).start()
+
+    return server
+
+
+def setup_logging(level:int = logging.INFO):
+    """
+    Logs recordings to stderr as plain JSON lines, unless logging of this module is configured already
+
+    Args:
+        level (int, optional): log level. Defaults to logging.INFO
+    """
+    if logger.handlers:
+        return
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
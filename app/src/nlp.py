@@ -2,23 +2,562 @@
 Helper functions for natural language processing tasks
 
 """
+import os
 import string
 import re
-import nltk
+import functools
+import multiprocessing
 import numpy as np
 
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-from nltk.tokenize import word_tokenize
+from concurrent.futures import ProcessPoolExecutor
 
-nltk.download('stopwords')
-nltk.download('punkt')
+# NLTK is imported and its resources are loaded on first use, nothing is downloaded at import.
+# Resources are provisioned once with `python __init__.py` into NLTK_DATA_DIR
+NLTK_DATA_DIR = os.environ.get("NLTK_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nltk_data"))
+# stop words, tokenizer models (punkt for older, punkt_tab for newer NLTK versions) and lexicon for vader sentiment analyzer
+NLTK_RESOURCES = ("stopwords", "punkt", "punkt_tab", "vader_lexicon")
+# True to download missing resources on first use instead of failing, e.g. for development
+NLTK_AUTO_DOWNLOAD = os.environ.get("NLTK_AUTO_DOWNLOAD", "0") == "1"
 
-from nltk.corpus import stopwords
+# pre-compiled patterns for text clean up
+NON_TEXT_REGEX = re.compile(f'[^a-zA-Z{string.punctuation}{string.digits}{string.whitespace}]')
+HYPERLINK_REGEX = re.compile(r'https?:\/\/.*[\r\n]*')
+HASHTAG_REGEX = re.compile(r'#')
+# words split like nltk treebank tokenizer: "don't" -> "do", "n't" and "it's" -> "it", "'s". Hyphenated words, 
+# ellipsis and other punctuation marks are separate tokens
+TOKEN_REGEX = re.compile(r"""
+        \w+(?=n't\b)
+        | n't\b
+        | '(?:s|m|d|ll|re|ve)\b
+        | \w+(?:-\w+)*
+        | \.\.\.
+        | [^\w\s]
+    """, re.VERBOSE | re.IGNORECASE)
 
-# download lexicon for vader sentiment analyzer
-nltk.download("vader_lexicon")
+SCORE_KEYS = ("compound", "pos", "neu", "neg")
 
-stopwords_english = stopwords.words('english')
+# number of processes for sentiment scoring, 1 scores in the calling process
+NLP_WORKERS = int(os.environ.get("NLP_WORKERS", 1))
+
+# vader scoring engines: "nltk" scores each text with nltk analyzer, "numpy" scores a batch at once with `vader_scores`
+VADER_ENGINES = ("nltk", "numpy")
+NLP_ENGINE = os.environ.get("NLP_ENGINE", "nltk")
+
+# tokenizers for stop word removal: "nltk" word_tokenize, "regex" TOKEN_REGEX, "split" `split_tokens`.
+# regex and split do not need NLTK tokenizer models
+TOKENIZERS = ("nltk", "regex", "split")
+NLP_TOKENIZER = os.environ.get("NLP_TOKENIZER", "nltk")
+
+
+def download_resources(download_dir:str = None, quiet:bool = False) -> bool:
+    """
+    Downloads NLTK resources used by the app. To be run once at setup, e.g. when the docker image is built.
+
+    Args:
+        download_dir (str, optional): directory for the resources. Defaults to NLTK_DATA_DIR
+        quiet (bool, optional): True to not print download progress. Defaults to False
+    Returns:
+        bool: True if all resources are available
+    """
+    nltk = get_nltk()
+
+    return all([nltk.download(resource, download_dir= download_dir or NLTK_DATA_DIR, quiet= quiet) for resource in NLTK_RESOURCES])
+
+
+@functools.lru_cache(maxsize=None)
+def get_nltk():
+    """
+    Imports NLTK with NLTK_DATA_DIR as first data directory
+
+    Returns:
+        module: nltk
+    """
+    import nltk
+
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIR)
+
+    return nltk
+
+
+def load_resource(loader):
+    """
+    Calls loader of an NLTK resource. Missing resources are downloaded only if NLTK_AUTO_DOWNLOAD is set.
+
+    Args:
+        loader (Callable): function that loads the resource
+    Returns:
+        loaded resource
+    Raises:
+        LookupError: if the resource is missing
+    """
+    get_nltk()
+
+    try:
+        return loader()
+    except LookupError:
+        if not NLTK_AUTO_DOWNLOAD:
+            raise LookupError(f"NLTK resources are missing in {NLTK_DATA_DIR}. "
+                                "Run `python __init__.py` in the app folder once or set NLTK_AUTO_DOWNLOAD=1") from None
+
+    download_resources(quiet= True)
+
+    return loader()
+
+
+@functools.lru_cache(maxsize=None)
+def get_analyzer():
+    """
+    Returns vader sentiment intensity analyzer. Lexicon is loaded only once per process.
+
+    Returns:
+        SentimentIntensityAnalyzer: shared vader analyzer
+    """
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+    return load_resource(SentimentIntensityAnalyzer)
+
+
+@functools.lru_cache(maxsize=None)
+def get_stopwords() -> frozenset:
+    """
+    Returns English stop words. Stop words are loaded only once per process.
+
+    Returns:
+        frozenset: stop words
+    """
+    from nltk.corpus import stopwords
+
+    return frozenset(load_resource(lambda: stopwords.words('english')))
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(tokenizer:str = None):
+    """
+    Returns word tokenizer function. NLTK tokenizer model is loaded only once per process.
+
+    Args:
+        tokenizer (str, optional): one of TOKENIZERS. Defaults to NLP_TOKENIZER environment variable or "nltk"
+    Returns:
+        Callable: function that splits text into a list of tokens
+    """
+    tokenizer = NLP_TOKENIZER if tokenizer is None else tokenizer
+
+    if tokenizer == "regex":
+        return TOKEN_REGEX.findall
+    if tokenizer == "split":
+        return split_tokens
+    if tokenizer != "nltk":
+        raise ValueError(f"Unknown tokenizer {tokenizer}, expected one of {TOKENIZERS}")
+
+    from nltk.tokenize import word_tokenize
+
+    load_resource(lambda: word_tokenize("load tokenizer model"))
+
+    return word_tokenize
+
+
+def score_batch(texts, thresh:float = .05, stwords:bool = True, hyperlinks:bool=True, keep_raw: bool = False, engine:str = None,
+                    tokenizer:str = None) -> dict:
+    """
+    Performs Vader sentiment analysis on a batch of review texts with a single analyzer.
+
+    Args:
+        texts (iterable of str): review texts to perform sentiment analysis on
+        thresh (float, optional) : threshold for vader sentiment analysis compound value. Defaults to .05
+        stwords (bool, optional): True to remove stop words before performing sentiment analysis. Default True
+        hyperlinks(bool, optional): True to remove hyperlinks before performing sentiment analysis. Default: True
+        keep_raw (bool, optional): to keep the raw string with all chracters. Defaults to False
+        engine (str, optional): one of VADER_ENGINES. Defaults to NLP_ENGINE environment variable or "nltk"
+        tokenizer (str, optional): tokenizer for stop word removal, one of TOKENIZERS. Defaults to NLP_TOKENIZER
+    Returns:
+        dict: numpy arrays for compound, pos, neu and neg scores and sentiment rating of each text
+    """
+    engine = NLP_ENGINE if engine is None else engine
+
+    if engine not in VADER_ENGINES:
+        raise ValueError(f"Unknown vader engine {engine}, expected one of {VADER_ENGINES}")
+
+    texts = list(texts)
+
+    if not keep_raw:
+        texts = [clean_text(text, stwords, hyperlinks, tokenizer) for text in texts]
+
+    if engine == "numpy":
+        batch_scores = vader_scores(texts)
+    else:
+        sa = get_analyzer()
+        scores = np.empty((len(SCORE_KEYS), len(texts)), dtype=float)
+
+        for i, text in enumerate(texts):
+            p_scores = sa.polarity_scores(text)
+
+            for k, key in enumerate(SCORE_KEYS):
+                scores[k, i] = p_scores[key]
+
+        batch_scores = dict(zip(SCORE_KEYS, scores))
+
+    batch_scores['sentiment'] = vader_sa_ratings(batch_scores['compound'], thresh)
+
+    return batch_scores
+
+
+def score_batch_parallel(texts, thresh:float = .05, stwords:bool = True, hyperlinks:bool=True, keep_raw: bool = False,
+                            workers:int = None, chunk_size:int = None, engine:str = None, tokenizer:str = None) -> dict:
+    """
+    Performs Vader sentiment analysis on a batch of review texts split in chunks across a pool of processes.
+    Results are in the same order as input texts.
+
+    Args:
+        texts (iterable of str): review texts to perform sentiment analysis on
+        thresh (float, optional) : threshold for vader sentiment analysis compound value. Defaults to .05
+        stwords (bool, optional): True to remove stop words before performing sentiment analysis. Default True
+        hyperlinks(bool, optional): True to remove hyperlinks before performing sentiment analysis. Default: True
+        keep_raw (bool, optional): to keep the raw string with all chracters. Defaults to False
+        workers (int, optional): number of worker processes. Defaults to NLP_WORKERS environment variable or 1
+        chunk_size (int, optional): number of texts sent to a worker at once. Defaults to 4 chunks per worker
+        engine (str, optional): one of VADER_ENGINES. Defaults to NLP_ENGINE environment variable or "nltk"
+        tokenizer (str, optional): tokenizer for stop word removal, one of TOKENIZERS. Defaults to NLP_TOKENIZER
+    Returns:
+        dict: numpy arrays for compound, pos, neu and neg scores and sentiment rating of each text
+    """
+    workers = NLP_WORKERS if workers is None else workers
+
+    texts = list(texts)
+
+    if workers <= 1 or len(texts) < 2:
+        return score_batch(texts, thresh, stwords, hyperlinks, keep_raw, engine, tokenizer)
+
+    if chunk_size is None:
+        chunk_size = -(-len(texts) // (workers * 4))
+
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+
+    # map keeps the order of the chunks
+    chunk_scores = list(get_pool(workers).map(
+                            _score_chunk,
+                            chunks,
+                            [stwords] * len(chunks),
+                            [hyperlinks] * len(chunks),
+                            [keep_raw] * len(chunks),
+                            [engine] * len(chunks),
+                            [tokenizer] * len(chunks),
+                        ))
+
+    batch_scores = {key: np.concatenate([cs[key] for cs in chunk_scores]) for key in SCORE_KEYS}
+    batch_scores['sentiment'] = vader_sa_ratings(batch_scores['compound'], thresh)
+
+    return batch_scores
+
+
+@functools.lru_cache(maxsize=None)
+def get_pool(workers:int):
+    """
+    Returns process pool for sentiment scoring. Pool is created once per number of workers and reused.
+    Processes are spawned rather than forked as streamlit runs scripts in threads.
+
+    Args:
+        workers (int): number of worker processes
+    Returns:
+        ProcessPoolExecutor: process pool
+    """
+    return ProcessPoolExecutor(
+                max_workers= workers,
+                mp_context= multiprocessing.get_context("spawn"),
+                initializer= _init_worker
+            )
+
+
+def _init_worker():
+    # load lexicon, stop words and tokenizer once per worker process
+    get_analyzer()
+    get_stopwords()
+    get_tokenizer()
+
+
+def _score_chunk(texts, stwords:bool, hyperlinks:bool, keep_raw:bool, engine:str, tokenizer:str) -> dict:
+    return score_batch(texts, stwords= stwords, hyperlinks= hyperlinks, keep_raw= keep_raw, engine= engine, tokenizer= tokenizer)
+
+
+def clean_batch(texts, stwords:bool = True, hyperlinks:bool=True, workers:int = None, tokenizer:str = None) -> list:
+    """
+    Cleans up a batch of review texts with `clean_text`, split in chunks across the scoring process pool.
+    Results are in the same order as input texts.
+
+    Args:
+        texts (iterable of str): review texts
+        stwords (bool, optional): True to remove stop words. Default True
+        hyperlinks(bool, optional): True to remove hyperlinks. Default: True
+        workers (int, optional): number of worker processes. Defaults to NLP_WORKERS environment variable or 1
+        tokenizer (str, optional): tokenizer for stop word removal, one of TOKENIZERS. Defaults to NLP_TOKENIZER
+    Returns:
+        list: cleaned up texts
+    """
+    workers = NLP_WORKERS if workers is None else workers
+
+    texts = list(texts)
+
+    if workers <= 1 or len(texts) < 2:
+        return _clean_chunk(texts, stwords, hyperlinks, tokenizer)
+
+    chunk_size = -(-len(texts) // (workers * 4))
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+
+    cleaned = get_pool(workers).map(_clean_chunk, chunks, [stwords] * len(chunks), [hyperlinks] * len(chunks), [tokenizer] * len(chunks))
+
+    return [text for chunk in cleaned for text in chunk]
+
+
+def _clean_chunk(texts, stwords:bool, hyperlinks:bool, tokenizer:str) -> list:
+    return [clean_text(text, stwords, hyperlinks, tokenizer) for text in texts]
+
+
+@functools.lru_cache(maxsize=None)
+def get_vader_tables() -> dict:
+    """
+    Returns lexicon and rule word lists of the nltk vader analyzer in lookup friendly form for `vader_scores`.
+    Tables are built only once per process.
+
+    Returns:
+        dict: lexicon, constants and lookup tables
+    """
+    sa = get_analyzer()
+    constants = sa.constants
+
+    return {
+        "lexicon": sa.lexicon,
+        "constants": constants,
+        "booster": {word: scalar for word, scalar in constants.BOOSTER_DICT.items() if " " not in word},
+        "booster_bigrams": [tuple(word.split()) for word in constants.BOOSTER_DICT if " " in word],
+        "idioms": [(tuple(idiom.split()), valence) for idiom, valence in constants.SPECIAL_CASE_IDIOMS.items()],
+        "punc_set": frozenset(constants.PUNC_LIST),
+        "punc_regex": constants.REGEX_REMOVE_PUNCTUATION,
+    }
+
+
+def vader_tokens(text:str, tables:dict = None) -> list:
+    """
+    Splits text into words and emoticons the same way as nltk vader does. Leading or trailing punctuation
+    is removed from words, contractions and most emoticons are kept. Single characters are dropped.
+
+    Args:
+        text (str): text to split
+        tables (dict, optional): tables from `get_vader_tables`. Defaults to None
+    Returns:
+        list: words and emoticons
+    """
+    tables = tables or get_vader_tables()
+    punc_set = tables["punc_set"]
+
+    if not isinstance(text, str):
+        text = str(text.encode("utf-8"))
+
+    words_only = {word for word in tables["punc_regex"].sub("", text).split() if len(word) > 1}
+
+    tokens = []
+    for token in text.split():
+        if len(token) <= 1:
+            continue
+
+        # word with one of the punctuation marks before or after it is replaced by the word
+        word = token.rstrip(string.punctuation)
+        if word == token or token[len(word):] not in punc_set or word not in words_only:
+            word = token.lstrip(string.punctuation)
+            if word == token or token[:len(token) - len(word)] not in punc_set or word not in words_only:
+                word = token
+
+        tokens.append(word)
+
+    return tokens
+
+
+def vader_scores(texts) -> dict:
+    """
+    Vectorized vader sentiment analysis of a batch of texts. All texts are tokenized once and the vader rules
+    (caps emphasis, boosters and dampeners, negations, idioms, "least", "but" and punctuation emphasis)
+    are applied with numpy operations over all words of the batch.
+    Scores match `SentimentIntensityAnalyzer.polarity_scores` of nltk up to float rounding.
+
+    Args:
+        texts (iterable of str): texts to perform sentiment analysis on
+    Returns:
+        dict: numpy arrays for compound, pos, neu and neg scores of each text
+    """
+    tables = get_vader_tables()
+    lexicon, booster, constants = tables["lexicon"], tables["booster"], tables["constants"]
+
+    tokens, doc_lens, amplifiers = [], [], []
+    for text in texts:
+        text_tokens = vader_tokens(text, tables)
+        tokens.extend(text_tokens)
+        doc_lens.append(len(text_tokens))
+        amplifiers.append(_punctuation_amplifier(text if isinstance(text, str) else str(text.encode("utf-8"))))
+
+    n_docs = len(doc_lens)
+    doc_lens = np.array(doc_lens, dtype=np.int64)
+    amplifiers = np.array(amplifiers, dtype=float)
+
+    # document, position in document and number of following words of each word of the batch
+    doc = np.repeat(np.arange(n_docs), doc_lens)
+    pos = np.arange(len(tokens)) - (np.cumsum(doc_lens) - doc_lens)[doc]
+    rpos = doc_lens[doc] - pos - 1
+
+    # word features are looked up once per distinct word of the batch
+    vocab = {}
+    ids = np.fromiter((vocab.setdefault(token, len(vocab)) for token in tokens), dtype=np.int64, count=len(tokens))
+    words = np.array(list(vocab), dtype=object)
+    lowers = np.array([word.lower() for word in vocab], dtype=object)
+
+    valence = np.array([lexicon.get(word, np.nan) for word in lowers], dtype=float)[ids]
+    in_lex = ~np.isnan(valence)
+    boost = np.array([booster.get(word, 0.) for word in lowers], dtype=float)[ids]
+    is_booster = np.array([word in booster for word in lowers], dtype=bool)[ids]
+    is_upper = np.array([word.isupper() for word in vocab], dtype=bool)[ids]
+    negated = np.array([word in constants.NEGATE or "n't" in word for word in lowers], dtype=bool)[ids]
+
+    def is_word(word, lower = True):
+        return ((lowers if lower else words) == word)[ids]
+
+    def at(values, offset, fill):
+        # values of the word at offset from each word, fill where the offset is outside of the document
+        shifted = np.full(values.shape, fill, dtype=values.dtype)
+        if offset < 0 and -offset < len(values):
+            shifted[-offset:] = values[:offset]
+            shifted[pos < -offset] = fill
+        elif offset > 0 and offset < len(values):
+            shifted[:-offset] = values[offset:]
+            shifted[rpos < offset] = fill
+        elif offset == 0:
+            shifted[:] = values
+        return shifted
+
+    def sequence(seq_words, offsets):
+        matched = np.ones(len(tokens), dtype=bool)
+        for word, offset in zip(seq_words, offsets):
+            matched &= at(is_word(word, lower= False), offset, False)
+        return matched
+
+    # texts with some but not all words in caps
+    caps = np.bincount(doc, weights= is_upper, minlength= n_docs)
+    cap_diff = ((caps > 0) & (caps < doc_lens))[doc]
+
+    scores = np.where(in_lex, valence, 0.)
+    scores = np.where(in_lex & is_upper & cap_diff, np.where(scores > 0, scores + constants.C_INCR, scores - constants.C_INCR), scores)
+
+    so_this = is_word("so", lower= False) | is_word("this", lower= False)
+    never = is_word("never", lower= False)
+
+    # boosters, dampeners and negations in the 3 preceding words
+    for start_i, damp in enumerate((1., .95, .9)):
+        offset = -(start_i + 1)
+        modified = in_lex & (pos > start_i) & ~at(in_lex, offset, True)
+
+        scalar = at(boost, offset, 0.)
+        scalar = np.where(scores < 0, -scalar, scalar)
+        cap_booster = at(is_booster, offset, False) & at(is_upper, offset, False) & cap_diff
+        scalar = np.where(cap_booster, np.where(scores > 0, scalar + constants.C_INCR, scalar - constants.C_INCR), scalar)
+        scores = np.where(modified, scores + scalar * damp, scores)
+
+        if start_i == 0:
+            emphasis = np.zeros(len(tokens), dtype=bool)
+        elif start_i == 1:
+            emphasis = at(never, -2, False) & at(so_this, -1, False)
+        else:
+            emphasis = (at(never, -3, False) & at(so_this, -2, False)) | at(so_this, -1, False)
+
+        scores = np.where(modified & emphasis, scores * (1.5 if start_i == 1 else 1.25),
+                    np.where(modified & ~emphasis & at(negated, offset, False), scores * constants.N_SCALAR, scores))
+
+        if start_i == 2:
+            scores = _vader_idioms(scores, modified, sequence, at, is_word, tables)
+
+    # negation with "least", except "at least" and "very least"
+    least = in_lex & at(is_word("least"), -1, False) & ~at(in_lex, -1, True)
+    least &= (pos == 1) | ((pos > 1) & ~at(is_word("at") | is_word("very"), -2, False))
+    scores = np.where(least, scores * constants.N_SCALAR, scores)
+
+    # boosters and "kind of" have no sentiment of their own
+    scores = np.where(is_booster | (is_word("kind") & at(is_word("of"), 1, False)), 0., scores)
+
+    # a repeated word gets the score of its first occurrence in the text
+    _, first, inverse = np.unique(doc * max(len(vocab), 1) + ids, return_index= True, return_inverse= True)
+    scores = scores[first[inverse.reshape(-1)]]
+
+    # words before the first "but" are halved and words after it are weighted 1.5 times
+    is_but = is_word("but")
+    first_but = np.full(n_docs, np.iinfo(np.int64).max)
+    np.minimum.at(first_but, doc[is_but], pos[is_but])
+    but_pos = first_but[doc]
+    scores = np.where(but_pos == np.iinfo(np.int64).max, scores,
+                np.where(pos < but_pos, scores * .5, np.where(pos > but_pos, scores * 1.5, scores)))
+
+    return _vader_doc_scores(scores, doc, doc_lens, amplifiers)
+
+
+def _vader_idioms(scores, modified, sequence, at, is_word, tables):
+    # idioms around the word replace its score, bigram dampeners "kind of" and "sort of" before it reduce it
+    idiom_scores = np.full(len(scores), np.nan)
+
+    for offsets in ((-1, 0), (-2, -1, 0), (-2, -1), (-3, -2, -1), (-3, -2)):
+        for idiom, valence in tables["idioms"]:
+            if len(idiom) == len(offsets):
+                idiom_scores[np.isnan(idiom_scores) & sequence(idiom, offsets)] = valence
+
+    scores = np.where(modified & ~np.isnan(idiom_scores), idiom_scores, scores)
+
+    for offsets in ((0, 1), (0, 1, 2)):
+        for idiom, valence in tables["idioms"]:
+            if len(idiom) == len(offsets):
+                scores = np.where(modified & sequence(idiom, offsets), valence, scores)
+
+    dampened = np.zeros(len(scores), dtype=bool)
+    for bigram in tables["booster_bigrams"]:
+        dampened |= sequence(bigram, (-3, -2)) | sequence(bigram, (-2, -1))
+
+    return np.where(modified & dampened, scores + tables["constants"].B_DECR, scores)
+
+
+def _vader_doc_scores(scores, doc, doc_lens, amplifiers) -> dict:
+    # sum word scores per text into compound, pos, neu and neg scores
+    n_docs = len(doc_lens)
+
+    sum_s = np.bincount(doc, weights= scores, minlength= n_docs)
+    sum_s = np.where(sum_s > 0, sum_s + amplifiers, np.where(sum_s < 0, sum_s - amplifiers, sum_s))
+    compound = sum_s / np.sqrt(sum_s * sum_s + 15)
+
+    pos_sum = np.bincount(doc, weights= np.where(scores > 0, scores + 1, 0.), minlength= n_docs)
+    neg_sum = np.bincount(doc, weights= np.where(scores < 0, scores - 1, 0.), minlength= n_docs)
+    neu_count = np.bincount(doc, weights= scores == 0, minlength= n_docs)
+
+    pos_amp = np.where(pos_sum > np.abs(neg_sum), pos_sum + amplifiers, pos_sum)
+    neg_amp = np.where(pos_sum < np.abs(neg_sum), neg_sum - amplifiers, neg_sum)
+
+    total = pos_amp + np.abs(neg_amp) + neu_count
+    has_words = doc_lens > 0
+    total = np.where(has_words, total, 1.)
+
+    doc_scores = {
+        "compound": (compound, 4),
+        "pos": (np.abs(pos_amp / total), 3),
+        "neu": (np.abs(neu_count / total), 3),
+        "neg": (np.abs(neg_amp / total), 3),
+    }
+
+    # rounded like nltk with python round, np.round differs for values close to a half
+    return {key: np.where(has_words, [round(value, digits) for value in values.tolist()], 0.)
+                for key, (values, digits) in doc_scores.items()}
+
+
+def _punctuation_amplifier(text:str) -> float:
+    # emphasis from up to 4 exclamation points and 2 or more question marks
+    ep_count = min(text.count("!"), 4)
+    qm_count = text.count("?")
+
+    qm_amplifier = 0.
+    if qm_count > 1:
+        qm_amplifier = qm_count * 0.18 if qm_count <= 3 else 0.96
+
+    return ep_count * 0.292 + qm_amplifier
 
 
 def get_vsa_value(review_text:str, thresh:int = .05, keep_raw: bool = False, stwords:bool = True, hyperlinks:bool=True) -> int:
@@ -36,19 +575,34 @@ def get_vsa_value(review_text:str, thresh:int = .05, keep_raw: bool = False, stw
         rating: int: sentiment rating fore the review text
     """
 
-    
-    sa = SentimentIntensityAnalyzer()
+    # Get polarity score dictionary
+    p_scores = get_vsa_scores(review_text, keep_raw, stwords, hyperlinks)
+
+    # return overall sentiment rating
+    return vader_sa_rating(p_scores, thresh)
+
+def get_vsa_scores(review_text:str, keep_raw: bool = False, stwords:bool = True, hyperlinks:bool=True) -> dict:
+    """
+    Performs Vader sentiment analysis on a review statement and returns the raw polarity scores.
+    Scores do not depend on the threshold, so they can be stored once and classified later with `vader_sa_ratings`
+
+    Args:
+        review_text (str): text string to perform sentiment analysis on
+        keep_raw (bool, optional): to keep the raw string with all chracters to perform a basic cleanup for non-english characters. Defaults to False
+        stwords (bool, optional): True to remove stop words before performing sentiment analysis. Default True
+        hyperlinks(bool, optional): True to remove hyperlinks before performing sentiment analysis. Default: True
+    Returns:
+        dict: polarity scores with keys compound, pos, neu and neg
+    """
+
+    sa = get_analyzer()
 
     tfsa = review_text
     # cleans the sentence of extra unicode chracters e.g. a different language chracters
     if not keep_raw:
         tfsa = clean_text(tfsa, stwords, hyperlinks)
 
-    # Get polarity score dictionary
-    p_scores = sa.polarity_scores(tfsa)
-
-    # return overall sentiment rating
-    return vader_sa_rating(p_scores, thresh)
+    return sa.polarity_scores(tfsa)
 
 def vader_sa_rating(ps:dict, thresh:float=.05):
     """
@@ -67,7 +621,50 @@ def vader_sa_rating(ps:dict, thresh:float=.05):
     cmp_value = ps['compound'] 
     return int((abs(cmp_value) > thresh) * np.sign(cmp_value ))
 
-def clean_text(in_text:str, stwords:bool= True, hyperlinks:bool=True) -> str:
+def vader_sa_ratings(compound, thresh:float=.05) -> np.ndarray:
+    """
+    Vectorized version of `vader_sa_rating` for an array of compound scores
+
+    Args:
+        compound (array like): compound scores from vader sentiment analysis
+        thresh (float, optional): threshold value to be used against compound score. Defaults to .05
+    Output:
+        np.ndarray : array of -1, 0 or 1 ratings based on the threshold
+    """
+
+    cmp_values = np.asarray(compound, dtype=float)
+    return ((np.abs(cmp_values) > thresh) * np.sign(cmp_values)).astype(int)
+
+def split_tokens(text:str) -> list:
+    """
+    Splits text at white space. Punctuation at the start or end of a word is split from the word.
+
+    Args:
+        text (str): text to split
+    Returns:
+        list: tokens
+    """
+    tokens = []
+    for token in text.split():
+        word = token.strip(string.punctuation)
+
+        if word == token or not word:
+            tokens.append(token)
+            continue
+
+        start = token.index(word)
+        end = start + len(word)
+
+        if start > 0:
+            tokens.append(token[:start])
+        tokens.append(word)
+        if end < len(token):
+            tokens.append(token[end:])
+
+    return tokens
+
+
+def clean_text(in_text:str, stwords:bool= True, hyperlinks:bool=True, tokenizer:str = None) -> str:
     """
     Cleans up text from special chracters, hyperlinks, etc
 
@@ -75,27 +672,31 @@ def clean_text(in_text:str, stwords:bool= True, hyperlinks:bool=True) -> str:
         in_text (str): Input review text
         stwords (bool, optional): True if to remove stopwords from text. Default: True
         hyperlinks (bool, optional): True if urls to be removed from text. Default: True
+        tokenizer (str, optional): tokenizer for stop word removal, one of TOKENIZERS. Defaults to NLP_TOKENIZER
 
     Output:
         str : cleaned up text
     """
 
-    regex = re.compile(f'[^a-zA-Z{string.punctuation}{string.digits}{string.whitespace}]')
-    out_text = regex.sub("",in_text)
+    out_text = NON_TEXT_REGEX.sub("",in_text)
 
     # remove hyperlinks
 
     if hyperlinks:
-        out_text = re.sub(r'https?:\/\/.*[\r\n]*', '', out_text)
+        out_text = HYPERLINK_REGEX.sub('', out_text)
 
     # remove hashtags
-    out_text = re.sub(r'#', '', out_text)
+    out_text = HASHTAG_REGEX.sub('', out_text)
     
     # remove stop words
     if stwords:
-        text_tokens = word_tokenize(out_text)
+        tokenizer = NLP_TOKENIZER if tokenizer is None else tokenizer
+        text_tokens = get_tokenizer(tokenizer)(out_text)
+        stopwords_english = get_stopwords()
 
-        out_text = [ token  for token in text_tokens if token not in stopwords_english]
+        # negations like "don't" are stop words, their "n't" is kept as nltk tokenizer splits it from the stop word
+        out_text = [ token if token not in stopwords_english else "n't" for token in text_tokens 
+                        if token not in stopwords_english or "n't" in token]
 
         out_text = " ".join(out_text)
 
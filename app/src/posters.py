@@ -0,0 +1,328 @@
+"""
+Local cache of movie posters and their thumbnails. Posters are fetched from the TMDB image host during updates
+of movies and served to the app from disk, so that selecting a movie does not depend on the image host.
+"""
+
+import io
+import os
+import threading
+
+from collections import OrderedDict
+
+import pandas as pd
+from PIL import Image
+
+from src import metrics, tmdbutils
+
+
+# False to show posters from the TMDB image host instead of the local cache
+POSTER_CACHE = os.environ.get("POSTER_CACHE", "1") != "0"
+# directory of the cached posters and thumbnails
+POSTER_CACHE_DIR = os.environ.get("POSTER_CACHE_DIR", ".cache/posters")
+# maximum size of the cached posters and thumbnails in MB, least recently used posters are removed first
+POSTER_CACHE_MB = float(os.environ.get("POSTER_CACHE_MB", 200))
+# TMDB image size of the cached posters
+POSTER_SIZE = os.environ.get("POSTER_SIZE", "w500")
+# width of the thumbnails shown in the app in pixels
+POSTER_THUMB_WIDTH = int(os.environ.get("POSTER_THUMB_WIDTH", 300))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class PosterCache:
+    """
+    Posters and their thumbnails in a directory, bounded in size with least recently used eviction.
+    Recency is kept in the modification times of the files, so that it survives restarts. Processes can share
+    the directory, files removed by another process are misses.
+    """
+
+    def __init__(self, directory:str, max_bytes:int, thumb_width:int = 300):
+        """
+        Args:
+            directory (str): cache directory
+            max_bytes (int): maximum size of posters and thumbnails
+            thumb_width (int, optional): width of the thumbnails in pixels. Defaults to 300
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.thumb_width = thumb_width
+
+        self.lock = threading.Lock()
+        # poster name to bytes of poster and thumbnail, least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+        os.makedirs(os.path.join(directory, "posters"), exist_ok= True)
+        os.makedirs(os.path.join(directory, "thumbs"), exist_ok= True)
+
+        self._scan()
+
+    def files(self, poster_path:str) -> tuple:
+        """
+        Returns file locations of the poster and its thumbnail
+
+        Args:
+            poster_path (str): poster_path of a movie e.g. /kqjL17yufvn9OVLyXYpvtyrFfak.jpg
+        Returns:
+            tuple: poster file, thumbnail file
+        """
+        # only the file name of TMDB paths is used, paths can not point outside the cache directory
+        name = os.path.basename(poster_path)
+        if name in ("", ".", ".."):
+            raise ValueError(f"Invalid poster path {poster_path}")
+
+        return (os.path.join(self.directory, "posters", name),
+                os.path.join(self.directory, "thumbs", os.path.splitext(name)[0] + ".jpg"))
+
+    def __contains__(self, poster_path:str) -> bool:
+        return os.path.exists(self.files(poster_path)[1])
+
+    def get(self, poster_path:str, thumb:bool = True) -> str:
+        """
+        Returns file of a cached poster and marks it as recently used
+
+        Args:
+            poster_path (str): poster_path of a movie
+            thumb (bool, optional): True for the thumbnail, False for the poster. Defaults to True
+        Returns:
+            str: file location, None if the poster is not cached
+        """
+        poster_file, thumb_file = self.files(poster_path)
+        name = os.path.basename(poster_file)
+
+        with self.lock:
+            if not (os.path.exists(poster_file) and os.path.exists(thumb_file)):
+                if name in self.entries:
+                    self.size -= self.entries.pop(name)
+                self.counters["misses"] += 1
+                return None
+
+            # cached by another process
+            if name not in self.entries:
+                self._add(name, _file_size(poster_file) + _file_size(thumb_file))
+
+            self.entries.move_to_end(name)
+            self.counters["hits"] += 1
+
+        try:
+            os.utime(poster_file)
+        except OSError:
+            pass
+
+        return thumb_file if thumb else poster_file
+
+    def put(self, poster_path:str, content:bytes) -> str:
+        """
+        Stores a poster with its thumbnail and removes least recently used posters while the cache is too large
+
+        Args:
+            poster_path (str): poster_path of a movie
+            content (bytes): image file content
+        Returns:
+            str: thumbnail file location
+        Raises:
+            OSError: if the content is not an image
+        """
+        poster_file, thumb_file = self.files(poster_path)
+        thumbnail = self.thumbnail(content)
+
+        _write_file(poster_file, content)
+        _write_file(thumb_file, thumbnail)
+
+        with self.lock:
+            self._add(os.path.basename(poster_file), len(content) + len(thumbnail))
+
+        return thumb_file
+
+    def thumbnail(self, content:bytes) -> bytes:
+        """
+        Returns JPEG thumbnail of an image with the thumbnail width, images are not scaled up
+
+        Args:
+            content (bytes): image file content
+        Returns:
+            bytes: thumbnail file content
+        """
+        with Image.open(io.BytesIO(content)) as img:
+            img.thumbnail((self.thumb_width, self.thumb_width * 4))
+
+            output = io.BytesIO()
+            img.convert("RGB").save(output, "JPEG", quality= 85, optimize= True)
+
+        return output.getvalue()
+
+    def stats(self) -> dict:
+        """
+        Returns hits, misses, evictions, entries and bytes of the cache
+        """
+        with self.lock:
+            return {**self.counters, "entries": len(self.entries), "bytes": self.size}
+
+    def _add(self, name:str, size:int):
+        # called with the lock held
+        self.size += size - self.entries.pop(name, 0)
+        self.entries[name] = size
+
+        # the latest poster is kept, even if it is larger than the cache
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            old_name, old_size = self.entries.popitem(last= False)
+            self.size -= old_size
+            self.counters["evictions"] += 1
+
+            for file in self.files(old_name):
+                try:
+                    os.remove(file)
+                except FileNotFoundError:
+                    pass
+
+    def _scan(self):
+        poster_dir = os.path.join(self.directory, "posters")
+        names = [name for name in os.listdir(poster_dir) if not name.endswith(".tmp")]
+
+        with self.lock:
+            for name in sorted(names, key= lambda name: _file_mtime(os.path.join(poster_dir, name))):
+                poster_file, thumb_file = self.files(name)
+                if os.path.exists(thumb_file):
+                    self._add(name, _file_size(poster_file) + _file_size(thumb_file))
+
+
+def get_cache() -> PosterCache:
+    """
+    Returns shared poster cache or None if caching is disabled
+    """
+    global _cache
+
+    if not POSTER_CACHE:
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = PosterCache(POSTER_CACHE_DIR, int(POSTER_CACHE_MB * 2 ** 20), thumb_width= POSTER_THUMB_WIDTH)
+
+    return _cache
+
+
+def fetch_poster(poster_path:str) -> str:
+    """
+    Fetches a poster from the TMDB image host into the cache
+
+    Args:
+        poster_path (str): poster_path of a movie
+    Returns:
+        str: thumbnail file location, None if the poster could not be fetched
+    """
+    content = tmdbutils.get_image(poster_path, size= POSTER_SIZE)
+
+    if content is None:
+        metrics.count("poster_fetch_errors")
+        return None
+
+    try:
+        thumb_file = get_cache().put(poster_path, content)
+    except OSError:
+        # not an image e.g. an error page of a proxy
+        metrics.count("poster_fetch_errors")
+        return None
+
+    metrics.count("posters_fetched")
+
+    return thumb_file
+
+
+def prefetch(movies_df: pd.DataFrame, api_key:str = None) -> int:
+    """
+    Fetches posters of movies that are not cached yet in parallel threads, e.g. during an update of movies
+
+    Args:
+        movies_df (DataFrame): movies with id and poster_path columns
+        api_key (str, optional): api key for TMDB api, not needed by the image host. Defaults to None
+    Returns:
+        int: number of fetched posters
+    """
+    poster_cache = get_cache()
+
+    if poster_cache is None or len(movies_df) == 0:
+        return 0
+
+    missing = {
+        int(m_id): poster_path for m_id, poster_path in zip(movies_df["id"], movies_df["poster_path"])
+        if isinstance(poster_path, str) and poster_path and poster_path not in poster_cache
+    }
+
+    if len(missing) == 0:
+        return 0
+
+    def fetch_movie_poster(m_id:int, api_key:str):
+        return fetch_poster(missing[m_id])
+
+    thumb_files = tmdbutils.fetch_many(fetch_movie_poster, m_ids= list(missing), api_key= api_key)
+
+    return sum(thumb_file is not None for thumb_file in thumb_files)
+
+
+def get_poster(poster_path:str, thumb:bool = True, fetch:bool = True) -> str:
+    """
+    Returns file of a cached poster. Posters that are not cached yet e.g. after a warm start are fetched.
+
+    Args:
+        poster_path (str): poster_path of a movie
+        thumb (bool, optional): True for the thumbnail, False for the poster. Defaults to True
+        fetch (bool, optional): True to fetch a poster that is not cached. Defaults to True
+    Returns:
+        str: file location, None if caching is disabled or the poster is not available
+    """
+    poster_cache = get_cache()
+
+    if poster_cache is None or not poster_path:
+        return None
+
+    poster_file = poster_cache.get(poster_path, thumb= thumb)
+
+    if poster_file is None and fetch and fetch_poster(poster_path) is not None:
+        poster_file = poster_cache.get(poster_path, thumb= thumb)
+
+    return poster_file
+
+
+@metrics.register_collector
+def cache_metrics():
+    """
+    Size and hit counters of the poster cache for the metrics export
+    """
+    if _cache is None:
+        return
+
+    stats = _cache.stats()
+
+    yield "cache_entries", {"cache": "poster"}, stats["entries"]
+    yield "cache_bytes", {"cache": "poster"}, stats["bytes"]
+
+    lookups = stats["hits"] + stats["misses"]
+    yield "cache_hit_ratio", {"cache": "poster"}, round(stats["hits"] / lookups, 4) if lookups else 0.
+    yield "cache_evictions_total", {"cache": "poster"}, stats["evictions"]
+
+
+def _write_file(path:str, content:bytes):
+    # written to a temporary file and renamed, readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+
+    os.replace(tmp_path, path)
+
+
+def _file_size(path:str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _file_mtime(path:str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.
@@ -0,0 +1,298 @@
+"""
+Columnar snapshots of the dataset: movies, crew and cast, reviews and stored scores, one Parquet file per table
+and a manifest with row counts, column types and checksums.
+
+An empty DB is warm started from the latest snapshot in seconds, an incremental update then catches up with TMDB.
+Snapshots are also reproducible datasets for the benchmarks.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+from sqlalchemy import engine
+
+from src import cache, db, metrics
+
+
+# directory of the snapshots, one sub directory per snapshot
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", ".cache/snapshots")
+# True to export a snapshot after every successful update
+SNAPSHOT_AFTER_REFRESH = os.environ.get("SNAPSHOT_AFTER_REFRESH", "0") == "1"
+# number of snapshots kept, older ones are removed after an export. 0 to keep all
+SNAPSHOT_KEEP = int(os.environ.get("SNAPSHOT_KEEP", 3))
+# True to load the latest snapshot into an empty DB instead of a full update from TMDB
+WARM_START = os.environ.get("WARM_START", "1") == "1"
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+
+# tables of a snapshot with the sort order of their rows, so that snapshots of the same data are identical.
+# Cleaned review texts are a cache, they are not part of snapshots
+SNAPSHOT_TABLES = {
+    db.MOVIE_TABLE: ["id"],
+    db.M_CREW_TABLE: ["m_id", "id", "job"],
+    db.M_CAST_TABLE: ["m_id", "order", "id"],
+    db.M_REVIEW_TABLE: ["m_id", "id"],
+    db.M_SCORE_TABLE: ["id", "stwords", "hyperlinks"],
+}
+
+
+class SnapshotError(Exception):
+    """
+    Raised when a snapshot is incomplete or its files do not match the manifest
+    """
+
+
+def export_snapshot(con: engine, directory:str = None) -> str:
+    """
+    Exports the tables of a consistent view of the DB into a new snapshot. The snapshot is written to a temporary
+    directory and renamed when complete, readers never see a partial snapshot.
+
+    Args:
+        con (engine): SQLAlchemy engine
+        directory (str, optional): directory of the snapshots. Defaults to SNAPSHOT_DIR
+    Returns:
+        str: path of the new snapshot
+    """
+    directory = directory or SNAPSHOT_DIR
+    created_at = datetime.datetime.now(datetime.timezone.utc)
+
+    with metrics.timer("snapshot_export"):
+        frames = {}
+        columns = {}
+
+        # all tables are read from the same DB snapshot, an update running meanwhile is not seen partially
+        with con.connect().execution_options(isolation_level= "REPEATABLE READ") as read_con, read_con.begin():
+            data_version = db.get_data_version(read_con)
+            schema_version = read_con.execute(f"select max(version) from {db.SCHEMA_VERSION_TABLE}").scalar()
+
+            for table_name, order in SNAPSHOT_TABLES.items():
+                columns[table_name] = db.get_table_columns(read_con, table_name)
+                col_list = ", ".join(f'"{col}"' for col in columns[table_name])
+                order_list = ", ".join(f'"{col}"' for col in order)
+                frames[table_name] = db.project_frame(
+                        pd.read_sql(f"select {col_list} from {table_name} order by {order_list}", read_con),
+                        columns[table_name]
+                    )
+
+        name = f"snapshot-{created_at:%Y%m%dT%H%M%SZ}-v{data_version}"
+        path = os.path.join(directory, name)
+        tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+        os.makedirs(tmp_path)
+
+        tables = {}
+        try:
+            for table_name, df in frames.items():
+                file_name = f"{table_name}.parquet"
+                df.to_parquet(os.path.join(tmp_path, file_name), index= False)
+
+                tables[table_name] = {
+                    "file": file_name,
+                    "rows": len(df),
+                    "columns": columns[table_name],
+                    "sha256": file_sha256(os.path.join(tmp_path, file_name)),
+                }
+
+            manifest = {
+                "format": SNAPSHOT_FORMAT,
+                "created_at": created_at.isoformat(timespec= "seconds"),
+                "schema_version": schema_version,
+                "data_version": data_version,
+                "tables": tables,
+            }
+            with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+                json.dump(manifest, f, indent= 2)
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors= True)
+            raise
+
+    metrics.count("snapshot_rows_exported", sum(table["rows"] for table in tables.values()))
+
+    return path
+
+
+def list_snapshots(directory:str = None) -> list:
+    """
+    Returns paths of the complete snapshots in a directory, oldest first
+
+    Args:
+        directory (str, optional): directory of the snapshots. Defaults to SNAPSHOT_DIR
+    Returns:
+        list: snapshot paths
+    """
+    directory = directory or SNAPSHOT_DIR
+    if not os.path.isdir(directory):
+        return []
+
+    # names start with the creation time, temporary directories start with a dot
+    return [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory))
+        if name.startswith("snapshot-") and os.path.isfile(os.path.join(directory, name, MANIFEST_FILE))
+    ]
+
+
+def latest_snapshot(directory:str = None) -> str:
+    """
+    Returns path of the latest complete snapshot, None if there is none
+
+    Args:
+        directory (str, optional): directory of the snapshots. Defaults to SNAPSHOT_DIR
+    Returns:
+        str: snapshot path
+    """
+    snapshots = list_snapshots(directory)
+    return snapshots[-1] if snapshots else None
+
+
+def prune_snapshots(directory:str = None, keep:int = None) -> list:
+    """
+    Removes all but the latest snapshots
+
+    Args:
+        directory (str, optional): directory of the snapshots. Defaults to SNAPSHOT_DIR
+        keep (int, optional): number of snapshots kept, 0 to keep all. Defaults to SNAPSHOT_KEEP
+    Returns:
+        list: paths of the removed snapshots
+    """
+    keep = SNAPSHOT_KEEP if keep is None else keep
+    if keep <= 0:
+        return []
+
+    removed = list_snapshots(directory)[:-keep]
+    for path in removed:
+        shutil.rmtree(path, ignore_errors= True)
+
+    return removed
+
+
+def read_manifest(path:str) -> dict:
+    """
+    Returns manifest of a snapshot
+
+    Args:
+        path (str): snapshot path
+    Returns:
+        dict: manifest
+    Raises:
+        SnapshotError: if the manifest is missing or of an unknown format
+    """
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"No readable manifest in {path}: {e}")
+
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Snapshot {path} has unknown format {manifest.get('format')}")
+
+    return manifest
+
+
+def read_snapshot(path:str, verify:bool = True) -> tuple:
+    """
+    Reads the tables of a snapshot into DataFrames with the columns of the manifest. Loading them with
+    db.bulk_load drops columns that were removed since the export, new columns are empty.
+
+    Args:
+        path (str): snapshot path
+        verify (bool, optional): True to compare checksums and row counts with the manifest. Defaults to True
+    Returns:
+        tuple: manifest and table name to DataFrame mapping
+    Raises:
+        SnapshotError: if a table is missing or does not match the manifest
+    """
+    manifest = read_manifest(path)
+    frames = {}
+
+    for table_name in SNAPSHOT_TABLES:
+        table = manifest["tables"].get(table_name)
+        if table is None:
+            raise SnapshotError(f"Snapshot {path} has no table {table_name}")
+
+        file_path = os.path.join(path, table["file"])
+        if verify and file_sha256(file_path) != table["sha256"]:
+            raise SnapshotError(f"Checksum of {file_path} does not match the manifest")
+
+        df = pd.read_parquet(file_path)
+        if verify and len(df) != table["rows"]:
+            raise SnapshotError(f"{file_path} has {len(df)} rows, manifest has {table['rows']}")
+
+        frames[table_name] = db.project_frame(df, table["columns"])
+
+    return manifest, frames
+
+
+def load_snapshot(con: engine, path:str = None) -> dict:
+    """
+    Replaces the tables of the DB with the data of a snapshot and refreshes the overview in a single transaction
+    and invalidates cached reads of this process. Stored scores are loaded, reviews are not scored again.
+    Callers hold the refresh lock (db.try_advisory_lock), so that no update runs meanwhile.
+
+    Args:
+        con (engine): SQLAlchemy engine
+        path (str, optional): snapshot path. Defaults to the latest snapshot in SNAPSHOT_DIR
+    Returns:
+        dict: manifest of the loaded snapshot
+    Raises:
+        SnapshotError: if there is no snapshot or it does not match its manifest
+    """
+    path = path or latest_snapshot()
+    if path is None:
+        raise SnapshotError(f"No snapshot in {SNAPSHOT_DIR}")
+
+    with metrics.timer("snapshot_load"):
+        manifest, frames = read_snapshot(path)
+
+        with con.begin() as trans_con:
+            rows_written = db.bulk_load(frames, trans_con)
+            db.refresh_overview(trans_con)
+        cache.invalidate()
+
+    metrics.count("rows_written", rows_written)
+
+    return manifest
+
+
+def warm_start(con: engine, path:str = None) -> dict:
+    """
+    Loads the latest snapshot if the DB has no movies yet. Nothing is loaded while an update is running.
+
+    Args:
+        con (engine): SQLAlchemy engine
+        path (str, optional): snapshot path. Defaults to the latest snapshot in SNAPSHOT_DIR
+    Returns:
+        dict: manifest of the loaded snapshot, None if nothing was loaded
+    Raises:
+        SnapshotError: if the snapshot does not match its manifest
+    """
+    path = path or latest_snapshot()
+    if path is None:
+        return None
+
+    with db.try_advisory_lock(con) as acquired:
+        if not acquired:
+            return None
+
+        if db.has_movies(con):
+            return None
+
+        return load_snapshot(con, path)
+
+
+def file_sha256(path:str) -> str:
+    """
+    Returns SHA-256 hex digest of a file
+    """
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
@@ -3,67 +3,483 @@ Helper functions to get information from TMDB API
   
 """
 import os
+import time
+import threading
 import requests
 import json
 import pandas as pd
-import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-tmdb_url = "https://api.themoviedb.org/3"
+from src import metrics
+from src.httpcache import ResponseCache
+
+
+# base url of the TMDB api, e.g. a local mock server for load tests
+tmdb_url = os.environ.get("TMDB_API_URL", "https://api.themoviedb.org/3").rstrip("/")
+
+# base url of the TMDB image host, e.g. a local mock server in tests
+tmdb_image_url = os.environ.get("TMDB_IMAGE_URL", "https://image.tmdb.org/t/p").rstrip("/")
 
 api_key = "f78ae83838fa87074abc367e0e58fdc0"
 
+# maximum parallel requests to TMDB
+TMDB_MAX_WORKERS = int(os.environ.get("TMDB_MAX_WORKERS", 8))
+# requests per second allowed to TMDB
+TMDB_RATE_LIMIT = float(os.environ.get("TMDB_RATE_LIMIT", 40))
+# max attempts for a request that is rate limited by TMDB
+TMDB_MAX_ATTEMPTS = 5
+# seconds to connect to TMDB and to wait for data of a response, a request that hangs fails instead of an update
+TMDB_TIMEOUT = (float(os.environ.get("TMDB_CONNECT_TIMEOUT", 5)), float(os.environ.get("TMDB_READ_TIMEOUT", 30)))
+# pages of popular movies fetched with an update, 20 movies per page
+TMDB_PAGE_LIMIT = int(os.environ.get("TMDB_PAGE_LIMIT", 5))
+# crew jobs kept of the credits of a movie, empty to keep all crew
+TMDB_CREW_JOBS = [job.strip() for job in os.environ.get("TMDB_CREW_JOBS", "Director").split(",") if job.strip()]
+# cast members kept by billing order of the credits of a movie, 0 to keep all cast. The overview shows the lead actor
+# of order 1, so orders 0 and 1 are always kept and values below 2 keep 2 members
+TMDB_CAST_TOP_N = int(os.environ.get("TMDB_CAST_TOP_N", 5))
+# billing order of the lead actor shown in the overview
+LEAD_ACTOR_ORDER = 1
+
+# columns kept of each TMDB frame with their pandas dtype, other columns are dropped right after parsing.
+# ids fit in 32 bits, nullable integers keep missing values, repeated texts are categorical
+TMDB_COLUMNS = {
+  "movie": {
+    "id": "Int32",
+    "title": "object",
+    "release_date": "object",
+    "popularity": "float32",
+    "poster_path": "object",
+    "genre_names": "category",
+  },
+  "crew": {
+    "id": "Int32",
+    "name": "object",
+    "job": "category",
+  },
+  "cast": {
+    "id": "Int32",
+    "name": "object",
+    "order": "Int16",
+  },
+  "review": {
+    "id": "object",
+    "author_details_username": "object",
+    "content": "object",
+    "created_at": "object",
+  },
+}
+
+# persistent response cache, set TMDB_CACHE=0 to disable
+TMDB_CACHE = os.environ.get("TMDB_CACHE", "1") != "0"
+TMDB_CACHE_PATH = os.environ.get("TMDB_CACHE_PATH", ".cache/tmdb_http_cache.sqlite")
+# time to live in seconds per endpoint
+TMDB_CACHE_TTLS = [
+  (r"/genre/movie/list", 7 * 24 * 3600),
+  (r"/movie/\d+/credits", 24 * 3600),
+  (r"/movie/\d+/reviews", 3600),
+  # details with credits and first page of reviews
+  (r"/movie/\d+$", 3600),
+  (r"/movie/popular", 3600),
+]
+
+
+class TokenBucket:
+  """
+  Thread safe token bucket rate limiter. 
+  A rate limit response from the server pauses all callers until the retry time has passed.
+  """
 
-def get_daily_pop_movies(api_key:str, page_limit:int=5):
+  def __init__(self, rate:float, capacity:float = None):
+    """
+    Args:
+      rate (float): tokens added per second
+      capacity (float, optional): maximum tokens in the bucket. Defaults to rate
+    """
+    self.rate = rate
+    self.capacity = capacity or rate
+    self.tokens = self.capacity
+    self.updated = time.monotonic()
+    self.paused_until = 0.
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    """
+    Blocks until a token is available
+    """
+    while True:
+      with self.lock:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if now < self.paused_until:
+          wait = self.paused_until - now
+        elif self.tokens >= 1:
+          self.tokens -= 1
+          return
+        else:
+          wait = (1 - self.tokens) / self.rate
+
+      time.sleep(wait)
+
+  def pause(self, seconds:float):
+    """
+    Stops handing out tokens for given seconds e.g. after 429 response
+
+    Args:
+      seconds (float): seconds to wait
+    """
+    with self.lock:
+      self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+      self.tokens = 0
+
+
+class TMDBRequestError(Exception):
+  """
+  Raised when a request to TMDB fails after retries, e.g. a page of a list, so that a partial result
+  is not taken for the complete one
   """
-  get popular movies from the TMDB using standard API
 
-  Inputs:
+  def __init__(self, url:str, status:int, page:int = None):
+    """
+    Args:
+      url (str): url of the endpoint
+      status (int): http status of the last attempt, None if there was no response e.g. after a timeout
+      page (int, optional): page number of a paged endpoint. Defaults to None
+    """
+    self.url = url
+    self.status = status
+    self.page = page
+
+    where = url if page is None else f"{url} page {page}"
+    reason = "without response" if status is None else f"with status {status}"
+    super().__init__(f"TMDB request {where} failed {reason}")
+
+
+rate_limiter = TokenBucket(TMDB_RATE_LIMIT)
+
+_session = None
+_cache = None
+_session_lock = threading.Lock()
+
+
+def project(df: pd.DataFrame, kind:str) -> pd.DataFrame:
+  """
+  Returns DataFrame with only the columns of TMDB_COLUMNS for the kind of frame in their compact dtypes.
+  Missing columns are empty.
+
+  Args:
+    df (DataFrame): parsed TMDB results
+    kind (str): movie, crew, cast or review
+  Returns:
+    DataFrame: projected DataFrame
+  """
+  return compact(df.reindex(columns = list(TMDB_COLUMNS[kind])), kind)
+
+
+def compact(df: pd.DataFrame, kind:str) -> pd.DataFrame:
+  """
+  Converts columns of TMDB_COLUMNS for the kind of frame to their compact dtypes, other columns are kept as they are.
+  Used again after frames are stacked, since concat turns categorical columns with different categories into objects.
+
+  Args:
+    df (DataFrame): DataFrame with columns of TMDB_COLUMNS
+    kind (str): movie, crew, cast or review
+  Returns:
+    DataFrame: DataFrame with compact dtypes
+  """
+  dtypes = {col: dtype for col, dtype in TMDB_COLUMNS[kind].items() if col in df}
+
+  return df.astype(dtypes)
+
+
+def filter_credits(cast_df: pd.DataFrame, crew_df: pd.DataFrame):
+  """
+  Keeps crew with jobs in TMDB_CREW_JOBS and cast with billing order below TMDB_CAST_TOP_N.
+  The lead actor and director of the overview are always kept
+
+  Args:
+    cast_df (DataFrame): projected cast of a movie
+    crew_df (DataFrame): projected crew of a movie
+  Returns:
+    (DataFrame, DataFrame): filtered cast and crew
+  """
+  if TMDB_CAST_TOP_N > 0:
+    cast_df = cast_df[cast_df['order'] < max(TMDB_CAST_TOP_N, LEAD_ACTOR_ORDER + 1)].reset_index(drop= True)
+
+  if len(TMDB_CREW_JOBS) > 0:
+    crew_df = crew_df[crew_df['job'].isin(TMDB_CREW_JOBS + ["Director"])].reset_index(drop= True)
+
+  return cast_df, crew_df
+
+
+def get_session() -> requests.Session:
+  """
+  Returns shared http session with connection pool sized for parallel requests and retries for server errors
+
+  Returns:
+    requests.Session: shared session
+  """
+  global _session
+
+  with _session_lock:
+    if _session is None:
+      retry = Retry(
+                total = 3,
+                backoff_factor = .5,
+                status_forcelist = [500, 502, 503, 504],
+                allowed_methods = ["GET"],
+                # the last response is returned, callers raise TMDBRequestError with its status
+                raise_on_status = False,
+                # 429 responses are handled by the shared rate limiter, so that all threads pause
+                respect_retry_after_header = False
+              )
+      adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = TMDB_MAX_WORKERS, max_retries = retry)
+
+      _session = requests.Session()
+      _session.mount("https://", adapter)
+      _session.mount("http://", adapter)
+
+  return _session
+
+
+def get_cache() -> ResponseCache:
+  """
+  Returns shared persistent response cache or None if caching is disabled
+
+  Returns:
+    ResponseCache: shared response cache
+  """
+  global _cache
+
+  with _session_lock:
+    if _cache is None and TMDB_CACHE:
+      _cache = ResponseCache(TMDB_CACHE_PATH, ttls = TMDB_CACHE_TTLS)
+
+  return _cache
+
+
+def cache_stats() -> dict:
+  """
+  Returns hit/miss counters of the response cache
+
+  Returns:
+    dict: hits, misses, revalidated and hit_ratio
+  """
+  cache = get_cache()
+
+  return cache.stats() if cache is not None else {}
+
+
+def tmdb_get(url:str, params:dict) -> requests.Response:
+  """
+  GET request to TMDB through response cache, shared session and rate limiter. 
+  Expired cache entries are revalidated with ETag / Last-Modified where TMDB provides them.
+  Requests with 429 response are retried after time given in Retry-After header.
+
+  Args:
+    url (str): complete url of the endpoint
+    params (dict): query parameters
+  Returns:
+    requests.Response: response of the last attempt or cached response
+  Raises:
+    TMDBRequestError: if the request times out or TMDB is not reachable, see TMDB_TIMEOUT
+  """
+  cache = get_cache()
+
+  if cache is None:
+    return _tmdb_get(url, params)
+
+  key = cache.key(url, params)
+  entry = cache.get(key)
+
+  if cache.is_fresh(url, entry):
+    cache.count("hits")
+    metrics.count("http_cache_hits")
+    return _cached_response(url, entry)
+
+  headers = {}
+  if entry is not None:
+    if entry["etag"]:
+      headers["If-None-Match"] = entry["etag"]
+    if entry["last_modified"]:
+      headers["If-Modified-Since"] = entry["last_modified"]
+
+  res = _tmdb_get(url, params, headers = headers)
+
+  if res.status_code == 304 and entry is not None:
+    cache.touch(key)
+    cache.count("revalidated")
+    metrics.count("http_cache_revalidated")
+    return _cached_response(url, entry)
+
+  cache.count("misses")
+  metrics.count("http_cache_misses")
+
+  if res.ok:
+    cache.put(key, res.content, res.headers.get("ETag"), res.headers.get("Last-Modified"))
+
+  return res
+
+
+def _tmdb_get(url:str, params:dict, headers:dict = None) -> requests.Response:
+  session = get_session()
+
+  for _ in range(TMDB_MAX_ATTEMPTS):
+    with metrics.timer("http_rate_wait"):
+      rate_limiter.acquire()
+
+    try:
+      with metrics.timer("http_fetch"):
+        res = session.get(url, params = params, headers = headers, timeout = TMDB_TIMEOUT)
+    except (requests.Timeout, requests.ConnectionError):
+      # timeouts of the last retry are raised as connection errors
+      metrics.count("http_timeouts")
+      raise TMDBRequestError(url, None)
+    finally:
+      metrics.count("http_requests")
+
+    if res.status_code != 429:
+      break
+
+    metrics.count("http_rate_limited")
+    rate_limiter.pause(_retry_after(res))
+
+  return res
+
+
+def _cached_response(url:str, entry:dict) -> requests.Response:
+  res = requests.Response()
+  res.status_code = 200
+  res.url = url
+  res.encoding = "utf-8"
+  res._content = entry["body"]
+  res.headers["X-Cache"] = "HIT"
+  return res
+
+
+def _retry_after(res: requests.Response, default:float = 1.) -> float:
+  try:
+    return float(res.headers.get("Retry-After", default))
+  except ValueError:
+    return default
+
+
+def fetch_many(fetch_func, m_ids, api_key:str, max_workers:int = None) -> list:
+  """
+  Calls a per movie fetch function e.g. get_movie_details for many movies in parallel threads. 
+
+  Args:
+    fetch_func (callable): function with m_id and api_key arguments
+    m_ids (List(int)): TMDB movie ids
     api_key (str): api key for TMDB api
-    page_limit (page_limit, optional): number of pages to download. Default: 20
-  output:
-    dataframe: pandas dataframe with basic information returned by the api
+    max_workers (int, optional): maximum parallel requests. Defaults to TMDB_MAX_WORKERS
+  Returns:
+    list: results of fetch_func in the same order as m_ids
   """
-  pop_movie_path = "/movie/popular"
+  with ThreadPoolExecutor(max_workers = max_workers or TMDB_MAX_WORKERS) as executor:
+    # timings of the threads are added to the recordings of the caller
+    futures = [executor.submit(metrics.in_context(fetch_func), m_id = m_id, api_key = api_key) for m_id in m_ids]
+    return [future.result() for future in futures]
 
-  url = tmdb_url + pop_movie_path
 
+def iter_pages(path:str, params:dict, page_limit:int = None):
+  """
+  Generator over pages of a TMDB list endpoint e.g. /movie/popular. 
+  Next page is fetched in the background while the current page is processed by the caller.
+
+  Args:
+    path (str): endpoint path e.g. /movie/popular
+    params (dict): query parameters without page
+    page_limit (int, optional): maximum number of pages. Defaults to all pages
+  Yields:
+    list: results of each page
+  Raises:
+    TMDBRequestError: if a page can not be fetched
+  """
+  url = tmdb_url + path
+
+  page = _get_page(url, params, 1)
+
+  total_pages = page['total_pages']
+
+  if page_limit is not None:
+    total_pages = min(page_limit, total_pages)
+
+  with ThreadPoolExecutor(max_workers = 1) as executor:
+    next_page = executor.submit(metrics.in_context(_get_page), url, params, 2) if total_pages > 1 else None
+
+    yield page['results']
+
+    for page_no in range(2, total_pages + 1):
+      page = next_page.result()
+
+      if page_no < total_pages:
+        next_page = executor.submit(metrics.in_context(_get_page), url, params, page_no + 1)
+
+      yield page['results']
+
+
+def _get_page(url:str, params:dict, page:int):
+  res = tmdb_get(url, params = {**params, "page": page})
+
+  if not res.ok:
+    raise TMDBRequestError(url, res.status_code, page = page)
+
+  with metrics.timer("json_parse"):
+    return json.loads(res.text)
+
+
+def iter_daily_pop_movies(api_key:str, page_limit:int = None):
+  """
+  get popular movies from the TMDB page by page
+
+  Inputs:
+    api_key (str): api key for TMDB api
+    page_limit (page_limit, optional): number of pages to download. Default: TMDB_PAGE_LIMIT
+  Yields:
+    dataframe: pandas dataframe with basic information returned by the api for each page
+  """
   params = {
     "api_key" : api_key,
     "language": "en-US",
-    "page" : 1
     }
 
-  res= requests.get(url,params= params)
+  genre_dict = get_movie_genres(api_key)
 
-  movies = json.loads(res.text)
-  
-  # find total number of pages
-  total_pages = movies['total_pages']
-  
-  total_pages = np.minimum(page_limit, total_pages)
+  page_limit = TMDB_PAGE_LIMIT if page_limit is None else page_limit
 
-  movie_df = pd.DataFrame(movies['results'])
+  for movies in iter_pages("/movie/popular", params, page_limit = page_limit):
 
-  # get all additional  pages if any exists and append to the DataFrame
-  for page in range(2,total_pages):
-    
-    params['page'] = page
-    res = requests.get(url, params=params)
-    movies = json.loads(res.text)
- 
-    cur_page_movies_df = pd.DataFrame(movies['results'])
-  
-    movie_df = pd.concat([movie_df , cur_page_movies_df ], ignore_index= True)
-    # movie_df.append(cur_page_movies_df,ignore_index= True)
+    with metrics.timer("json_parse"):
+      movie_df = pd.DataFrame(movies)
 
+      movie_df['genre_names'] = movie_df['genre_ids']\
+                                .apply(lambda ids : ", ".join([genre_dict.get(id,"") for id in ids]))
 
-  genre_dict = get_movie_genres(api_key)
+      movie_df = project(movie_df, "movie")
 
-  movie_df['genre_names'] = movie_df['genre_ids']\
-                            .apply(lambda ids : ", ".join([genre_dict.get(id,"") for id in ids]))
+    yield movie_df
 
-  return movie_df
+
+def get_daily_pop_movies(api_key:str, page_limit:int = None):
+  """
+  get popular movies from the TMDB using standard API
+
+  Inputs:
+    api_key (str): api key for TMDB api
+    page_limit (page_limit, optional): number of pages to download. Default: TMDB_PAGE_LIMIT
+  output:
+    dataframe: pandas dataframe with basic information returned by the api
+  """
+
+  movie_df = compact(pd.concat(iter_daily_pop_movies(api_key, page_limit = page_limit), ignore_index= True), "movie")
+
+  # popularity can change while paging, a movie can appear on two pages
+  return movie_df.drop_duplicates(subset= "id", ignore_index= True)
 
 
 # genre
@@ -76,6 +492,8 @@ def get_movie_genres(api_key:str):
     api_key (str) : API key for TMDB api
   Returns:
       dict: Dictionary of id:name for genre id and genre name for movies
+  Raises:
+    TMDBRequestError: if the genres can not be fetched
   """
   genre_path = "/genre/movie/list"
 
@@ -86,111 +504,164 @@ def get_movie_genres(api_key:str):
     "language": "en-US"
     }
 
-  res = requests.get(url,params=params)
+  res = tmdb_get(url,params=params)
 
-  genres = json.loads(res.text)
+  if not res.ok:
+    raise TMDBRequestError(url, res.status_code)
+
+  with metrics.timer("json_parse"):
+    genres = json.loads(res.text)
 
-  genres_df = pd.json_normalize(genres['genres'])
+    genres_df = pd.json_normalize(genres['genres'])
 
   # return dictionary of genres with id:name
   return genres_df.set_index("id").to_dict()["name"]
 
 
-# actor
+# reviews
 
-def get_movie_credits(m_id:int, api_key:str):
+def iter_movie_reviews(m_id:int, api_key:str):
   """
-  Get casting and crew details of a movie from TMDB and returns the informaton as separate dataframes
+  Get reviews of the movie from TMDB page by page
 
-  Args:
-      m_id (int): TMDB movie ID
-      api_key (str) : API key for TMDB api
+  Input:
+    m_id(int) : TMDB Movie id
+    api_key (str) : TMDB api key
 
-  Returns:
-      (DataFrame, DataFrame): returns a tuple of cast and cre information
+  Yields:
+    Dataframe: Dataframe with reviews of the movie for each page
+  Raises:
+    TMDBRequestError: if a page of reviews can not be fetched
   """
-  crew_url = "/movie/{}/credits"
 
-  url = tmdb_url + crew_url
+  review_path = "/movie/{}/reviews".format(m_id)
 
   params = {
     "api_key" : api_key,
-    "language": "en-US"
+    "language": "en-US",
     }
 
-  url = url.format(m_id)
-
-  res = requests.get(url, params= params)
-
-  if not res.ok:
-    return None, None
+  for reviews in iter_pages(review_path, params):
     
-  m_credits = json.loads(res.text)
+    with metrics.timer("json_parse"):
+      reviews_df = _reviews_frame(reviews)
 
-  # separate the json into two separate Dataframes
-  cast_df = pd.DataFrame(m_credits['cast'])
+    yield reviews_df
 
-  crew_df = pd.DataFrame(m_credits['crew'])
 
-  return cast_df, crew_df
+def _reviews_frame(reviews:list) -> pd.DataFrame:
+  reviews_df = pd.json_normalize(reviews)
 
+  # update column names to convert to snake case
+  reviews_df.columns = [c.replace('.','_') for c in reviews_df.columns]
+
+  return project(reviews_df, "review")
 
-# reviews
 
 def get_movie_reviews(m_id:int, api_key:str):
   """
-  Get reviews of the movies from TMDB and return s dataframe
+  Get reviews of the movies from TMDB and return s dataframe. Only columns of TMDB_COLUMNS are kept.
 
   Input:
     m_id(int) : TMDB Movie id
     api_key (str) : TMDB api key
 
   Output:
-    Dataframe: Dataframe with all the reviews of the movie
+    Dataframe: Dataframe with all the reviews of the movie or None if the movie has no reviews or is not found
+  Raises:
+    TMDBRequestError: if a page of reviews can not be fetched. A failed fetch is not taken for a movie without reviews
   """
 
-  review_path = "/movie/{}/reviews"
+  try:
+    pages = list(iter_movie_reviews(m_id, api_key))
+  except TMDBRequestError as e:
+    if e.status == 404 and e.page == 1:
+      return None
+    raise
+
+  if len(pages) == 0:
+    return None
+  
+  return pd.concat(pages, ignore_index= True)
+
 
-  url = tmdb_url + review_path
+# details
 
-  url = url.format(m_id)
+def get_movie_details(m_id:int, api_key:str):
+  """
+  Get cast, crew and reviews of a movie from TMDB with a single request of the movie details with credits and
+  reviews appended. Further pages of reviews are requested only if the movie has more than one page of reviews.
+
+  Args:
+    m_id (int): TMDB movie ID
+    api_key (str) : API key for TMDB api
+
+  Returns:
+    (DataFrame, DataFrame, DataFrame): cast, crew and reviews of the movie, crew and cast filtered with
+                                       filter_credits and reviews same as get_movie_reviews. None for all if the movie is not found
+  Raises:
+    TMDBRequestError: if the details or a further page of reviews can not be fetched
+  """
+  url = tmdb_url + "/movie/{}".format(m_id)
 
   params = {
     "api_key" : api_key,
     "language": "en-US",
-    "page" : 1
     }
 
+  res = tmdb_get(url, params= {**params, "append_to_response": "credits,reviews"})
+
+  if res.status_code == 404:
+    return None, None, None
 
-  res = requests.get(url, params=params)
-  
   if not res.ok:
-    return None
+    raise TMDBRequestError(url, res.status_code)
 
-  reviews = json.loads(res.text)
+  with metrics.timer("json_parse"):
+    details = json.loads(res.text)
 
-  # find total number of pages
-  total_pages = reviews['total_pages']
-  # return reviews['total_pages'],reviews['total_results']
-  
-  reviews_df = pd.json_normalize(reviews['results'])
+    m_credits = details.get('credits', {})
+    cast_df, crew_df = filter_credits(
+                          project(pd.DataFrame(m_credits.get('cast', [])), "cast"),
+                          project(pd.DataFrame(m_credits.get('crew', [])), "crew")
+                        )
 
-  # print(f'total pages : {total_pages}')
+    reviews = details.get('reviews', {})
+    pages = [_reviews_frame(reviews['results'])] if reviews.get('results') else []
 
-  # get all additional  pages if any exists and append to the DataFrame
-  for page in range(2,total_pages):
-    
-    params['page'] = page
-    res = requests.get(url, params=params)
-    reviews = json.loads(res.text)
- 
-    cur_page_reviews_df = pd.json_normalize(reviews['results'])
-  
-    reviews_df.append(cur_page_reviews_df,ignore_index= True)
+  review_url = tmdb_url + "/movie/{}/reviews".format(m_id)
 
-  # update column names to convert to snake case
-  reviews_df.columns = [c.replace('.','_') for c in reviews_df.columns]
-  
-  return reviews_df
+  for page_no in range(2, reviews.get('total_pages', 1) + 1):
+    page = _get_page(review_url, params, page_no)
+
+    with metrics.timer("json_parse"):
+      pages.append(_reviews_frame(page['results']))
 
+  reviews_df = pd.concat(pages, ignore_index= True) if len(pages) > 0 else None
+
+  return cast_df, crew_df, reviews_df
+
+
+# images
+
+def get_image(image_path:str, size:str = "original") -> bytes:
+  """
+  Get an image e.g. a movie poster from the TMDB image host through the shared session.
+  The image host is not part of the api, requests are not rate limited.
+
+  Args:
+    image_path (str): image path of TMDB e.g. poster_path of a movie
+    size (str, optional): image size of TMDB e.g. w500. Defaults to "original"
+
+  Returns:
+    bytes: image file content, None if the image could not be fetched
+  """
+  try:
+    with metrics.timer("http_fetch_image"):
+      res = get_session().get(f"{tmdb_image_url}/{size}{image_path}", timeout= TMDB_TIMEOUT)
+  except requests.RequestException:
+    return None
+  finally:
+    metrics.count("http_image_requests")
 
+  return res.content if res.ok else None
@@ -3,23 +3,88 @@ General purpose utilities package to help simplify common operations
 """
 
 import io
+import os
+import hashlib
 
+import sqlalchemy as sa
 from sqlalchemy import engine
-from typing import List
-from src import tmdbutils, nlp
+from typing import List, Callable
+from src import tmdbutils, nlp, db, cache, metrics, posters
+from src.db import M_CREW_TABLE, M_CAST_TABLE, MOVIE_TABLE, M_REVIEW_TABLE, M_SCORE_TABLE, M_CLEAN_TEXT_TABLE
 
 import pandas as pd
 import streamlit as st
 
 
-M_CREW_TABLE = "t_tmdb_movie_crew"
-M_CAST_TABLE = "t_tmdb_movie_cast"
-MOVIE_TABLE = "t_tmdb_pop_movies"
-M_REVIEW_TABLE = "t_tmdb_movie_review"
+SCORE_COLUMNS = ["compound", "pos", "neu", "neg"]
+
+# (stwords, hyperlinks) pre-processing options offered in the app
+SCORE_VARIANTS = [(True, True), (True, False), (False, True), (False, False)]
+
+# sentiment rating of a stored compound score in SQL, same rule as nlp.vader_sa_rating.
+# Reviews without a score of the variant, e.g. of a left join, have no rating rather than a neutral one
+SENTIMENT_SQL = """case 
+                    when {compound} is null then null
+                    when {compound} > :thresh then 1
+                    when {compound} < -:thresh then -1
+                    else 0
+                end"""
+
+# sentiment labels of the ratings
+SENTIMENT_LABELS = {1: "positive", 0: "neutral", -1: "negative"}
 
 CSS_FILE = "./src/css/styles.css"
 
-def update_tmdb_pop_movies_sentiments(con: engine, tmdb_key:str, thresh:float = .05, stwords:bool = True, hyperlinks:bool=True):
+# reviews per page of the review browser
+REVIEW_PAGE_SIZE = int(os.environ.get("REVIEW_PAGE_SIZE", 20))
+# characters of a review shown in the review browser, full texts are loaded on demand
+REVIEW_PREVIEW_CHARS = int(os.environ.get("REVIEW_PREVIEW_CHARS", 300))
+
+# maximum cleaned review texts kept in memory, per content hash and pre-processing variant
+CLEAN_TEXT_CACHE_SIZE = int(os.environ.get("CLEAN_TEXT_CACHE_SIZE", 50000))
+# True to also keep cleaned review texts in DB, so that they survive restarts
+CLEAN_TEXT_CACHE_DB = os.environ.get("CLEAN_TEXT_CACHE_DB", "0") == "1"
+
+clean_text_cache = cache.LRUCache(CLEAN_TEXT_CACHE_SIZE)
+
+
+class RefreshInProgressError(Exception):
+    """
+    Raised when an update of movies is started while another update is running
+    """
+
+
+@metrics.register_collector
+def cache_metrics():
+    """
+    Sizes and hit counters of the in memory caches for the metrics export
+    """
+    read_stats = cache.stats()
+
+    yield "cache_entries", {"cache": "read"}, read_stats["entries"]
+    yield "cache_entries", {"cache": "clean_text"}, len(clean_text_cache)
+    yield "cache_hit_ratio", {"cache": "read"}, round(read_stats["hit_ratio"], 4)
+
+    lookups = clean_text_cache.hits + clean_text_cache.misses
+    yield "cache_hit_ratio", {"cache": "clean_text"}, round(clean_text_cache.hits / lookups, 4) if lookups else 0.
+
+
+def report_progress(progress: Callable, **counts):
+    """
+    Reports progress increments of an update to the metrics counters and, if a progress callback is given, to the callback
+
+    Args:
+        progress (Callable): callback accepting movies_fetched, reviews_scored and rows_written keyword arguments or None
+        counts: progress increments
+    """
+    for counter, value in counts.items():
+        metrics.count(counter, value)
+
+    if progress is not None:
+        progress(**counts)
+
+
+def update_tmdb_pop_movies_sentiments(con: engine, tmdb_key:str, incremental:bool = False, progress: Callable = None):
     """
     Updates daily list of popular movies from TMDB. 
     get additional information about the moview e.g. crew and cast.
@@ -27,52 +92,161 @@ def update_tmdb_pop_movies_sentiments(con: engine, tmdb_key:str, thresh:float =
     perform sentiment analysis on the reviews.
 
 
-    update Database with new information
+    update Database with new information. Reviews are scored for all pre-processing variants of SCORE_VARIANTS 
+    before they are written, new data and the movie overview are committed together.
 
     Inputs:
         con (sqlalchemy engine) : SQLAlchemy engine to the postgresql DB
         tmdb_key (str) : TMDB api key
-        thresh (float, optional) : threshold value to classify for positive/negative sentiment. Defaults .05
-          stwords (bool, optional): True to remove stop words before performing sentiment analysis. Default True
-        hyperlinks(bool, optional): True to remove hyperlinks before performing sentiment analysis. Default: True
-    Output:
-        Dataframe: dataframe with movie id, name, director name, genre and overall ratio of positive sentiments 
+        incremental (bool, optional): True to only write changes to DB and score new or changed reviews. Default: False
+        progress (Callable, optional): called with movies_fetched, reviews_scored and rows_written increments 
+                    as the update advances. Default: None
+    Raises:
+        RefreshInProgressError: if another update is running
+
+    """
+
+    db.migrate(con)
+
+    with db.try_advisory_lock(con) as acquired:
+        if not acquired:
+            raise RefreshInProgressError("Movies are being updated already")
+
+        if incremental:
+            sync_tmdb_pop_movies(con, tmdb_key, progress= progress)
+        else:
+            load_tmdb_pop_movies(con, tmdb_key, progress= progress)
+
+        # reviews stored without scores of a variant, e.g. scored by an earlier version for one variant only
+        for variant_stwords, variant_hyperlinks in SCORE_VARIANTS:
+            update_review_scores(con, stwords= variant_stwords, hyperlinks= variant_hyperlinks, progress= progress)
+
+        if CLEAN_TEXT_CACHE_DB:
+            prune_clean_texts(con)
+
+    cache.invalidate()
+
+
+def sync_tmdb_pop_movies(con: engine, tmdb_key:str, progress: Callable = None):
+    """
+    Incremental update of popular movies, their crew, cast and review sentiments in DB. 
+    Popular movies are synced page by page.
+
+    Args:
+        con (engine): SQLAlchemy engine
+        tmdb_key (str) : TMDB api key
+        progress (Callable, optional): progress callback, see update_tmdb_pop_movies_sentiments. Default: None
+    Raises:
+        TMDBRequestError: if a page of popular movies or reviews of a movie can not be fetched. 
+                    Pages synced before are kept, no movie is removed
+    """
+    m_ids = []
+
+    # each page of popular movies is synced as it arrives
+    for pop_movies_df in tmdbutils.iter_daily_pop_movies(api_key=tmdb_key):
+        report_progress(progress, movies_fetched= len(pop_movies_df))
+
+        # only posters that are not cached yet are fetched
+        posters.prefetch(pop_movies_df, api_key= tmdb_key)
+
+        sync_tmdb_pop_movies_sentiments(pop_movies_df,
+                                con = con,
+                                tmdb_key = tmdb_key,
+                                remove_missing = False,
+                                progress = progress
+                            )
+        m_ids.extend(pop_movies_df['id'].tolist())
+
+    # only reached when all pages were fetched, a failed page raises before
+    with con.begin() as trans_con:
+        remove_movies(keep_ids= m_ids, con= trans_con)
+        db.refresh_overview(trans_con)
+
 
+def load_tmdb_pop_movies(con: engine, tmdb_key:str, progress: Callable = None):
     """
+    Replaces popular movies, their crew, cast and review sentiments in DB with a new list from TMDB
 
+    Args:
+        con (engine): SQLAlchemy engine
+        tmdb_key (str) : TMDB api key
+        progress (Callable, optional): progress callback, see update_tmdb_pop_movies_sentiments. Default: None
+    Raises:
+        TMDBRequestError: if popular movies or details of a movie can not be fetched, DB is not changed
+    """
     # update daily popular movie DB with new list
     pop_movies_df = tmdbutils.get_daily_pop_movies(api_key=tmdb_key)
+    report_progress(progress, movies_fetched= len(pop_movies_df))
 
+    if len(pop_movies_df) == 0:
+        raise ValueError("TMDB returned no popular movies, movies in DB are kept")
 
-    # df_toPG(df=pop_movies_df, table_name=MOVIE_TABLE, con =con )
-    pop_movies_df.to_sql(MOVIE_TABLE,con=con, index = False, if_exists= "replace")
+    m_ids = pop_movies_df['id'].tolist()
 
-    # Get additional details about movies i.e crew and cast details
+    # Get additional details about movies i.e crew and cast details and reviews, with one request per movie
+    crews_df, casts_df, movies_reviews_df = get_crew_cast_reviews(m_ids, tmdb_key= tmdb_key)
 
-    update_crew_cast(pop_movies_df['id'], con=con, tmdb_key=tmdb_key)
+    # posters are cached locally, so that the app does not depend on the TMDB image host
+    posters.prefetch(pop_movies_df, api_key= tmdb_key)
 
-    #Get reviews for each movie and perform sentiment analysis of reviews before updating DB
-    update_review_sentiments(m_ids = pop_movies_df['id'], 
-                                con = con, 
-                                tmdb_key = tmdb_key, 
-                                thresh = thresh,
-                                stwords= stwords,
-                                hyperlinks= hyperlinks
+    # perform sentiment analysis of reviews before updating DB
+    movies_reviews_df, scores_df = get_review_sentiments(m_ids,
+                                tmdb_key = tmdb_key,
+                                con = con,
+                                reviews_df = movies_reviews_df
                             )
+    report_progress(progress, reviews_scored= len(scores_df))
+
+    # all tables and the overview are replaced in one transaction, readers never see a partial update
+    with con.begin() as trans_con:
+        rows_written = db.bulk_load({
+                    MOVIE_TABLE: pop_movies_df,
+                    M_CREW_TABLE: crews_df,
+                    M_CAST_TABLE: casts_df,
+                    M_REVIEW_TABLE: movies_reviews_df,
+                    M_SCORE_TABLE: scores_df,
+                },
+                con = trans_con
+            )
+        db.refresh_overview(trans_con)
+    report_progress(progress, rows_written= rows_written)
+
+
+def get_crew_cast_reviews(m_ids:List[int], tmdb_key:str):
+    """
+    Get crew, cast and reviews for list of movie ids from TMDB with a single request per movie,
+    unless a movie has more than one page of reviews
 
-def update_crew_cast(m_ids:List[int], con: engine, tmdb_key:str):
+    Args:
+        m_ids (List(int)): List of movie Ids in TMDB 
+        tmdb_key (str): TMDB api key
+
+    Returns:
+        (DataFrame, DataFrame, DataFrame): crew, cast and reviews of all movies, see stack_crew_cast and stack_reviews
+    """
+    m_details = tmdbutils.fetch_many(tmdbutils.get_movie_details, m_ids= m_ids, api_key= tmdb_key)
+
+    crews_df, casts_df = stack_crew_cast(m_ids, [(cast_df, crew_df) for cast_df, crew_df, _ in m_details])
+    reviews_df = stack_reviews(m_ids, [reviews_df for _, _, reviews_df in m_details])
+
+    return crews_df, casts_df, reviews_df
+
+
+def stack_crew_cast(m_ids:List[int], m_credits:list):
     """
-    Update crew cast for list of movie ids in DB
+    Stacks cast and crew of movies into single DataFrames with movie id as m_id column
 
     Args:
         m_ids (List(int)): List of movie Ids in TMDB 
-        con (engine): SQLAlchemy engine
+        m_credits (list): (cast, crew) DataFrames of each movie in order of m_ids
+
+    Returns:
+        (DataFrame, DataFrame): crew and cast of all movies
     """
     crew_list = []
     cast_list = []
 
-    for m_id in m_ids:
-        cast_df, crew_df = tmdbutils.get_movie_credits(m_id= m_id, api_key=tmdb_key)
+    for m_id, (cast_df, crew_df) in zip(m_ids, m_credits):
 
         if (not crew_df is None) and len(crew_df) > 0:
         
@@ -83,197 +257,658 @@ def update_crew_cast(m_ids:List[int], con: engine, tmdb_key:str):
             cast_df.insert(0, "m_id", m_id)
             cast_list.append(cast_df)
 
-    # stack all crew and cast information in respective DF
-    crews_df = pd.concat(crew_list,ignore_index= True)
-    casts_df = pd.concat(cast_list, ignore_index= True)
+    # stack all crew and cast information in respective DF, stacking loses the compact dtypes
+    crews_df = stack_frames(crew_list, "crew")
+    casts_df = stack_frames(cast_list, "cast")
+
+    return crews_df, casts_df
+
+
+def stack_frames(frames:List[pd.DataFrame], kind:str) -> pd.DataFrame:
+    """
+    Stacks TMDB frames of movies with m_id column and restores their compact dtypes
+
+    Args:
+        frames (List(DataFrame)): frames of one kind, see tmdbutils.TMDB_COLUMNS
+        kind (str): movie, crew, cast or review
+
+    Returns:
+        DataFrame: stacked frame, empty frame with m_id and the columns of the kind if there are no frames
+    """
+    if len(frames) == 0:
+        return tmdbutils.project(pd.DataFrame(), kind).assign(m_id= pd.Series(dtype= "int32"))
+
+    stacked_df = pd.concat(frames, ignore_index= True)
+    stacked_df['m_id'] = stacked_df['m_id'].astype("int32")
 
-    # update DB table with crew and cast info for popular movies
-    # NOTE: current implementation is simplified to replace the whole table rather than to update the delta
-    # as it is supposed to keep data only about the current popular movie list
-    df_toPG(df=crews_df, table_name=M_CREW_TABLE, con =con )
-    df_toPG(df=casts_df, table_name=M_CAST_TABLE, con =con )
+    return tmdbutils.compact(stacked_df, kind)
  
 
-def update_review_sentiments(m_ids:List[int], con: engine, tmdb_key:str, thresh: float = .05, stwords:bool = True, hyperlinks:bool=True):
+def get_review_sentiments(m_ids:List[int], tmdb_key:str, con: engine = None, reviews_df: pd.DataFrame = None):
+    """
+    Get reviews for list of TMDB movie IDs and perform sentiment analysis for all pre-processing variants
+
+    Args:
+        m_ids (List(int)): List of TMDB movie ids
+        tmdb_key (str): TMDB api key
+        con (engine, optional): SQl Alchemy engine to DB for cleaned review texts stored in DB. Default: None
+        reviews_df (DataFrame, optional): reviews of the movies fetched already e.g. with get_crew_cast_reviews. 
+                    Default: None to fetch them from TMDB
+
+    Returns:
+        (DataFrame, DataFrame): reviews and raw vader scores of the reviews for each variant
     """
-    update movie reviews and its sentiments for list of TMDB movie IDs.
-    Store in DB
+    # get reviews and perform sentiment analysis for each reivew
+    movies_reviews_df = get_reviews(m_ids, tmdb_key= tmdb_key) if reviews_df is None else reviews_df
+
+    # perform sentiment analysis once and keep raw scores, so that a new threshold does not need a re-run
+    scores_df = score_review_variants(movies_reviews_df, con= con)
 
-    NOTE: Current implentation updates complete table rather than adding delta
+    return movies_reviews_df, scores_df
+
+
+def get_reviews(m_ids:List[int], tmdb_key:str) -> pd.DataFrame:
+    """
+    Get reviews for list of movie ids from TMDB
 
     Args:
         m_ids (List(int)): List of TMDB movie ids
-        con (engine): SQl Alchemy engine to DB
         tmdb_key (str): TMDB api key
-        thresh (float, optional): threshold to classify positive of negative sentiment. Defaults .05
-          stwords (bool, optional): True to remove stop words before performing sentiment analysis. Default True
-        hyperlinks(bool, optional): True to remove hyperlinks before performing sentiment analysis. Default: True
 
+    Returns:
+        DataFrame: reviews of all movies with movie id as m_id column and hash of the review text as content_hash column
+    """
+    m_reviews = tmdbutils.fetch_many(tmdbutils.get_movie_reviews, m_ids= m_ids, api_key= tmdb_key)
+
+    return stack_reviews(m_ids, m_reviews)
+
+
+def stack_reviews(m_ids:List[int], m_reviews:list) -> pd.DataFrame:
+    """
+    Stacks reviews of movies into a single DataFrame
+
+    Args:
+        m_ids (List(int)): List of TMDB movie ids
+        m_reviews (list): reviews DataFrame or None of each movie in order of m_ids
+
+    Returns:
+        DataFrame: reviews of all movies with movie id as m_id column and hash of the review text as content_hash column
     """
     m_reviews_list = []
-    # get reviews and perform sentiment analysis for each reivew
-    for m_id in m_ids:
 
-        m_reviews_df = tmdbutils.get_movie_reviews(m_id= m_id, api_key = tmdb_key)
-        
+    for m_id, m_reviews_df in zip(m_ids, m_reviews):
+
         if (m_reviews_df is None) or len(m_reviews_df) == 0:
             continue
 
         # add movie id to Dataframe
         m_reviews_df.insert(0,"m_id",m_id)
         
-        # perform sentiment analysis and add it to the Dataframe
-        m_reviews_df['sentiment'] = m_reviews_df['content'].apply(nlp.get_vsa_value, 
-                                                thresh = thresh,
-                                                stwords= stwords,
-                                                hyperlinks= hyperlinks
-                                            )
-
         m_reviews_list.append(m_reviews_df)
 
     # stack all reviews in single DF
-    movies_reviews_df = pd.concat(m_reviews_list, ignore_index=True)
+    movies_reviews_df = stack_frames(m_reviews_list, "review")
 
-    # movies_reviews_df['content'] = movies_reviews_df['content'].replace("\n","")
-    
-    # update DB table with crew and cast info for popular movies
-
-    # NOTE: current implementation is simplified to replace the whole table rather than to update the delta
-    # as it is supposed to keep data only about the current popular movie list
-    movies_reviews_df.to_sql(name=M_REVIEW_TABLE, con =con, if_exists= 'replace', index =False )
-    
+    # to find changed reviews in incremental updates
+    movies_reviews_df['content_hash'] = movies_reviews_df['content'].map(content_hash)
 
     return movies_reviews_df
 
 
-def update_sentiments(con: engine, thresh: float = .05, stwords:bool = True, hyperlinks:bool=True):
+def content_hash(text:str) -> str:
+    """
+    Returns md5 hex digest of a text
     """
-    update sentiments of movie reviews for all movies in DB.
-   
-    NOTE: Current implentation updates complete table rather than adding delta
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def sync_tmdb_pop_movies_sentiments(pop_movies_df: pd.DataFrame, con: engine, tmdb_key:str, remove_missing:bool = True,
+                                        progress: Callable = None):
+    """
+    Incremental update of the DB with a new list of popular movies.
+    Movies are upserted by TMDB id and movies that are no longer popular are removed with their crew, cast and reviews.
+    Crew and cast are fetched only for new movies. Only new or changed reviews are scored and written.
+    Changes and the refreshed overview are committed together.
 
     Args:
+        pop_movies_df (DataFrame): popular movies from TMDB
+        con (engine): SQLAlchemy engine
+        tmdb_key (str) : TMDB api key
+        remove_missing (bool, optional): True to remove movies that are not in pop_movies_df. 
+                        False when movies are synced page by page. Default: True
+        progress (Callable, optional): progress callback, see update_tmdb_pop_movies_sentiments. Default: None
+    """
+    m_ids = [int(m_id) for m_id in pop_movies_df['id']]
+
+    known_ids = set(pd.read_sql(f"select id from {MOVIE_TABLE}", con= con)['id'])
+
+    new_ids = [m_id for m_id in m_ids if m_id not in known_ids]
+
+    frames = {MOVIE_TABLE: pop_movies_df}
+    keys = {MOVIE_TABLE: ["id"]}
+
+    reviews_df = None
+
+    if len(new_ids) > 0:
+        # new movies with crew, cast and reviews in one request, known movies only need reviews
+        crews_df, casts_df, new_reviews_df = get_crew_cast_reviews(new_ids, tmdb_key= tmdb_key)
+        known_reviews_df = get_reviews([m_id for m_id in m_ids if m_id in known_ids], tmdb_key= tmdb_key)
+
+        reviews_df = pd.concat([new_reviews_df, known_reviews_df], ignore_index= True)
+
+        frames.update({M_CREW_TABLE: crews_df, M_CAST_TABLE: casts_df})
+        keys.update({M_CREW_TABLE: ["m_id"], M_CAST_TABLE: ["m_id"]})
+
+    changed_df, scores_df, removed_ids = get_changed_review_sentiments(m_ids,
+                                                con = con,
+                                                tmdb_key = tmdb_key,
+                                                reviews_df = reviews_df
+                                            )
+    report_progress(progress, reviews_scored= len(scores_df))
+
+    frames.update({M_REVIEW_TABLE: changed_df, M_SCORE_TABLE: scores_df})
+    keys.update({M_REVIEW_TABLE: ["id"], M_SCORE_TABLE: ["id"]})
+
+    # all changes of the page are written in one transaction
+    with con.begin() as trans_con:
+        if remove_missing:
+            remove_movies(keep_ids= m_ids, con= trans_con)
+
+        # scores of changed reviews are invalid for all pre-processing variants
+        trans_con.execute(sa.text(f"delete from {M_REVIEW_TABLE} where id = any(:ids)"), {"ids": removed_ids})
+        trans_con.execute(
+                sa.text(f"delete from {M_SCORE_TABLE} where id = any(:ids)"),
+                {"ids": removed_ids + changed_df['id'].tolist()}
+            )
+
+        rows_written = db.bulk_load(frames, con= trans_con, keys= keys)
+        db.refresh_overview(trans_con)
+
+    report_progress(progress, rows_written= rows_written)
+
+
+def get_changed_review_sentiments(m_ids:List[int], con: engine, tmdb_key:str, reviews_df: pd.DataFrame = None):
+    """
+    Get reviews for list of TMDB movie IDs and perform sentiment analysis for all pre-processing variants
+    only for reviews that are not in DB yet or whose content changed.
+
+    Args:
+        m_ids (List(int)): List of TMDB movie ids
         con (engine): SQl Alchemy engine to DB
-        thresh (float, optional): threshold to classify positive of negative sentiment. Defaults .05
+        tmdb_key (str): TMDB api key
+        reviews_df (DataFrame, optional): reviews of the movies fetched already. Default: None to fetch them from TMDB
+
+    Returns:
+        (DataFrame, DataFrame, list): new or changed reviews, their raw vader scores for each variant and
+                                      ids of reviews in DB that no longer exist on TMDB
+    Raises:
+        TMDBRequestError: if reviews of a movie can not be fetched
+    """
+    # a failed fetch raises, reviews in DB are only removed for movies whose reviews were fetched completely
+    movies_reviews_df = get_reviews(m_ids, tmdb_key= tmdb_key) if reviews_df is None else reviews_df
+
+    known_stmt = sa.text(f"""select ttmr.id, ttmr.content_hash from {M_REVIEW_TABLE} ttmr
+                    where ttmr.m_id = any(:m_ids)
+                """)
+
+    known_df = pd.read_sql(known_stmt, con= con, params= {"m_ids": m_ids})
+
+    known_hashes = known_df.set_index("id")['content_hash']
+
+    changed = movies_reviews_df['content_hash'] != movies_reviews_df['id'].map(known_hashes)
+
+    changed_df = movies_reviews_df[changed].reset_index(drop= True)
+
+    removed_ids = list(set(known_df['id']) - set(movies_reviews_df['id']))
+
+    scores_df = score_review_variants(changed_df, con= con)
+
+    return changed_df, scores_df, removed_ids
+
+
+def remove_movies(keep_ids:List[int], con):
+    """
+    Removes movies and their crew, cast, reviews and scores that are not in the given list of movie ids
+
+    Args:
+        keep_ids (List(int)): TMDB movie ids to be kept
+        con (engine or Connection): SQLAlchemy engine or a connection with an open transaction
+    Raises:
+        ValueError: if keep_ids is empty, e.g. after a failed fetch of popular movies
+    """
+    keep_ids = [int(m_id) for m_id in keep_ids]
+
+    if len(keep_ids) == 0:
+        raise ValueError("No movies to keep, movies in DB are not removed")
+
+    if isinstance(con, sa.engine.Engine):
+        with con.begin() as trans_con:
+            return remove_movies(keep_ids, con= trans_con)
+
+    con.execute(sa.text(f"delete from {MOVIE_TABLE} where id <> all(:ids)"), {"ids": keep_ids})
+
+    for table_name in [M_CREW_TABLE, M_CAST_TABLE, M_REVIEW_TABLE, M_SCORE_TABLE]:
+        con.execute(sa.text(f"delete from {table_name} where m_id <> all(:ids)"), {"ids": keep_ids})
+
+
+def score_reviews(reviews_df: pd.DataFrame, stwords:bool = True, hyperlinks:bool=True, con: engine = None) -> pd.DataFrame:
+    """
+    Calculate raw vader polarity scores for reviews for one preprocessing variant
+
+    Args:
+        reviews_df (DataFrame): reviews with id, m_id, content and optionally content_hash columns
         stwords (bool, optional): True to remove stop words before performing sentiment analysis. Default True
         hyperlinks(bool, optional): True to remove hyperlinks before performing sentiment analysis. Default: True
+        con (engine, optional): SQl Alchemy engine to DB for cleaned review texts stored in DB. Default: None
+
+    Returns:
+        DataFrame: review id, movie id, preprocessing variant and compound, pos, neu, neg scores
     """
-    # read existing data
-    m_reviews_df = pd.read_sql(M_REVIEW_TABLE, con = con)
-    
-        
-    # perform sentiment analysis and add it to the Dataframe
-    m_reviews_df['sentiment'] = m_reviews_df['content'].apply(nlp.get_vsa_value, 
-                                                            thresh = thresh, 
-                                                            stwords =stwords,
-                                                            hyperlinks = hyperlinks
-                                                        )
-    
-    # update DB table with crew and cast info for popular movies
+    texts = clean_reviews(reviews_df, stwords= stwords, hyperlinks= hyperlinks, con= con)
 
-    # NOTE: current implementation is simplified to replace the whole table rather than to update the delta
-    # as it is supposed to keep data only about the current popular movie list
-    m_reviews_df.to_sql(name=M_REVIEW_TABLE, con =con, if_exists= 'replace', index =False )
-    
+    with metrics.timer("score"):
+        scores = nlp.score_batch_parallel(texts, stwords= stwords, hyperlinks= hyperlinks, keep_raw= True)
+
+    scores_df = pd.DataFrame({col: scores[col] for col in SCORE_COLUMNS}, index= reviews_df.index)
 
-    # return m_reviews_df
+    scores_df.insert(0, "id", reviews_df['id'])
+    scores_df.insert(1, "m_id", reviews_df['m_id'])
+    scores_df.insert(2, "stwords", stwords)
+    scores_df.insert(3, "hyperlinks", hyperlinks)
 
-def get_movies_overview(con: engine):
+    return scores_df
+
+
+def score_review_variants(reviews_df: pd.DataFrame, con: engine = None) -> pd.DataFrame:
     """
-    Get overview information about daily popular movies and return as DataFrame
+    Calculate raw vader polarity scores for reviews for all preprocessing variants of SCORE_VARIANTS, 
+    so that app sessions only read scores
 
     Args:
-        con (engine):SQLAlchemy engine
-    
+        reviews_df (DataFrame): reviews with id, m_id, content and optionally content_hash columns
+        con (engine, optional): SQl Alchemy engine to DB for cleaned review texts stored in DB. Default: None
+
     Returns:
-        Dataframe: Dataframe with movie basic information and overal positive sentiment %age based on review sentiment analysis,
-        int: Total number of movies
+        DataFrame: scores of all variants, see score_reviews
     """
+    return pd.concat([
+                score_reviews(reviews_df, stwords= stwords, hyperlinks= hyperlinks, con= con)
+                for stwords, hyperlinks in SCORE_VARIANTS
+            ],
+            ignore_index= True
+        )
 
-    ovr_stmt = f"""select ttpm.id, 
-                        ttpm.title, 
-                        ttpm.release_date,
-                        ttmc."name" as "director",
-                        ttmc2."name" as "lead_Actor",
-                        ttpm.genre_names as genre
-            from {MOVIE_TABLE} ttpm 
-            join {M_CREW_TABLE} ttmc   on 
-                ttpm .id = ttmc.m_id 
-            join  {M_CAST_TABLE} ttmc2 on
-                ttmc2.m_id = ttpm.id
-            where 
-                ttmc.job = 'Director' and 
-                ttmc2."order" = '1'
-            """
-
-    m_overview_df = pd.read_sql(ovr_stmt, con=con)
 
-    
-    m_overview_df = m_overview_df.drop_duplicates(subset="id")
+def clean_reviews(reviews_df: pd.DataFrame, stwords:bool = True, hyperlinks:bool=True, con: engine = None) -> list:
+    """
+    Returns cleaned up review texts for one preprocessing variant. Cleaned texts are cached by content hash and tokenizer, 
+    so each review content is cleaned and tokenized at most once per variant.
+    With CLEAN_TEXT_CACHE_DB texts missing in memory are also looked up in and written to DB.
 
-    
-    # Get overall review of listed movies    
-    review_stmt = f"""select ttmr.m_id, ttmr.sentiment  from {M_REVIEW_TABLE} ttmr
-                    where ttmr.m_id in {tuple(m_overview_df['id'].tolist())} 
-                """
+    Args:
+        reviews_df (DataFrame): reviews with content and optionally content_hash columns
+        stwords (bool, optional): True to remove stop words. Default True
+        hyperlinks(bool, optional): True to remove hyperlinks. Default: True
+        con (engine, optional): SQl Alchemy engine to DB. Default: None
+
+    Returns:
+        list: cleaned up texts in order of reviews_df
+    """
+    contents = reviews_df['content'].tolist()
 
-    m_reviews_df = pd.read_sql(review_stmt, con= con)
+    if 'content_hash' in reviews_df:
+        hashes = reviews_df['content_hash'].tolist()
+    else:
+        hashes = [content_hash(text) for text in contents]
 
-    
-    m_reviews_df = m_reviews_df.replace(
-                            to_replace={"sentiment":{
-                                                    1:"pos",
-                                                    0: "neu", 
-                                                    -1: "neg"}
-                                            }
-                                        )
-
-    m_reviews_df = m_reviews_df.value_counts().unstack(fill_value=0)
-    
-    m_reviews_df['sentiment'] = m_reviews_df.apply(lambda row: f"{row['pos']/row.sum()*100:.2f} % +", axis=1)
+    tokenizer = nlp.NLP_TOKENIZER
+
+    texts = [clean_text_cache.get((c_hash, stwords, hyperlinks, tokenizer)) for c_hash in hashes]
+
+    missing = {c_hash: content for c_hash, content, text in zip(hashes, contents, texts) if text is None}
+    cleaned = {}
+
+    metrics.count("clean_text_cache_hits", len(texts) - sum(text is None for text in texts))
+
+    persist = con is not None and CLEAN_TEXT_CACHE_DB
+
+    if persist and len(missing) > 0:
+        stored = con.execute(
+                    sa.text(f"""select content_hash, clean_text from {M_CLEAN_TEXT_TABLE}
+                                where stwords = :stwords and hyperlinks = :hyperlinks and tokenizer = :tokenizer
+                                    and content_hash = any(:hashes)"""),
+                    {"stwords": stwords, "hyperlinks": hyperlinks, "tokenizer": tokenizer, "hashes": list(missing)}
+                ).fetchall()
+        cleaned.update(stored)
+        metrics.count("clean_text_db_hits", len(stored))
+
+    new_hashes = [c_hash for c_hash in missing if c_hash not in cleaned]
+
+    with metrics.timer("clean"):
+        new_texts = nlp.clean_batch([missing[c_hash] for c_hash in new_hashes], stwords= stwords, hyperlinks= hyperlinks, tokenizer= tokenizer)
+    metrics.count("reviews_cleaned", len(new_texts))
+    cleaned.update(zip(new_hashes, new_texts))
+
+    for c_hash, text in cleaned.items():
+        clean_text_cache.put((c_hash, stwords, hyperlinks, tokenizer), text)
+
+    if persist and len(new_hashes) > 0:
+        db.bulk_load({
+                M_CLEAN_TEXT_TABLE: pd.DataFrame({
+                    "content_hash": new_hashes,
+                    "stwords": stwords,
+                    "hyperlinks": hyperlinks,
+                    "tokenizer": tokenizer,
+                    "clean_text": new_texts
+                })
+            },
+            con = con,
+            keys = {M_CLEAN_TEXT_TABLE: ["content_hash", "stwords", "hyperlinks", "tokenizer"]}
+        )
+
+    return [cleaned[c_hash] if text is None else text for c_hash, text in zip(hashes, texts)]
+
+
+def prune_clean_texts(con: engine) -> int:
+    """
+    Removes cleaned texts stored in DB whose review content is no longer in DB
+
+    Args:
+        con (engine): SQl Alchemy engine to DB
+    Returns:
+        int: number of removed texts
+    """
+    return con.execute(f"""delete from {M_CLEAN_TEXT_TABLE} ttrct
+                where not exists (
+                    select 1 from {M_REVIEW_TABLE} ttmr
+                    where ttmr.content_hash = ttrct.content_hash
+                )
+            """).rowcount
+
+
+def update_review_scores(con: engine, stwords:bool = True, hyperlinks:bool=True, progress: Callable = None):
+    """
+    Calculate and store vader scores for reviews that do not have scores yet for the given preprocessing variant.
+    Each review is scored at most once per variant. Scores are committed with a new data version.
+
+    Args:
+        con (engine): SQl Alchemy engine to DB
+        stwords (bool, optional): True to remove stop words before performing sentiment analysis. Default True
+        hyperlinks(bool, optional): True to remove hyperlinks before performing sentiment analysis. Default: True
+        progress (Callable, optional): progress callback, see update_tmdb_pop_movies_sentiments. Default: None
+    """
+    review_stmt = sa.text(f"""select ttmr.id, ttmr.m_id, ttmr."content", ttmr.content_hash from {M_REVIEW_TABLE} ttmr
+                where not exists (
+                    select 1 from {M_SCORE_TABLE} ttrs
+                    where ttrs.id = ttmr.id and 
+                        ttrs.stwords = :stwords and 
+                        ttrs.hyperlinks = :hyperlinks
+                )
+            """)
+
+    with metrics.timer("db_read"):
+        m_reviews_df = pd.read_sql(review_stmt, con= con, params= {"stwords": stwords, "hyperlinks": hyperlinks})
 
-    # Merge overview movies with overall movie sentiment rating
-    m_reviews_df = m_overview_df.merge(
-                        m_reviews_df['sentiment'],
-                        left_on= "id",
-                        right_index= True
-                        )
+    if len(m_reviews_df) == 0:
+        return
 
-    m_reviews_df = m_reviews_df.reset_index(drop= True)
+    scores_df = score_reviews(m_reviews_df, stwords= stwords, hyperlinks= hyperlinks, con= con)
+    report_progress(progress, reviews_scored= len(scores_df))
 
-    return m_reviews_df, len(m_overview_df)
+    with con.begin() as trans_con:
+        rows_written = db.bulk_load({M_SCORE_TABLE: scores_df}, con= trans_con, keys= {M_SCORE_TABLE: ["id", "stwords", "hyperlinks"]})
+        db.refresh_overview(trans_con)
+    report_progress(progress, rows_written= rows_written)
 
 
-def get_movie_reviews(m_id: int, con: engine):
+@cache.versioned
+def get_movies_overview(con: engine, thresh: float = .05, stwords:bool = True, hyperlinks:bool=True):
+    """
+    Get overview information about daily popular movies and return as DataFrame.
+    Sentiments are classified from stored vader scores with the given settings, nothing is written to DB.
+
+    Args:
+        con (engine):SQLAlchemy engine
+        thresh (float, optional): threshold to classify positive of negative sentiment. Defaults .05
+        stwords (bool, optional): scores with stop words removed. Default True
+        hyperlinks(bool, optional): scores with hyperlinks removed. Default: True
+    
+    Returns:
+        Dataframe: Dataframe with movie basic information and overal positive sentiment %age based on review sentiment analysis,
+        int: Total number of movies
+    """
+
+    # threshold is a setting of the session, ratio of positive reviews is classified in DB from the stored scores
+    ovr_stmt = sa.text(f"""select mv.id,
+                        mv.title,
+                        mv.release_date,
+                        mv.director,
+                        mv."lead_Actor",
+                        mv.genre,
+                        to_char(100.0 * sentiments.pos / sentiments.reviews, 'FM990.00') || ' % +' as sentiment,
+                        (select count(*) from {db.OVERVIEW_VIEW}) as tot_movies
+            from {db.OVERVIEW_VIEW} mv
+            join (
+                select ttrs.m_id,
+                    count(*) filter (where {SENTIMENT_SQL.format(compound= "ttrs.compound")} = 1) as pos,
+                    count(*) as reviews
+                from {M_SCORE_TABLE} ttrs
+                where ttrs.stwords = :stwords and 
+                    ttrs.hyperlinks = :hyperlinks
+                group by ttrs.m_id
+            ) sentiments on sentiments.m_id = mv.id
+            where sentiments.reviews >= :min_reviews
+            order by mv.id
+            """)
+
+    with metrics.timer("db_read"):
+        m_reviews_df = pd.read_sql(ovr_stmt, con=con, params= {
+                                                        "thresh": thresh,
+                                                        "stwords": stwords,
+                                                        "hyperlinks": hyperlinks,
+                                                        "min_reviews": 1
+                                                    })
+
+    if len(m_reviews_df) > 0:
+        tot_movies = int(m_reviews_df['tot_movies'].iloc[0])
+    else:
+        tot_movies = con.execute(f"select count(*) from {db.OVERVIEW_VIEW}").scalar()
+
+    m_reviews_df = m_reviews_df.drop(columns= 'tot_movies')
+
+    return m_reviews_df, tot_movies
+
+
+@cache.versioned
+def get_movie_reviews(m_id: int, con: engine, thresh: float = .05, stwords:bool = True, hyperlinks:bool=True):
     """
     Fetches reviews from the database and returns a DataFrame with movie reviews and respective sentiment.
+    Sentiments are classified from stored vader scores with the given settings, nothing is written to DB.
 
     Args:
         m_id (int): TMDB movie ID
         con (engine): SQLAlchemy engine with DB details
+        thresh (float, optional): threshold to classify positive of negative sentiment. Defaults .05
+        stwords (bool, optional): scores with stop words removed. Default True
+        hyperlinks(bool, optional): scores with hyperlinks removed. Default: True
     """
 
-    review_stmt = f"""select ttmr.created_at,
+    review_stmt = sa.text(f"""select ttmr.created_at::date as created_at,
                             ttmr.author_details_username as user, 
                             ttmr."content" as review, 
-                            ttmr.sentiment  
+                            case {SENTIMENT_SQL.format(compound= "ttrs.compound")}
+                                when 1 then 'positive'
+                                when 0 then 'neutral'
+                                when -1 then 'negative'
+                            end as sentiment
                     from {M_REVIEW_TABLE} ttmr
-                where m_id = '{m_id}'
-                """
+                    left join {M_SCORE_TABLE} ttrs on 
+                        ttrs.id = ttmr.id and 
+                        ttrs.stwords = :stwords and 
+                        ttrs.hyperlinks = :hyperlinks
+                where ttmr.m_id = :m_id
+                """)
     
-    m_reviews_df = pd.read_sql(review_stmt, con= con)
+    with metrics.timer("db_read"):
+        m_reviews_df = pd.read_sql(review_stmt, con= con, params= {
+                                                        "m_id": int(m_id),
+                                                        "thresh": thresh,
+                                                        "stwords": stwords,
+                                                        "hyperlinks": hyperlinks
+                                                    })
 
-    m_reviews_df['created_at'] = pd.to_datetime(m_reviews_df['created_at']).dt.date
+    return m_reviews_df
 
-    m_reviews_df = m_reviews_df.replace(
-                            to_replace={"sentiment":{
-                                                    1:"positive",
-                                                    0: "neutral", 
-                                                    -1: "negative"}
-                                            }
-                                        )
 
-    return m_reviews_df
+@cache.versioned
+def get_movie_reviews_page(m_id: int, con: engine, after: tuple = None, page_size: int = None, sentiment: str = None,
+                           thresh: float = .05, stwords:bool = True, hyperlinks:bool=True, preview_chars: int = None):
+    """
+    Fetches one page of reviews of a movie, newest first, with previews of the review texts. Pages are read with
+    a keyset on creation time and review id, so that the time per page does not depend on the number of reviews
+    or the page position. Sentiments are classified from stored vader scores with the given settings.
+
+    Args:
+        m_id (int): TMDB movie ID
+        con (engine): SQLAlchemy engine with DB details
+        after (tuple, optional): cursor returned with the previous page, None for the first page. Defaults to None
+        page_size (int, optional): reviews per page. Defaults to REVIEW_PAGE_SIZE
+        sentiment (str, optional): only reviews with this sentiment, one of SENTIMENT_LABELS. Defaults to all reviews
+        thresh (float, optional): threshold to classify positive of negative sentiment. Defaults .05
+        stwords (bool, optional): scores with stop words removed. Default True
+        hyperlinks(bool, optional): scores with hyperlinks removed. Default: True
+        preview_chars (int, optional): characters of the review previews. Defaults to REVIEW_PREVIEW_CHARS
+    Returns:
+        DataFrame: reviews with id, creation date, user, review preview, truncated flag and sentiment,
+        tuple: cursor of the next page, None if this is the last page
+    """
+    page_size = page_size or REVIEW_PAGE_SIZE
+    preview_chars = preview_chars or REVIEW_PREVIEW_CHARS
+
+    labels = {label: rating for rating, label in SENTIMENT_LABELS.items()}
+    if sentiment is not None and sentiment not in labels:
+        raise ValueError(f"Unknown sentiment {sentiment}, use one of {list(labels)}")
+
+    conditions = ["ttmr.m_id = :m_id"]
+    if after is not None:
+        conditions.append("(ttmr.created_at, ttmr.id) < (cast(:after_created_at as timestamp with time zone), :after_id)")
+    if sentiment is not None:
+        conditions.append(f"{SENTIMENT_SQL.format(compound= 'ttrs.compound')} = :rating")
+
+    # one more row than the page is read to know if there is a next page
+    page_stmt = sa.text(f"""select ttmr.id,
+                            ttmr.created_at as cursor_created_at,
+                            ttmr.created_at::date as created_at,
+                            ttmr.author_details_username as user,
+                            case when char_length(ttmr."content") > :preview_chars
+                                then rtrim(left(ttmr."content", :preview_chars)) || ' …'
+                                else ttmr."content"
+                            end as review,
+                            coalesce(char_length(ttmr."content") > :preview_chars, false) as truncated,
+                            case {SENTIMENT_SQL.format(compound= "ttrs.compound")}
+                                when 1 then 'positive'
+                                when 0 then 'neutral'
+                                when -1 then 'negative'
+                            end as sentiment
+                    from {M_REVIEW_TABLE} ttmr
+                    left join {M_SCORE_TABLE} ttrs on
+                        ttrs.id = ttmr.id and
+                        ttrs.stwords = :stwords and
+                        ttrs.hyperlinks = :hyperlinks
+                where {" and ".join(conditions)}
+                order by ttmr.created_at desc, ttmr.id desc
+                limit :limit
+                """)
+
+    params = {
+        "m_id": int(m_id),
+        "thresh": thresh,
+        "stwords": stwords,
+        "hyperlinks": hyperlinks,
+        "preview_chars": preview_chars,
+        "rating": labels.get(sentiment),
+        "limit": page_size + 1,
+        "after_created_at": None if after is None else after[0],
+        "after_id": None if after is None else after[1],
+    }
+
+    with metrics.timer("db_read"):
+        page_df = pd.read_sql(page_stmt, con= con, params= params)
+
+    next_cursor = None
+    if len(page_df) > page_size:
+        page_df = page_df.iloc[:page_size]
+        last = page_df.iloc[-1]
+        next_cursor = (last["cursor_created_at"].isoformat(), last["id"])
+
+    return page_df.drop(columns= "cursor_created_at"), next_cursor
+
+
+@cache.versioned
+def get_movie_review_counts(m_id: int, con: engine, thresh: float = .05, stwords:bool = True, hyperlinks:bool=True) -> dict:
+    """
+    Returns number of reviews of a movie per sentiment, classified from stored vader scores with the given settings
+
+    Args:
+        m_id (int): TMDB movie ID
+        con (engine): SQLAlchemy engine with DB details
+        thresh (float, optional): threshold to classify positive of negative sentiment. Defaults .05
+        stwords (bool, optional): scores with stop words removed. Default True
+        hyperlinks(bool, optional): scores with hyperlinks removed. Default: True
+    Returns:
+        dict: sentiment label to number of reviews, None for all reviews including reviews that are not scored yet
+    """
+    count_stmt = sa.text(f"""select {SENTIMENT_SQL.format(compound= "ttrs.compound")} as rating, count(*) as reviews
+                    from {M_REVIEW_TABLE} ttmr
+                    left join {M_SCORE_TABLE} ttrs on
+                        ttrs.id = ttmr.id and
+                        ttrs.stwords = :stwords and
+                        ttrs.hyperlinks = :hyperlinks
+                where ttmr.m_id = :m_id
+                group by 1
+                """)
+
+    with metrics.timer("db_read"):
+        rows = con.execute(count_stmt, {"m_id": int(m_id), "thresh": thresh, "stwords": stwords, "hyperlinks": hyperlinks}).fetchall()
+
+    counts = {label: 0 for label in SENTIMENT_LABELS.values()}
+    for rating, reviews in rows:
+        if rating is not None:
+            counts[SENTIMENT_LABELS[rating]] = reviews
+    counts[None] = sum(reviews for _, reviews in rows)
+
+    return counts
+
+
+@cache.versioned
+def get_review_text(review_id: str, con: engine) -> str:
+    """
+    Returns full text of a review, e.g. when a preview of the review browser is opened
+
+    Args:
+        review_id (str): TMDB review ID
+        con (engine): SQLAlchemy engine with DB details
+    Returns:
+        str: review text, None if the review does not exist
+    """
+    with metrics.timer("db_read"):
+        return con.execute(sa.text(f'select "content" from {M_REVIEW_TABLE} where id = :id'), {"id": review_id}).scalar()
+
+
+@cache.versioned
+def get_poster_paths(con: engine) -> dict:
+    """
+    Returns poster paths of all movies, read once per data version and kept in memory
+
+    Args:
+        con (engine): SQLAlchemy engine
+    Returns:
+        dict: TMDB movie ID to poster_path, None for movies without poster
+    """
+    with metrics.timer("db_read"):
+        rows = con.execute(f"select id, poster_path from {MOVIE_TABLE}").fetchall()
+
+    return {m_id: poster_path for m_id, poster_path in rows}
 
 
 def get_movie_img_url(m_id:int, con: engine, orig:bool = False):
@@ -285,18 +920,10 @@ def get_movie_img_url(m_id:int, con: engine, orig:bool = False):
         con (engine): SQLAlchemy engine
         orig (bool, optional): To return original resolution or scaled version. Default : False
     """
-
-    stmt = f"""select ttpm.poster_path  from {MOVIE_TABLE} ttpm 
-            where ttpm.id = {m_id} 
-        """
-
-    tmdb_img_host = "https://image.tmdb.org/t/p/"
-    
-    try:
-        image_name= con.execute(stmt).fetchone()[0]
+    image_name = get_poster_paths(con).get(int(m_id))
 
     # else returns TMDB logo
-    except:
+    if not image_name:
         url = "https://www.themoviedb.org/assets/2/v4/logos/v2/blue_square_2-d537fb228cf3ded904ef09b136fe3fec72548ebc1fea3fbbd1ad9e36364db38b.svg"
         return url
 
@@ -304,11 +931,28 @@ def get_movie_img_url(m_id:int, con: engine, orig:bool = False):
     if not orig:
         location = "w600_and_h900_bestv2"
 
-    url = f"{tmdb_img_host}{location}{image_name}"
+    url = f"{tmdbutils.tmdb_image_url}/{location}{image_name}"
 
     return url
 
 
+def get_movie_poster(m_id:int, con: engine) -> str:
+    """
+    Returns thumbnail of the poster of a movie from the local poster cache. Posters are fetched during updates
+    of movies, a poster that is not cached yet is fetched once. Falls back to the URL of the TMDB image host
+    if the poster cache is disabled or the poster is not available.
+
+    Args:
+        m_id (int): TMDB movie ID
+        con (engine): SQLAlchemy engine
+    Returns:
+        str: thumbnail file location or poster URL
+    """
+    poster_file = posters.get_poster(get_poster_paths(con).get(int(m_id)))
+
+    return poster_file or get_movie_img_url(m_id, con)
+
+
 
 
 
@@ -344,8 +988,9 @@ def df_toPG(df, table_name, con,if_exists='replace', sep='\t', index= False,dtyp
     curs = raw.cursor()
     # null values become ''
     # columns = df.columns
-    curs.copy_from(output, table_name, null="")
-    curs.connection.commit()
+    with metrics.timer("db_write"):
+        curs.copy_from(output, table_name, null="")
+        curs.connection.commit()
     curs.close()
     del output
 
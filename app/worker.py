@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Background worker that runs queued updates of popular movies and their sentiments.
+
+    python worker.py run [--once] [--poll SECONDS] [--interval SECONDS] [--metrics-port PORT]
+    python worker.py enqueue [--full]
+    python worker.py export [--dir DIR]
+    python worker.py import [PATH] [--no-update]
+"""
+
+import os
+import argparse
+
+from src import db, jobs, metrics, snapshot, utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description= "Runs updates of popular movies from TMDB in the background")
+    commands = parser.add_subparsers(dest= "command", required= True)
+
+    run_parser = commands.add_parser("run", help= "run queued updates")
+    run_parser.add_argument("--once", action= "store_true", help= "exit when the queue is empty")
+    run_parser.add_argument("--poll", type= float, default= jobs.JOB_POLL_INTERVAL, help= "seconds between checks for new updates")
+    run_parser.add_argument("--interval", type= float, default= jobs.REFRESH_INTERVAL,
+                            help= "seconds between scheduled updates, 0 to only run enqueued updates")
+    run_parser.add_argument("--metrics-port", type= int, default= metrics.METRICS_PORT,
+                            help= "port of the /metrics endpoint with stage timings in Prometheus format, 0 for none")
+
+    enqueue_parser = commands.add_parser("enqueue", help= "queue an update")
+    enqueue_parser.add_argument("--full", action= "store_true", help= "replace all movies instead of an incremental update")
+
+    export_parser = commands.add_parser("export", help= "export a snapshot of movies, reviews and scores")
+    export_parser.add_argument("--dir", default= snapshot.SNAPSHOT_DIR, help= "directory of the snapshots")
+
+    import_parser = commands.add_parser("import", help= "replace movies, reviews and scores with a snapshot")
+    import_parser.add_argument("path", nargs= "?", default= None, help= "snapshot path, defaults to the latest snapshot")
+    import_parser.add_argument("--no-update", action= "store_true", help= "do not queue an incremental update after the import")
+
+    args = parser.parse_args()
+
+    metrics.setup_logging()
+
+    engine = db.engine_from_env()
+    db.migrate(engine)
+
+    if args.command == "enqueue":
+        job_id = jobs.enqueue_refresh(engine, incremental= not args.full)
+        print(f"update job {job_id} queued")
+    elif args.command == "export":
+        path = snapshot.export_snapshot(engine, args.dir)
+        snapshot.prune_snapshots(args.dir)
+        print(f"snapshot exported to {path}")
+    elif args.command == "import":
+        # an update running meanwhile would write into the imported tables
+        with db.try_advisory_lock(engine) as acquired:
+            if not acquired:
+                raise utils.RefreshInProgressError("Movies are being updated, snapshot is not imported")
+
+            manifest = snapshot.load_snapshot(engine, args.path)
+
+        rows = sum(table["rows"] for table in manifest["tables"].values())
+        print(f"snapshot of {manifest['created_at']} imported, {rows} rows")
+
+        if not args.no_update:
+            job_id = jobs.enqueue_refresh(engine)
+            print(f"update job {job_id} queued")
+    else:
+        if args.metrics_port:
+            metrics.start_http_server(args.metrics_port)
+
+        jobs.run_worker(engine, os.environ['TMDB_KEY'], once= args.once, poll= args.poll, interval= args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark for batch and multi-process sentiment scoring against the per review scoring with a new analyzer for every review
+
+Reviews are generated with `corpus.make_reviews`.
+
+Usage (from repository root):
+    python benchmarks/bench_nlp.py --reviews 3000 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from nltk.sentiment.vader import SentimentIntensityAnalyzer  # noqa: E402
+from src import nlp  # noqa: E402
+from corpus import make_reviews  # noqa: E402
+
+
+def score_per_review(texts, thresh, stwords, hyperlinks):
+    """
+    Scoring as previously done with Series.apply: new analyzer (and lexicon load) for every review
+    """
+    ratings = []
+    for text in texts:
+        sa = SentimentIntensityAnalyzer()
+        ratings.append(nlp.vader_sa_rating(sa.polarity_scores(nlp.clean_text(text, stwords, hyperlinks)), thresh))
+    return ratings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", type=int, default=3000, help="number of synthetic reviews")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="process pool size for parallel scoring")
+    args = parser.parse_args()
+
+    # hyperlinks and hashtags are removed before scoring, a share of the reviews contains them
+    texts = make_reviews(args.reviews, url_ratio=.05)
+
+    # NLTK resources are loaded on first use, load them outside of the measurements
+    nlp.get_analyzer()
+    nlp.get_stopwords()
+    nlp.get_tokenizer()
+
+    start = time.perf_counter()
+    baseline = score_per_review(texts, .05, True, True)
+    baseline_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = nlp.score_batch(texts, .05, True, True)
+    batch_time = time.perf_counter() - start
+
+    assert list(batch['sentiment']) == baseline, "batch ratings differ from per review ratings"
+
+    start = time.perf_counter()
+    vectorized = nlp.score_batch(texts, .05, True, True, engine="numpy")
+    vectorized_time = time.perf_counter() - start
+
+    assert list(vectorized['sentiment']) == baseline, "numpy engine ratings differ from per review ratings"
+
+    # start pool outside of the measurement
+    nlp.score_batch_parallel(texts[:args.workers * 2], workers=args.workers)
+
+    start = time.perf_counter()
+    parallel = nlp.score_batch_parallel(texts, .05, True, True, workers=args.workers)
+    parallel_time = time.perf_counter() - start
+
+    assert list(parallel['sentiment']) == baseline, "parallel ratings differ from per review ratings"
+
+    print(f"reviews          : {len(texts)}")
+    print(f"per review       : {baseline_time:.2f} s ({len(texts) / baseline_time:.0f} reviews/s)")
+    print(f"score_batch      : {batch_time:.2f} s ({len(texts) / batch_time:.0f} reviews/s)")
+    print(f"speedup          : {baseline_time / batch_time:.1f}x")
+    print(f"numpy engine     : {vectorized_time:.2f} s ({len(texts) / vectorized_time:.0f} reviews/s)")
+    print(f"speedup          : {baseline_time / vectorized_time:.1f}x")
+    print(f"parallel ({args.workers:>2} wk) : {parallel_time:.2f} s ({len(texts) / parallel_time:.0f} reviews/s)")
+    print(f"speedup          : {baseline_time / parallel_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark for cold start of the app modules. Every run imports the modules in a fresh interpreter and measures
+import time, time of the first use of the NLTK resources and network connections made during import.
+
+Usage (from repository root):
+    python benchmarks/bench_startup.py --runs 5 --max-import-ms 2000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+# executed in a fresh interpreter for every run, prints measurements as JSON
+PROBE = """
+import json, socket, sys, time
+
+connections = []
+connect = socket.socket.connect
+
+def record_connect(sock, address):
+    connections.append(str(address))
+    return connect(sock, address)
+
+socket.socket.connect = record_connect
+
+start = time.perf_counter()
+from src import nlp
+nlp_import = time.perf_counter() - start
+nltk_imported = "nltk" in sys.modules
+
+start = time.perf_counter()
+from src import utils, jobs
+app_import = time.perf_counter() - start
+
+start = time.perf_counter()
+nlp.get_analyzer()
+nlp.get_stopwords()
+nlp.get_tokenizer()
+first_use = time.perf_counter() - start
+
+start = time.perf_counter()
+nlp.score_batch(["What a great movie, loved it!"])
+first_score = time.perf_counter() - start
+
+print(json.dumps({
+    "nlp_import": nlp_import,
+    "app_import": app_import,
+    "first_use": first_use,
+    "first_score": first_score,
+    "nltk_imported": nltk_imported,
+    "connections": connections,
+}))
+"""
+
+
+def run_probe() -> dict:
+    """
+    Runs the probe in a fresh interpreter from the app folder and returns its measurements
+    """
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=APP_DIR, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreter runs")
+    parser.add_argument("--max-import-ms", type=float, default=None,
+                        help="exit with an error if median import time of src.nlp exceeds this value")
+    args = parser.parse_args()
+
+    runs = [run_probe() for _ in range(args.runs)]
+
+    for key in ("nlp_import", "app_import", "first_use", "first_score"):
+        values = [run[key] * 1000 for run in runs]
+        print(f"{key:<12} : median {statistics.median(values):8.1f} ms, min {min(values):8.1f} ms, max {max(values):8.1f} ms")
+
+    connections = sorted({address for run in runs for address in run["connections"]})
+    print(f"nltk imported by src.nlp : {any(run['nltk_imported'] for run in runs)}")
+    print(f"network connections      : {connections or 'none'}")
+
+    failed = False
+
+    if connections:
+        print("FAIL: modules connect to the network during start up")
+        failed = True
+
+    nlp_import_ms = statistics.median(run["nlp_import"] for run in runs) * 1000
+    if args.max_import_ms is not None and nlp_import_ms > args.max_import_ms:
+        print(f"FAIL: src.nlp import takes {nlp_import_ms:.1f} ms, more than {args.max_import_ms:.1f} ms")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Equivalence report and micro-benchmark of the tokenizers for stop word removal (`nlp.TOKENIZERS`).
+
+For every tokenizer the reviews are cleaned with stop word removal and scored. Compound scores and sentiment labels
+are compared with the nltk tokenizer at several thresholds. Tokenizing and cleaning time is measured per tokenizer.
+
+Reviews are generated with `corpus.make_reviews`, stored reviews are used with --from-db.
+
+Usage (from repository root):
+    python benchmarks/bench_tokenizers.py --reviews 2000
+    python benchmarks/bench_tokenizers.py --from-db
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from src import nlp  # noqa: E402
+from corpus import make_reviews  # noqa: E402
+
+THRESHOLDS = (.05, .25, .5)
+
+def read_db_reviews():
+    """
+    Reads stored review texts from the DB configured with POSTGRES_* environment variables
+    """
+    from src import db
+
+    return [row[0] for row in db.engine_from_env().execute(f"select content from {db.M_REVIEW_TABLE}")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", type=int, default=2000, help="number of generated reviews")
+    parser.add_argument("--from-db", action="store_true", help="use reviews stored in the DB instead of generated ones")
+    parser.add_argument("--repeat", type=int, default=3, help="timing repetitions, best is reported")
+    args = parser.parse_args()
+
+    reviews = read_db_reviews() if args.from_db else make_reviews(args.reviews)
+
+    lengths = np.array([len(review.split()) for review in reviews])
+    print(f"reviews : {len(reviews)}, words per review median {np.median(lengths):.0f}, "
+          f"p90 {np.percentile(lengths, 90):.0f}, max {lengths.max()}")
+
+    # text as it is tokenized in clean_text
+    prepared = [nlp.HASHTAG_REGEX.sub("", nlp.HYPERLINK_REGEX.sub("", nlp.NON_TEXT_REGEX.sub("", review))) for review in reviews]
+    words = lengths.sum()
+
+    # load resources outside of the measurements
+    nlp.get_stopwords()
+    for tokenizer in nlp.TOKENIZERS:
+        nlp.get_tokenizer(tokenizer)
+
+    results = {}
+    for tokenizer in nlp.TOKENIZERS:
+        tokenize = nlp.get_tokenizer(tokenizer)
+
+        tokenize_time = min(_timed(lambda: [tokenize(text) for text in prepared]) for _ in range(args.repeat))
+        clean_time = min(_timed(lambda: [nlp.clean_text(review, True, True, tokenizer) for review in reviews])
+                            for _ in range(args.repeat))
+
+        cleaned = [nlp.clean_text(review, True, True, tokenizer) for review in reviews]
+        results[tokenizer] = (tokenize_time, clean_time, nlp.vader_scores(cleaned)["compound"])
+
+    base = results["nltk"][2]
+
+    print()
+    print(f"{'tokenizer':<10} {'tokenize':>10} {'clean_text':>11} {'words/s':>10} {'speedup':>8} "
+          f"{'mean |d|':>9} {'max |d|':>8} " + " ".join(f"{'drift@' + str(t):>11}" for t in THRESHOLDS))
+
+    for tokenizer, (tokenize_time, clean_time, compound) in results.items():
+        diff = np.abs(compound - base)
+        drift = [np.mean(nlp.vader_sa_ratings(compound, t) != nlp.vader_sa_ratings(base, t)) * 100 for t in THRESHOLDS]
+
+        print(f"{tokenizer:<10} {tokenize_time:>9.3f}s {clean_time:>10.3f}s {words / clean_time:>10.0f} "
+              f"{results['nltk'][1] / clean_time:>7.1f}x {diff.mean():>9.4f} {diff.max():>8.4f} "
+              + " ".join(f"{d:>10.2f}%" for d in drift))
+
+
+def _timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compares two result files of `benchmarks/suite.py`. For every scenario in both files the change of median latency,
+p99 latency, throughput and peak memory is reported. Exits with an error if median latency or peak memory of any
+scenario grew by more than the threshold.
+
+Usage (from repository root):
+    python benchmarks/compare.py baseline.json results.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+
+def change(base: float, new: float) -> float:
+    """
+    Returns relative change in percent
+    """
+    if not base:
+        return 0.
+    return (new - base) / base * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", help="results of the baseline run")
+    parser.add_argument("results", help="results of the new run")
+    parser.add_argument("--threshold", type=float, default=10, help="allowed growth of latency and memory in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+
+    print(f"baseline : {baseline['meta'].get('commit')} {baseline['meta']['timestamp']}")
+    print(f"results  : {results['meta'].get('commit')} {results['meta']['timestamp']}")
+    print()
+    print(f"{'scenario':<28} {'p50 ms':>19} {'p99 ms':>19} {'items/s':>19} {'peak MB':>17}")
+
+    regressions = []
+    for name, new in results["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<28} new scenario")
+            continue
+
+        p50 = change(base["latency_ms"]["p50"], new["latency_ms"]["p50"])
+        p99 = change(base["latency_ms"]["p99"], new["latency_ms"]["p99"])
+        throughput = change(base["throughput"], new["throughput"])
+        memory = change(base["peak_mem_mb"], new["peak_mem_mb"])
+
+        flag = ""
+        if p50 > args.threshold or memory > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+
+        print(f"{name:<28} {new['latency_ms']['p50']:>10.1f} {p50:>+7.1f}% {new['latency_ms']['p99']:>10.1f} {p99:>+7.1f}% "
+              f"{new['throughput']:>10.0f} {throughput:>+7.1f}% {new['peak_mem_mb']:>8.1f} {memory:>+7.1f}%{flag}")
+
+    print()
+    print(f"FAIL: {', '.join(regressions)}" if regressions else "OK")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Synthetic review corpus and movie data for the benchmarks.
+
+Reviews follow the length distribution of TMDB reviews (log-normal, median about 230 words, a long tail of
+multi-page reviews) and contain contractions, quotes, hyphenated words, punctuation and optionally hyperlinks
+and hashtags.
+"""
+import hashlib
+import random
+
+import numpy as np
+import pandas as pd
+
+SUBJECTS = ["The movie", "This film", "The plot", "The cast", "Her performance", "The ending", "It", "The director",
+            "The soundtrack", "The script", "I", "We", "The first half", "The CGI"]
+VERBS = ["is", "was", "isn't", "wasn't", "felt", "looks", "doesn't feel", "can't be", "would've been", "seemed", "never was"]
+ADJECTIVES = ["great", "good", "bad", "awful", "boring", "amazing", "brilliant", "terrible", "funny", "sad", "slow",
+              "well-made", "over-the-top", "beautiful", "mediocre", "fantastic", "disappointing", "fun", "dull", "perfect"]
+ADVERBS = ["", "", "really", "very", "so", "extremely", "kind of", "a bit", "absolutely", "not", "hardly"]
+CONNECTORS = ["", "", "but", "and", "though", "because", "so"]
+ENDINGS = [".", ".", ".", "!", "!!", "?", "...", "!?"]
+QUOTES = ['"{}"', "'{}'", "({})", "{}"]
+
+
+def make_reviews(n: int, median_words: int = 230, sigma: float = .9, min_words: int = 5, max_words: int = 5000,
+                 url_ratio: float = 0., seed: int = 11):
+    """
+    Generates reviews with TMDB like lengths
+
+    Args:
+        n (int): number of reviews
+        median_words (int, optional): median review length in words. Defaults to 230
+        sigma (float, optional): spread of the log-normal length distribution, larger for more long reviews. Defaults to .9
+        min_words (int, optional): minimum review length. Defaults to 5
+        max_words (int, optional): maximum review length. Defaults to 5000
+        url_ratio (float, optional): share of sentences followed by a hyperlink or hashtag. Defaults to 0
+        seed (int, optional): random seed. Defaults to 11
+    Returns:
+        list: review texts
+    """
+    rnd = random.Random(seed)
+
+    reviews = []
+    for r in range(n):
+        n_words = int(min(max(rnd.lognormvariate(np.log(median_words), sigma), min_words), max_words))
+        sentences, words = [], 0
+        while words < n_words:
+            clause = f"{rnd.choice(SUBJECTS)} {rnd.choice(VERBS)} {rnd.choice(ADVERBS)} {rnd.choice(ADJECTIVES)}"
+            connector = rnd.choice(CONNECTORS)
+            if connector:
+                clause += f", {connector} {rnd.choice(SUBJECTS).lower()} {rnd.choice(VERBS)} {rnd.choice(ADJECTIVES)}"
+            clause = rnd.choice(QUOTES).format(" ".join(clause.split())) + rnd.choice(ENDINGS)
+            if url_ratio > 0 and rnd.random() < url_ratio:
+                clause += rnd.choice([f" https://www.themoviedb.org/review/{r}-{words}\n", f" #movie{words}"])
+            sentences.append(clause)
+            words += len(clause.split())
+        reviews.append(" ".join(sentences))
+
+    return reviews
+
+
+def make_movie_frames(movies: int, reviews_per_movie: int, seed: int = 11, **review_args) -> dict:
+    """
+    Generates popular movies with director, lead actor, reviews and stored scores for all pre-processing variants
+    as DataFrames in the layout of the DB tables
+
+    Args:
+        movies (int): number of movies
+        reviews_per_movie (int): average number of reviews per movie
+        seed (int, optional): random seed. Defaults to 11
+        review_args: arguments of make_reviews
+    Returns:
+        dict: table name to DataFrame mapping
+    """
+    from src import db, utils
+
+    rnd = np.random.default_rng(seed)
+
+    m_ids = np.arange(1, movies + 1) * 7
+    movies_df = pd.DataFrame({
+        "id": m_ids,
+        "title": [f"Movie {m_id}" for m_id in m_ids],
+        "release_date": "2022-06-01",
+        "popularity": rnd.uniform(1, 1000, movies).round(3),
+        "poster_path": [f"/poster{m_id}.jpg" for m_id in m_ids],
+        "genre_names": "Drama, Comedy",
+    })
+    crew_df = pd.DataFrame({"m_id": m_ids, "id": m_ids * 10, "name": [f"Director {m_id}" for m_id in m_ids], "job": "Director"})
+    cast_df = pd.DataFrame({"m_id": np.repeat(m_ids, 3), "id": np.arange(movies * 3), "name": [f"Actor {i}" for i in range(movies * 3)],
+                            "order": np.tile([0, 1, 2], movies)})
+
+    review_m_ids = np.repeat(m_ids, rnd.poisson(reviews_per_movie, movies))
+    contents = make_reviews(len(review_m_ids), seed= seed, **review_args)
+    review_ids = [f"r{i:08d}" for i in range(len(review_m_ids))]
+
+    reviews_df = pd.DataFrame({
+        "m_id": review_m_ids,
+        "id": review_ids,
+        "author_details_username": "user",
+        "content": contents,
+        "content_hash": [hashlib.md5(text.encode("utf-8")).hexdigest() for text in contents],
+        "created_at": "2022-06-01T10:00:00Z",
+    })
+
+    scores_df = pd.concat([
+        pd.DataFrame({
+            "id": review_ids,
+            "m_id": review_m_ids,
+            "stwords": stwords,
+            "hyperlinks": hyperlinks,
+            "compound": rnd.uniform(-1, 1, len(review_ids)).round(4),
+            "pos": .3, "neu": .5, "neg": .2,
+        })
+        for stwords, hyperlinks in utils.SCORE_VARIANTS
+    ], ignore_index= True)
+
+    return {
+        db.MOVIE_TABLE: movies_df,
+        db.M_CREW_TABLE: crew_df,
+        db.M_CAST_TABLE: cast_df,
+        db.M_REVIEW_TABLE: reviews_df,
+        db.M_SCORE_TABLE: scores_df,
+    }
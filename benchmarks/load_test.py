@@ -0,0 +1,128 @@
+"""
+Load test of updates of movies (`utils.update_tmdb_pop_movies_sentiments`) against the local TMDB stand-in
+(`benchmarks/mock_tmdb.py`). A full update is followed by incremental updates, between updates a share of the
+popular movies is replaced and reviews are edited. Every update is reported with its duration, stage timings
+(`src.metrics`), TMDB requests and 429 responses. Posters are fetched from the mock server into a temporary
+poster cache, unless --no-posters is given.
+
+Data is written to the `bench` schema of the DB configured with POSTGRES_* environment variables (or --db),
+the tables of the app are not touched.
+
+Usage (from repository root):
+    python benchmarks/load_test.py --movies 1000 --reviews-per-movie 10 --latency-ms 30 --rate-limit 40 --rounds 3
+    python benchmarks/load_test.py --movies 200 --error-ratio .02 --output load.json
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from src import metrics, posters, tmdbutils, utils  # noqa: E402
+import mock_tmdb  # noqa: E402
+import suite  # noqa: E402
+
+STAGES = ("http_fetch", "http_rate_wait", "http_fetch_image", "json_parse", "clean", "score", "db_read", "db_write", "db_refresh_view")
+
+
+def server_stats(url: str) -> dict:
+    """
+    Returns request counters of a mock server
+    """
+    with urllib.request.urlopen(url.rsplit("/3", 1)[0] + "/__stats") as res:
+        return json.loads(res.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mock_tmdb.add_arguments(parser)
+    parser.add_argument("--rounds", type=int, default=2, help="incremental updates after the full update")
+    parser.add_argument("--churn", type=float, default=.1, help="share of popular movies replaced between updates")
+    parser.add_argument("--edits", type=float, default=.05, help="share of reviews edited between updates")
+    parser.add_argument("--client-rate", type=float, default=tmdbutils.TMDB_RATE_LIMIT, help="requests per second of the client")
+    parser.add_argument("--workers", type=int, default=tmdbutils.TMDB_MAX_WORKERS, help="parallel requests of the client")
+    parser.add_argument("--no-posters", action="store_true", help="do not fetch posters with the updates")
+    parser.add_argument("--url", default=None, help="base url of a running mock server instead of an in-process one")
+    parser.add_argument("--db", default=None, help="SQLAlchemy URL of the DB, defaults to POSTGRES_* environment variables")
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    args = parser.parse_args()
+
+    server = None
+    if args.url is None:
+        server = mock_tmdb.make_server(args).start()
+
+    # client settings are read when a request is made, the session is created with the first request
+    tmdbutils.tmdb_url = args.url or server.url
+    tmdbutils.TMDB_CACHE = False
+    tmdbutils.TMDB_PAGE_LIMIT = math.ceil(args.movies / mock_tmdb.PAGE_SIZE)
+    tmdbutils.TMDB_MAX_WORKERS = args.workers
+    tmdbutils.rate_limiter = tmdbutils.TokenBucket(args.client_rate)
+    tmdbutils.tmdb_image_url = tmdbutils.tmdb_url.rsplit("/3", 1)[0] + "/t/p"
+
+    poster_dir = None
+    posters.POSTER_CACHE = not args.no_posters
+    if posters.POSTER_CACHE:
+        poster_dir = tempfile.mkdtemp(prefix="load_test_posters_")
+        posters.POSTER_CACHE_DIR = poster_dir
+
+    url = args.db or suite.default_url()
+    con = None if url is None else suite.bench_engine(url)
+    if con is None:
+        sys.exit("a DB is needed for the load test, set POSTGRES_* environment variables or --db")
+
+    print(f"mock TMDB api at {tmdbutils.tmdb_url}, {args.movies} movies, latency {args.latency_ms} ms, "
+          f"rate limit {args.rate_limit or 'none'}, client {args.client_rate} requests/s with {args.workers} workers")
+    print()
+    print(f"{'round':<14} {'seconds':>8} {'movies':>7} {'scored':>7} {'rows':>7} {'requests':>9} {'429':>5} {'req/s':>7}  "
+          + " ".join(f"{stage:>15}" for stage in STAGES))
+
+    results = []
+    for round_no in range(args.rounds + 1):
+        incremental = round_no > 0
+
+        if incremental and server is not None:
+            server.fixtures.advance(churn= args.churn, edits= args.edits)
+
+        before = server_stats(tmdbutils.tmdb_url)
+
+        with metrics.recording("refresh") as recorder:
+            utils.update_tmdb_pop_movies_sentiments(con, "mock", incremental= incremental)
+
+        after = server_stats(tmdbutils.tmdb_url)
+
+        snapshot = recorder.snapshot()
+        counters = snapshot["counters"]
+        requests = after["requests"] - before["requests"]
+
+        result = {
+            "round": round_no,
+            "incremental": incremental,
+            "seconds": snapshot["seconds"],
+            "server_requests": requests,
+            "server_rate_limited": after["rate_limited"] - before["rate_limited"],
+            "server_errors": after["errors"] - before["errors"],
+            "metrics": snapshot,
+        }
+        results.append(result)
+
+        name = f"{round_no} {'incremental' if incremental else 'full'}"
+        print(f"{name:<14} {snapshot['seconds']:>8.2f} {counters.get('movies_fetched', 0):>7} {counters.get('reviews_scored', 0):>7} "
+              f"{counters.get('rows_written', 0):>7} {requests:>9} {result['server_rate_limited']:>5} {requests / snapshot['seconds']:>7.1f}  "
+              + " ".join(f"{snapshot['stages'].get(stage, {}).get('seconds', 0):>14.2f}s" for stage in STAGES))
+
+    if poster_dir is not None:
+        shutil.rmtree(poster_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args) | {"db": None}, "rounds": results}, f, indent= 2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
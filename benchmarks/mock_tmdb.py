@@ -0,0 +1,438 @@
+"""
+Local stand-in for the TMDB api, e.g. to load test updates of movies without the real api.
+
+Serves /movie/popular, /genre/movie/list, /movie/{id} (with append_to_response=credits,reviews), /movie/{id}/credits
+and /movie/{id}/reviews from generated fixtures in the response format of TMDB, 20 results per page.
+Generated posters of every size are served at /t/p/{size}/{poster_path} like the TMDB image host.
+Latency, rate limiting of the api with 429 responses and server errors can be injected. Request counters are served
+at /__stats.
+
+Point the app or worker to the server with TMDB_API_URL and TMDB_IMAGE_URL, e.g.
+
+    python benchmarks/mock_tmdb.py --port 8765 --movies 500 --latency-ms 40 --rate-limit 40
+    TMDB_API_URL=http://127.0.0.1:8765/3 TMDB_IMAGE_URL=http://127.0.0.1:8765/t/p TMDB_PAGE_LIMIT=25 python worker.py enqueue --full
+"""
+import argparse
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image, ImageDraw
+
+from corpus import make_reviews
+
+PAGE_SIZE = 20
+
+GENRES = [(28, "Action"), (12, "Adventure"), (16, "Animation"), (35, "Comedy"), (80, "Crime"), (18, "Drama"),
+          (14, "Fantasy"), (27, "Horror"), (9648, "Mystery"), (10749, "Romance"), (878, "Science Fiction"), (53, "Thriller")]
+
+CREW_JOBS = [("Director", "Directing"), ("Screenplay", "Writing"), ("Producer", "Production"),
+             ("Original Music Composer", "Sound"), ("Director of Photography", "Camera"), ("Editor", "Editing")]
+
+
+class Fixtures:
+    """
+    Generated popular movies with credits and reviews. Responses are generated on first request and kept.
+    """
+
+    def __init__(self, movies:int = 100, reviews_per_movie:float = 8, cast_size:int = 15, crew_size:int = 30,
+                 median_words:int = 230, url_ratio:float = .05, seed:int = 11):
+        """
+        Args:
+            movies (int, optional): number of popular movies. Defaults to 100
+            reviews_per_movie (float, optional): average reviews per movie, some movies have none. Defaults to 8
+            cast_size (int, optional): cast members per movie. Defaults to 15
+            crew_size (int, optional): crew members per movie. Defaults to 30
+            median_words (int, optional): median review length in words. Defaults to 230
+            url_ratio (float, optional): share of review sentences followed by a hyperlink. Defaults to .05
+            seed (int, optional): random seed. Defaults to 11
+        """
+        self.reviews_per_movie = reviews_per_movie
+        self.cast_size = cast_size
+        self.crew_size = crew_size
+        self.review_args = {"median_words": median_words, "url_ratio": url_ratio}
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.next_id = 1000
+        self.popular = [self._new_movie() for _ in range(movies)]
+        self.reviews = {}
+
+    def _new_movie(self) -> dict:
+        self.next_id += self.rnd.randint(1, 50)
+        m_id = self.next_id
+
+        return {
+            "adult": False,
+            "backdrop_path": f"/backdrop{m_id}.jpg",
+            "genre_ids": self.rnd.sample([genre_id for genre_id, _ in GENRES], self.rnd.randint(1, 3)),
+            "id": m_id,
+            "original_language": "en",
+            "original_title": f"Movie {m_id}",
+            "overview": f"Overview of movie {m_id}.",
+            "popularity": round(self.rnd.uniform(10, 5000), 3),
+            "poster_path": f"/poster{m_id}.jpg",
+            "release_date": f"20{self.rnd.randint(10, 22)}-{self.rnd.randint(1, 12):02d}-{self.rnd.randint(1, 28):02d}",
+            "title": f"Movie {m_id}",
+            "video": False,
+            "vote_average": round(self.rnd.uniform(3, 9), 1),
+            "vote_count": self.rnd.randint(0, 20000),
+        }
+
+    def advance(self, churn:float = .1, edits:float = .05):
+        """
+        Simulates the next day: a share of popular movies is replaced with new ones, popularity changes
+        and a share of the reviews is edited
+
+        Args:
+            churn (float, optional): share of popular movies replaced. Defaults to .1
+            edits (float, optional): share of reviews edited. Defaults to .05
+        """
+        with self.lock:
+            for i in self.rnd.sample(range(len(self.popular)), int(len(self.popular) * churn)):
+                self.popular[i] = self._new_movie()
+
+            for movie in self.popular:
+                movie["popularity"] = round(movie["popularity"] * self.rnd.uniform(.8, 1.2), 3)
+
+            for m_id, reviews in self.reviews.items():
+                for review in reviews:
+                    if self.rnd.random() < edits:
+                        review["content"] += " Edit: changed my mind, it was not that good."
+                        review["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+
+    def popular_page(self, page:int) -> dict:
+        with self.lock:
+            movies = sorted(self.popular, key= lambda movie: -movie["popularity"])
+
+        return _page(movies, page)
+
+    def details(self, m_id:int, append:list) -> dict:
+        with self.lock:
+            movie = next((dict(movie) for movie in self.popular if movie["id"] == m_id), {"id": m_id, "title": f"Movie {m_id}"})
+
+        movie["genres"] = [{"id": genre_id, "name": name} for genre_id, name in GENRES if genre_id in movie.pop("genre_ids", [])]
+        movie.update({"budget": 0, "revenue": 0, "runtime": 120, "status": "Released", "tagline": ""})
+
+        if "credits" in append:
+            movie["credits"] = {key: value for key, value in self.credits(m_id).items() if key != "id"}
+        if "reviews" in append:
+            movie["reviews"] = {key: value for key, value in self.reviews_page(m_id, 1).items() if key != "id"}
+
+        return movie
+
+    def credits(self, m_id:int) -> dict:
+        rnd = random.Random(m_id)
+
+        cast = [{
+                "adult": False,
+                "gender": rnd.randint(0, 2),
+                "id": m_id * 100 + i,
+                "known_for_department": "Acting",
+                "name": f"Actor {m_id}-{i}",
+                "original_name": f"Actor {m_id}-{i}",
+                "popularity": round(rnd.uniform(1, 100), 3),
+                "profile_path": f"/profile{m_id}{i}.jpg",
+                "cast_id": i + 1,
+                "character": f"Character {i}",
+                "credit_id": f"cast{m_id}{i}",
+                "order": i,
+            } for i in range(self.cast_size)]
+
+        crew = [{
+                "adult": False,
+                "gender": rnd.randint(0, 2),
+                "id": m_id * 1000 + i,
+                "known_for_department": CREW_JOBS[i % len(CREW_JOBS)][1],
+                "name": f"Crew {m_id}-{i}",
+                "original_name": f"Crew {m_id}-{i}",
+                "popularity": round(rnd.uniform(1, 20), 3),
+                "profile_path": None,
+                "credit_id": f"crew{m_id}{i}",
+                "department": CREW_JOBS[i % len(CREW_JOBS)][1],
+                "job": CREW_JOBS[i % len(CREW_JOBS)][0],
+            } for i in range(self.crew_size)]
+
+        return {"id": m_id, "cast": cast, "crew": crew}
+
+    def reviews_page(self, m_id:int, page:int) -> dict:
+        with self.lock:
+            if m_id not in self.reviews:
+                rnd = random.Random(m_id)
+                # a third of the movies has no reviews, like on TMDB
+                count = 0 if rnd.random() < .3 else max(1, int(rnd.expovariate(1 / (self.reviews_per_movie * 1.5))))
+
+                self.reviews[m_id] = [{
+                        "author": f"author{m_id}{i}",
+                        "author_details": {
+                            "name": "",
+                            "username": f"user{m_id}{i}",
+                            "avatar_path": None,
+                            "rating": rnd.choice([None, float(rnd.randint(1, 10))]),
+                        },
+                        "content": content,
+                        "created_at": f"2022-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}T10:00:00.000Z",
+                        "id": f"{m_id:08x}{i:016x}",
+                        "updated_at": "2022-10-01T10:00:00.000Z",
+                        "url": f"https://www.themoviedb.org/review/{m_id:08x}{i:016x}",
+                    } for i, content in enumerate(make_reviews(count, seed= m_id, **self.review_args))]
+
+            reviews = [dict(review) for review in self.reviews[m_id]]
+
+        return {"id": m_id, **_page(reviews, page)}
+
+
+def _page(results:list, page:int) -> dict:
+    total_pages = math.ceil(len(results) / PAGE_SIZE)
+
+    return {
+        "page": page,
+        "results": results[(page - 1) * PAGE_SIZE: page * PAGE_SIZE],
+        "total_pages": total_pages,
+        "total_results": len(results),
+    }
+
+
+class MockTMDB(ThreadingHTTPServer):
+    """
+    Threaded http server for the TMDB stand-in with injected latency, rate limit and errors
+    """
+    daemon_threads = True
+
+    def __init__(self, address:tuple, fixtures: Fixtures, latency_ms:float = 0, jitter_ms:float = 0,
+                 rate_limit:float = 0, error_ratio:float = 0, seed:int = 11):
+        """
+        Args:
+            address (tuple): (host, port) to listen on, port 0 for a free port
+            fixtures (Fixtures): served data
+            latency_ms (float, optional): added latency per response. Defaults to 0
+            jitter_ms (float, optional): maximum random latency added on top. Defaults to 0
+            rate_limit (float, optional): requests per second before 429 responses, 0 for no limit. Defaults to 0
+            error_ratio (float, optional): share of requests answered with 503. Defaults to 0
+            seed (int, optional): random seed of jitter and errors. Defaults to 11
+        """
+        super().__init__(address, MockHandler)
+        self.fixtures = fixtures
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit = rate_limit
+        self.error_ratio = error_ratio
+        self.rnd = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.tokens = rate_limit
+        self.updated = time.monotonic()
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0, "endpoints": {}}
+
+    @property
+    def url(self) -> str:
+        """
+        Base url to use as TMDB_API_URL
+        """
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/3"
+
+    @property
+    def image_url(self) -> str:
+        """
+        Base url to use as TMDB_IMAGE_URL
+        """
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/t/p"
+
+    def admit(self) -> bool:
+        """
+        Takes a token of the rate limit, False if the request is over the limit
+        """
+        if not self.rate_limit:
+            return True
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.updated) * self.rate_limit)
+            self.updated = now
+
+            if self.tokens < 1:
+                self.stats["rate_limited"] += 1
+                return False
+
+            self.tokens -= 1
+            return True
+
+    def count(self, endpoint:str):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["endpoints"][endpoint] = self.stats["endpoints"].get(endpoint, 0) + 1
+
+    def start(self) -> "MockTMDB":
+        """
+        Serves requests from a daemon thread
+        """
+        threading.Thread(target= self.serve_forever, name= "mock-tmdb", daemon= True).start()
+        return self
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    ROUTES = [
+        (re.compile(r"^/3/movie/popular$"), "popular"),
+        (re.compile(r"^/3/genre/movie/list$"), "genres"),
+        (re.compile(r"^/3/movie/(\d+)$"), "details"),
+        (re.compile(r"^/3/movie/(\d+)/credits$"), "credits"),
+        (re.compile(r"^/3/movie/(\d+)/reviews$"), "reviews"),
+        (re.compile(r"^/t/p/(\w+)/([\w.-]+)$"), "image"),
+    ]
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+
+        if url.path == "/__stats":
+            return self.send_json(200, server.stats)
+
+        for pattern, endpoint in self.ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            return self.send_json(404, {"success": False, "status_code": 34, "status_message": "The resource you requested could not be found."})
+
+        server.count(endpoint)
+
+        delay = server.latency_ms + server.rnd.uniform(0, server.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        # the image host is not rate limited
+        if endpoint != "image" and not server.admit():
+            return self.send_json(429, {"status_code": 25, "status_message": "Your request count is over the allowed limit."},
+                                  headers= {"Retry-After": "1"})
+
+        if server.error_ratio and server.rnd.random() < server.error_ratio:
+            with server.lock:
+                server.stats["errors"] += 1
+            return self.send_json(503, {"status_code": 11, "status_message": "Internal error: Something went wrong, contact TMDb."})
+
+        if endpoint == "image":
+            return self.send_image(poster_image(match.group(2), match.group(1)))
+
+        query = parse_qs(url.query)
+        page = int(query.get("page", ["1"])[0])
+        if not 1 <= page <= 500:
+            return self.send_json(422, {"errors": ["page must be less than or equal to 500"]})
+
+        fixtures = server.fixtures
+
+        if endpoint == "popular":
+            body = fixtures.popular_page(page)
+        elif endpoint == "genres":
+            body = {"genres": [{"id": genre_id, "name": name} for genre_id, name in GENRES]}
+        elif endpoint == "details":
+            body = fixtures.details(int(match.group(1)), query.get("append_to_response", [""])[0].split(","))
+        elif endpoint == "credits":
+            body = fixtures.credits(int(match.group(1)))
+        else:
+            body = fixtures.reviews_page(int(match.group(1)), page)
+
+        self.send_json(200, body)
+
+    def send_json(self, status:int, body:dict, headers:dict = None):
+        data = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_image(self, data:bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def poster_image(name:str, size:str) -> bytes:
+    """
+    Returns generated JPEG poster of an image size of TMDB e.g. w500 or w600_and_h900_bestv2, 2:3 unless both
+    width and height are given. Posters of the same name have the same colors.
+    """
+    width_match = re.search(r"w(\d+)", size)
+    height_match = re.search(r"h(\d+)", size)
+
+    # original posters of TMDB are about 2000 pixels high
+    width = int(width_match.group(1)) if width_match else 1333
+    height = int(height_match.group(1)) if height_match else width * 3 // 2
+
+    rnd = random.Random(zlib.crc32(name.encode("utf-8")))
+    img = Image.new("RGB", (width, height), tuple(rnd.randrange(256) for _ in range(3)))
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        draw.ellipse((x, y, x + rnd.randrange(width // 2), y + rnd.randrange(height // 2)),
+                     fill= tuple(rnd.randrange(256) for _ in range(3)))
+    draw.text((width // 10, height * 4 // 5), name, fill= (255, 255, 255))
+
+    output = io.BytesIO()
+    img.save(output, "JPEG", quality= 90)
+
+    return output.getvalue()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds fixture and fault injection arguments of the mock server to a parser
+    """
+    parser.add_argument("--movies", type=int, default=100, help="number of popular movies")
+    parser.add_argument("--reviews-per-movie", type=float, default=8, help="average reviews per movie")
+    parser.add_argument("--median-words", type=int, default=230, help="median review length in words")
+    parser.add_argument("--latency-ms", type=float, default=0, help="latency added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="maximum random latency added on top")
+    parser.add_argument("--rate-limit", type=float, default=0, help="requests per second before 429 responses, 0 for no limit")
+    parser.add_argument("--error-ratio", type=float, default=0, help="share of requests answered with 503")
+    parser.add_argument("--seed", type=int, default=11, help="random seed of the fixtures")
+
+
+def make_server(args: argparse.Namespace, host:str = "127.0.0.1", port:int = 0) -> MockTMDB:
+    """
+    Creates mock server from parsed arguments, see add_arguments
+    """
+    fixtures = Fixtures(movies= args.movies, reviews_per_movie= args.reviews_per_movie, median_words= args.median_words, seed= args.seed)
+
+    return MockTMDB((host, port), fixtures, latency_ms= args.latency_ms, jitter_ms= args.jitter_ms,
+                    rate_limit= args.rate_limit, error_ratio= args.error_ratio, seed= args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(args, args.host, args.port)
+    print(f"mock TMDB api at {server.url}, {args.movies} popular movies in {math.ceil(args.movies / PAGE_SIZE)} pages")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Benchmark suite for the NLP and DB hot paths. Every scenario is timed over several runs and reported with
+throughput, latency percentiles and peak Python memory. Results are written as JSON, so that runs can be
+compared with `benchmarks/compare.py`.
+
+NLP scenarios run on a generated review corpus (`corpus.make_reviews`). DB scenarios load generated movies,
+reviews and scores into a separate `bench` schema of the DB configured with POSTGRES_* environment variables
+(or --db), the tables of the app are not touched. DB scenarios are skipped if the DB is not reachable.
+With --snapshot, all scenarios run on the reviews and movies of a snapshot (`src/snapshot.py`) instead,
+so that runs on different machines and commits use the same dataset.
+
+Usage (from repository root):
+    python benchmarks/suite.py --reviews 2000 --movies 100 --output results.json
+    python benchmarks/suite.py --scenarios clean_text,get_movies_overview --repeat 10
+    python benchmarks/suite.py --snapshot app/.cache/snapshots/snapshot-20221001T120000Z-v42 --output results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from src import cache, db, nlp, snapshot, utils  # noqa: E402
+import corpus  # noqa: E402
+
+BENCH_SCHEMA = "bench"
+
+PERCENTILES = (50, 90, 99)
+
+
+def nlp_scenarios(reviews: list) -> dict:
+    """
+    Returns NLP scenarios as name to (items per run, function) mapping
+    """
+    cleaned = [nlp.clean_text(review, True, True) for review in reviews]
+
+    return {
+        "get_vsa_value": (len(cleaned), lambda: [nlp.get_vsa_value(text) for text in cleaned]),
+        "clean_text": (len(reviews), lambda: [nlp.clean_text(review, True, True) for review in reviews]),
+        "clean_text_regex": (len(reviews), lambda: [nlp.clean_text(review, True, True, "regex") for review in reviews]),
+        "score_batch_nltk": (len(reviews), lambda: nlp.score_batch(reviews, engine= "nltk")),
+        "score_batch_numpy": (len(reviews), lambda: nlp.score_batch(reviews, engine= "numpy")),
+    }
+
+
+def db_scenarios(con, frames: dict) -> dict:
+    """
+    Returns DB scenarios as name to (items per run, function) mapping. Data is loaded before the scenarios run.
+    """
+    reviews_df = frames[db.M_REVIEW_TABLE]
+    scores_df = frames[db.M_SCORE_TABLE]
+    m_ids = frames[db.MOVIE_TABLE]["id"].tolist()
+
+    db.bulk_load(frames, con)
+    db.refresh_overview(con)
+
+    variant_scores = scores_df[scores_df["stwords"] & scores_df["hyperlinks"]]
+
+    def rescore():
+        # scores of one variant are removed, so that update_review_scores scores all reviews again
+        con.execute(f"delete from {db.M_SCORE_TABLE} where stwords and hyperlinks")
+        utils.clean_text_cache.clear()
+        utils.update_review_scores(con)
+
+    def overview_cached():
+        cache.invalidate()
+        utils.get_movies_overview(con)
+        for _ in range(99):
+            utils.get_movies_overview(con)
+
+    return {
+        "bulk_load_reviews": (len(reviews_df), lambda: db.bulk_load({db.M_REVIEW_TABLE: reviews_df}, con)),
+        "bulk_load_scores": (len(variant_scores), lambda: db.bulk_load(
+                                {db.M_SCORE_TABLE: variant_scores}, con, keys= {db.M_SCORE_TABLE: ["id", "stwords", "hyperlinks"]})),
+        # df_toPG copies in text format, review texts with line breaks can not be loaded with it
+        "df_toPG": (len(scores_df), lambda: utils.df_toPG(scores_df, "t_bench_df_topg", con)),
+        "update_review_scores": (len(reviews_df), rescore),
+        "get_movies_overview": (len(m_ids), lambda: utils.get_movies_overview.__wrapped__(con)),
+        "get_movies_overview_cached": (100, overview_cached),
+        "get_movie_reviews": (len(m_ids), lambda: [utils.get_movie_reviews.__wrapped__(m_id, con) for m_id in m_ids]),
+        "get_movie_reviews_page": (len(m_ids), lambda: [utils.get_movie_reviews_page.__wrapped__(m_id, con) for m_id in m_ids]),
+    }
+
+
+def bench_engine(url: str):
+    """
+    Creates SQLAlchemy engine for the bench schema and applies the migrations. Returns None if the DB is not reachable.
+    """
+    try:
+        with sa.create_engine(url).begin() as admin_con:
+            admin_con.execute(f"create schema if not exists {BENCH_SCHEMA}")
+    except sa.exc.OperationalError as e:
+        print(f"DB not reachable, DB scenarios are skipped: {e.orig}".strip())
+        return None
+
+    con = sa.create_engine(url, connect_args= {"options": f"-csearch_path={BENCH_SCHEMA}"})
+    db.migrate(con)
+
+    return con
+
+
+def measure(func, items: int, repeat: int, warmup: int = 1) -> dict:
+    """
+    Runs func repeat times and returns latency, throughput and peak memory of the runs.
+    Memory is traced in a separate run, so that tracing does not slow down the timed runs.
+
+    Args:
+        func (callable): scenario
+        items (int): items processed per run
+        repeat (int): timed runs
+        warmup (int, optional): untimed runs before the measurements. Defaults to 1
+    Returns:
+        dict: measurements
+    """
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = np.array(latencies) * 1000
+
+    return {
+        "items": items,
+        "runs": repeat,
+        "latency_ms": {
+            **{f"p{p}": round(float(np.percentile(latencies, p)), 3) for p in PERCENTILES},
+            "mean": round(float(latencies.mean()), 3),
+            "min": round(float(latencies.min()), 3),
+            "max": round(float(latencies.max()), 3),
+        },
+        "throughput": round(items / (np.median(latencies) / 1000), 1),
+        "peak_mem_mb": round(peak / 2 ** 20, 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def default_url() -> str:
+    if "POSTGRES_HOST" not in os.environ:
+        return None
+    return db.engine_from_env().url.render_as_string(hide_password= False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", type=int, default=2000, help="number of generated reviews for NLP scenarios")
+    parser.add_argument("--movies", type=int, default=100, help="number of generated movies for DB scenarios")
+    parser.add_argument("--reviews-per-movie", type=int, default=20, help="average reviews per generated movie")
+    parser.add_argument("--median-words", type=int, default=230, help="median review length in words")
+    parser.add_argument("--url-ratio", type=float, default=.05, help="share of review sentences followed by a hyperlink")
+    parser.add_argument("--snapshot", default=None, help="snapshot to take reviews and movies from instead of generating them")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per scenario")
+    parser.add_argument("--scenarios", default=None, help="comma separated scenarios to run, all by default")
+    parser.add_argument("--db", default=None, help="SQLAlchemy URL of the DB, defaults to POSTGRES_* environment variables")
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    args = parser.parse_args()
+
+    selected = None if args.scenarios is None else set(args.scenarios.split(","))
+    review_args = {"median_words": args.median_words, "url_ratio": args.url_ratio}
+
+    # load resources outside of the measurements
+    nlp.get_analyzer()
+    nlp.get_stopwords()
+    for tokenizer in nlp.TOKENIZERS:
+        nlp.get_tokenizer(tokenizer)
+
+    manifest = None
+    if args.snapshot:
+        manifest, frames = snapshot.read_snapshot(args.snapshot)
+        reviews = frames[db.M_REVIEW_TABLE]["content"].dropna().head(args.reviews).tolist()
+    else:
+        reviews = corpus.make_reviews(args.reviews, **review_args)
+
+    scenarios = nlp_scenarios(reviews)
+
+    url = args.db or default_url()
+    con = None if url is None else bench_engine(url)
+    if con is not None:
+        if manifest is None:
+            frames = corpus.make_movie_frames(args.movies, args.reviews_per_movie, **review_args)
+        scenarios.update(db_scenarios(con, frames))
+    elif url is None:
+        print("no DB configured, DB scenarios are skipped")
+
+    results = {}
+    print(f"{'scenario':<28} {'items':>7} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'items/s':>10} {'peak MB':>8}")
+
+    for name, (items, func) in scenarios.items():
+        if selected is not None and name not in selected:
+            continue
+
+        result = measure(func, items, args.repeat)
+        results[name] = result
+
+        latency = result["latency_ms"]
+        print(f"{name:<28} {items:>7} {latency['p50']:>10.1f} {latency['p90']:>10.1f} {latency['p99']:>10.1f} "
+              f"{result['throughput']:>10.0f} {result['peak_mem_mb']:>8.1f}")
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec= "seconds"),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "args": vars(args) | {"db": None},
+                "nlp_engine": nlp.NLP_ENGINE,
+                "nlp_tokenizer": nlp.NLP_TOKENIZER,
+                "snapshot": None if manifest is None else {
+                    "created_at": manifest["created_at"],
+                    "data_version": manifest["data_version"],
+                    "rows": {table_name: table["rows"] for table_name, table in manifest["tables"].items()},
+                },
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent= 2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Conformance check of the vectorized vader engine (`nlp.vader_scores`) against nltk `SentimentIntensityAnalyzer`.
+Scores of a review corpus are compared for every text and pre-processing variant and the throughput of both engines
+is reported. Exits with an error if any score differs by more than the tolerance.
+
+The corpus is generated with words that trigger the vader rules: lexicon words, boosters and dampeners, negations,
+words in caps, "but", "least", idioms, emoticons and punctuation. Reviews stored in the DB can be checked as well.
+
+Usage (from repository root):
+    python benchmarks/vader_conformance.py --reviews 5000 --tolerance 1e-3
+    python benchmarks/vader_conformance.py --from-db
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from src import nlp  # noqa: E402
+
+RULE_WORDS = """but but BUT least at least very least never so this never this not isn't don't aint without nothing
+            kind of sort of kinda just enough the shit the bomb bad ass yeah right cut the mustard kiss of death
+            hand to mouth very really extremely barely hardly slightly VERY EXTREMELY""".split()
+FILLER_WORDS = """the movie film story plot actor scene director and was is a of to it this that with for
+            performance script ending music visual""".split()
+EMOTICONS = [":)", ":(", ":-)", ":D", "<3", ";)", ":'("]
+PUNCTUATION = ["", "", "", ".", ",", "!", "!!", "?", "??", "...", "!?!", ":", "'"]
+
+
+def make_corpus(n: int, seed: int = 7):
+    """
+    Generates reviews that exercise the vader rules
+    """
+    rnd = random.Random(seed)
+    lexicon_words = sorted(word for word in nlp.get_vader_tables()["lexicon"] if word.isalpha())
+
+    reviews = []
+    for _ in range(n):
+        words = []
+        for _ in range(rnd.randint(0, 120)):
+            pick = rnd.random()
+            if pick < .3:
+                word = rnd.choice(lexicon_words)
+            elif pick < .55:
+                word = rnd.choice(RULE_WORDS)
+            elif pick < .6:
+                word = rnd.choice(EMOTICONS)
+            else:
+                word = rnd.choice(FILLER_WORDS)
+
+            if rnd.random() < .08:
+                word = word.upper()
+            elif rnd.random() < .1:
+                word = word.capitalize()
+
+            if rnd.random() < .15:
+                word = rnd.choice(PUNCTUATION) + word
+            if rnd.random() < .3:
+                word = word + rnd.choice(PUNCTUATION)
+
+            words.append(word)
+        reviews.append(" ".join(words))
+
+    return reviews
+
+
+def read_db_reviews():
+    """
+    Reads stored review texts from the DB configured with POSTGRES_* environment variables
+    """
+    from src import db
+
+    return [row[0] for row in db.engine_from_env().execute(f"select content from {db.M_REVIEW_TABLE}")]
+
+
+def nltk_scores(texts):
+    sa = nlp.get_analyzer()
+    scores = [sa.polarity_scores(text) for text in texts]
+    return {key: np.array([s[key] for s in scores], dtype=float) for key in nlp.SCORE_KEYS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", type=int, default=5000, help="number of generated reviews")
+    parser.add_argument("--from-db", action="store_true", help="check reviews stored in the DB instead of generated ones")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="maximum absolute difference of any score")
+    args = parser.parse_args()
+
+    corpus = read_db_reviews() if args.from_db else make_corpus(args.reviews)
+
+    failed = False
+    for stwords, hyperlinks, keep_raw in [(False, False, True), (True, True, False), (False, True, False)]:
+        texts = corpus if keep_raw else [nlp.clean_text(text, stwords, hyperlinks) for text in corpus]
+
+        # load lexicon and tables outside of the measurements
+        nlp.vader_scores(texts[:10])
+
+        start = time.perf_counter()
+        expected = nltk_scores(texts)
+        nltk_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = nlp.vader_scores(texts)
+        numpy_time = time.perf_counter() - start
+
+        variant = "raw text" if keep_raw else f"stwords={stwords}, hyperlinks={hyperlinks}"
+        print(f"{variant} ({len(texts)} reviews)")
+
+        for key in nlp.SCORE_KEYS:
+            diff = np.abs(actual[key] - expected[key])
+            mismatches = np.flatnonzero(diff > args.tolerance)
+            print(f"  {key:<8} : max diff {diff.max(initial=0):.2e}, {len(mismatches)} over tolerance")
+
+            for i in mismatches[:3]:
+                print(f"    nltk {expected[key][i]:.4f} numpy {actual[key][i]:.4f} : {texts[i][:200]!r}")
+
+            failed |= len(mismatches) > 0
+
+        ratings = nlp.vader_sa_ratings(actual["compound"]) != nlp.vader_sa_ratings(expected["compound"])
+        print(f"  ratings  : {ratings.sum()} differ")
+        print(f"  nltk     : {nltk_time:.2f} s ({len(texts) / nltk_time:.0f} reviews/s)")
+        print(f"  numpy    : {numpy_time:.2f} s ({len(texts) / numpy_time:.0f} reviews/s), {nltk_time / numpy_time:.1f}x")
+
+    print("FAIL" if failed else "OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()